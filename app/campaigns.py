@@ -0,0 +1,168 @@
+# app/campaigns.py
+# Campanhas de envio em massa (ex.: "enviar instruções" para a lista da clínica).
+# A requisição só grava a campanha + destinatários e enfileira um job; o envio
+# roda nos workers, em paralelo, sob um token bucket por número de WhatsApp que
+# fica no banco (send_rates), compartilhado por todos os processos.
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import update, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import jobs
+from .models import Campaign, CampaignRecipient, Patient, SendRate
+from .search import filter_patients
+from .settings import settings
+from .whatsapp import send_template_message
+
+
+def take_tokens(db: Session, want: int) -> Tuple[int, float]:
+    """
+    Tira até `want` fichas do token bucket do número (linha de send_rates).
+    O bucket fica no banco porque o envio roda no web (JOB_RUN_IN_APP) e em
+    cada processo de worker; um bucket em memória multiplicaria a taxa.
+    Devolve (fichas concedidas, segundos até a próxima ficha se nenhuma saiu).
+    """
+    rate, burst = settings.CAMPAIGN_RATE_PER_S, float(settings.CAMPAIGN_BURST)
+    key = f"wa:{settings.WHATSAPP_PHONE_NUMBER_ID or '-'}"
+    while True:
+        row = db.query(SendRate).filter(SendRate.key == key).with_for_update().one_or_none()
+        now = time.time()
+        if row is None:
+            db.add(SendRate(key=key, tokens=burst, updated_at=now))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()  # outro processo criou a linha ao mesmo tempo
+            continue
+        tokens = min(burst, row.tokens + max(0.0, now - row.updated_at) * rate)
+        granted = min(want, int(tokens))
+        # update condicional, como em jobs.claim: no SQLite o FOR UPDATE não existe
+        res = db.execute(
+            update(SendRate)
+              .where(SendRate.key == key, SendRate.tokens == row.tokens, SendRate.updated_at == row.updated_at)
+              .values(tokens=tokens - granted, updated_at=now)
+              .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        if res.rowcount == 1:
+            return granted, (0.0 if granted else (1.0 - tokens) / rate)
+
+
+def create_campaign(db: Session, template_name: str, lang: str = "pt_BR",
+                    patient_ids: Optional[List[int]] = None, q: Optional[str] = None) -> Campaign:
+    """Cria a campanha a partir de ids explícitos ou de um filtro de busca e enfileira o envio."""
+    qry = db.query(Patient.id, Patient.whatsapp)
+    if patient_ids:
+        qry = qry.filter(Patient.id.in_(patient_ids))
+    else:
+        qry = filter_patients(qry, q)
+    rows = qry.order_by(Patient.id).all()
+
+    campaign = Campaign(template_name=template_name, lang=lang, status="queued", total=len(rows))
+    db.add(campaign)
+    db.flush()
+    db.bulk_insert_mappings(CampaignRecipient, [
+        {"campaign_id": campaign.id, "patient_id": pid, "whatsapp": wa, "status": "pending"}
+        for pid, wa in rows
+    ])
+    jobs.enqueue(db, "campaign_dispatch", {"campaign_id": campaign.id}, commit=False)
+    db.commit()
+    db.refresh(campaign)
+    return campaign
+
+
+def _send_one(template_name: str, lang: str, to_whatsapp: str) -> Optional[str]:
+    try:
+        send_template_message(to_whatsapp=to_whatsapp, template_name=template_name, lang=lang)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"[:2000]
+    return None
+
+
+@jobs.handler("campaign_dispatch")
+def dispatch_campaign_job(db: Session, payload: dict):
+    dispatch_campaign(db, payload["campaign_id"])
+
+
+def dispatch_campaign(db: Session, campaign_id: int) -> None:
+    """
+    Envia até CAMPAIGN_SLICE destinatários pendentes e, se sobrar, reenfileira.
+    Só destinatários "pending" são enviados, então um retry do job não reenvia.
+    """
+    campaign = db.get(Campaign, campaign_id)
+    if campaign is None or campaign.status == "done":
+        return
+    if campaign.status == "queued":
+        campaign.status = "running"
+        db.commit()
+
+    pending = (
+        db.query(CampaignRecipient.id, CampaignRecipient.whatsapp)
+          .filter(CampaignRecipient.campaign_id == campaign_id, CampaignRecipient.status == "pending")
+          .order_by(CampaignRecipient.id)
+          .limit(settings.CAMPAIGN_SLICE)
+          .all()
+    )
+    template_name, lang = campaign.template_name, campaign.lang
+
+    # só as chamadas HTTP vão para as threads; a Session (e as fichas do bucket)
+    # ficam nesta thread, e só se pede ficha para o que cabe no pool agora
+    with ThreadPoolExecutor(max_workers=settings.CAMPAIGN_CONCURRENCY) as pool:
+        inflight = {}
+        sent_ids, failed = [], []
+        i = 0
+        while i < len(pending) or inflight:
+            free = min(settings.CAMPAIGN_CONCURRENCY - len(inflight), len(pending) - i)
+            wait_s = 0.0
+            if free:
+                granted, wait_s = take_tokens(db, free)
+                for rid, wa in pending[i:i + granted]:
+                    inflight[pool.submit(_send_one, template_name, lang, wa)] = rid
+                i += granted
+            if not inflight:
+                time.sleep(wait_s)
+                continue
+            done, _ = wait(inflight, timeout=wait_s or None, return_when=FIRST_COMPLETED)
+            for fut in done:
+                rid = inflight.pop(fut)
+                err = fut.result()
+                if err is None:
+                    sent_ids.append(rid)
+                else:
+                    failed.append((rid, err))
+            # grava o progresso em lotes para a tela de acompanhamento andar
+            if len(sent_ids) + len(failed) >= 50:
+                _record(db, campaign_id, sent_ids, failed)
+                sent_ids, failed = [], []
+        _record(db, campaign_id, sent_ids, failed)
+
+    remaining = (
+        db.query(func.count(CampaignRecipient.id))
+          .filter(CampaignRecipient.campaign_id == campaign_id, CampaignRecipient.status == "pending")
+          .scalar()
+    )
+    if remaining:
+        jobs.enqueue(db, "campaign_dispatch", {"campaign_id": campaign_id})
+    else:
+        db.execute(update(Campaign).where(Campaign.id == campaign_id)
+                   .values(status="done", finished_at=datetime.utcnow()))
+        db.commit()
+
+
+def _record(db: Session, campaign_id: int, sent_ids: List[int], failed: List[tuple]) -> None:
+    if not sent_ids and not failed:
+        return
+    now = datetime.utcnow()
+    if sent_ids:
+        db.execute(update(CampaignRecipient).where(CampaignRecipient.id.in_(sent_ids))
+                   .values(status="sent", sent_at=now))
+    for rid, err in failed:
+        db.execute(update(CampaignRecipient).where(CampaignRecipient.id == rid)
+                   .values(status="failed", error=err))
+    db.execute(update(Campaign).where(Campaign.id == campaign_id)
+               .values(sent=Campaign.sent + len(sent_ids), failed=Campaign.failed + len(failed)))
+    db.commit()
@@ -0,0 +1,294 @@
+# app/cpu_pool.py
+# Pool de processos para o trabalho de CPU do exame (decodificação, análise e
+# laudo). Nas threads do worker isso segura o GIL e atrasa os outros exames do
+# lote e, com JOB_RUN_IN_APP, as rotas do próprio web.
+#   - processos "spawn" aquecidos no start(): numpy, reportlab e o layout do
+#     laudo são carregados uma vez por processo, não no primeiro exame
+#   - cada processo é trocado depois de CPU_POOL_MAX_TASKS_PER_CHILD tarefas
+#     (limita o crescimento de memória)
+#   - backpressure: no máximo CPU_POOL_MAX_PENDING tarefas em voo; quem passa
+#     disso espera até CPU_POOL_SUBMIT_TIMEOUT_S e recebe PoolBusy
+#   - timeout por tarefa, contado de quando ela começa a rodar no processo (o
+#     início vai num array compartilhado; o running() do Future já vale com a
+#     tarefa parada na fila de chamadas): o pool é recriado e os processos
+#     antigos são mortos (tarefas de outras threads neles recebem BrokenProcessPool)
+#   - áudio em disco vai para o processo pelo caminho (media.SpooledFile, o filho
+#     faz o próprio mmap); só a mídia pequena, em memória, é copiada
+#   - health check periódico: pool quebrado ou parado sem responder é recriado
+# CPU_POOL_WORKERS=0 desliga o pool: as tarefas rodam na thread de quem chama.
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional, Tuple
+
+from . import metrics
+from .media import shared_view
+from .settings import settings
+
+
+class PoolBusy(Exception):
+    """Fila do pool cheia por mais de CPU_POOL_SUBMIT_TIMEOUT_S (tente mais tarde)."""
+
+
+class TaskTimeout(Exception):
+    """Tarefa passou de CPU_POOL_TASK_TIMEOUT_S (o processo foi morto)."""
+
+
+# ---------- lado dos processos ----------
+# início (time.monotonic) de cada tarefa, por vaga; compartilhado com todos os processos
+_started = None
+
+
+def _warm(started=None):
+    global _started
+    _started = started
+    from . import features, report  # noqa: F401  (numpy, reportlab, ffmpeg via processing)
+
+    report._layout()
+    report._static_stream()
+
+
+def _timed(slot: int, fn: Callable, *args):
+    _started[slot] = time.monotonic()
+    return fn(*args)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def analyze_and_render(kind: str, data, audio_sha256: str,
+                       name: Optional[str] = None, cpf: Optional[str] = None
+                       ) -> Tuple[dict, Optional[bytes], Dict[str, bytes], Dict[str, float]]:
+    """
+    Análise + laudo de um áudio. kind: "metrics" (data = métricas prontas),
+    "features" (data = Features ou .feat.npz) ou "audio" (data = áudio bruto
+    ou media.SpooledFile).
+    O laudo só é gerado com `name`. Devolve (métricas, pdf, blobs de features
+    a subir, segundos por etapa).
+    """
+    from . import features
+
+    timings: Dict[str, float] = {}
+    blobs: Dict[str, bytes] = {}
+    t0 = time.perf_counter()
+    if kind == "metrics":
+        result = data
+    elif kind == "features":
+        result = features.analyze(data if isinstance(data, features.Features) else features.decode(data))
+    else:
+        with shared_view(data) as audio:
+            f = features.extract(audio)
+        result = features.analyze(f)
+        blobs = features.encode(audio_sha256, f)
+    if kind != "metrics":
+        timings["process"] = time.perf_counter() - t0
+    pdf = None
+    if name is not None:
+        from .report import build_pdf_bytes
+
+        t0 = time.perf_counter()
+        pdf = build_pdf_bytes(name, cpf or "", result)
+        timings["pdf"] = time.perf_counter() - t0
+    return result, pdf, blobs, timings
+
+
+# ---------- lado de quem chama ----------
+class CpuPool:
+    def __init__(self, workers: Optional[int] = None, max_tasks_per_child: int = 200,
+                 max_pending: Optional[int] = None, task_timeout: Optional[float] = 120.0,
+                 submit_timeout: Optional[float] = 30.0, health_interval: float = 30.0):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.max_pending = max_pending or 2 * max(self.workers, 1)
+        self.task_timeout = task_timeout
+        self.submit_timeout = submit_timeout
+        self.health_interval = health_interval
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._ctx = multiprocessing.get_context("spawn")  # sem herdar threads/conexões
+        # uma vaga por tarefa em voo (o semáforo garante que não faltam); o array
+        # compartilhado é criado com o primeiro executor
+        self._started = None
+        self._free = list(range(self.max_pending))
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._stop = threading.Event()
+        self._health: Optional[threading.Thread] = None
+        self._warming: list = []
+        self.pending = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        if self._started is None:
+            self._started = self._ctx.RawArray("d", self.max_pending)
+        ex = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self._ctx,
+            initializer=_warm,
+            initargs=(self._started,),
+            max_tasks_per_child=self.max_tasks_per_child or None,
+        )
+        # sobe (e aquece) os processos já; start(wait=True) espera por isso
+        self._warming = [ex.submit(_ping) for _ in range(self.workers)]
+        return ex
+
+    def _current(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            return self._executor
+
+    def start(self, wait: bool = False) -> None:
+        if not self.enabled:
+            return
+        self._current()
+        if wait:
+            for fut in list(self._warming):
+                fut.result()
+        if self.health_interval and self._health is None:
+            self._stop.clear()
+            self._health = threading.Thread(target=self._health_loop, name="cpu-pool-health", daemon=True)
+            self._health.start()
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        with self._lock:
+            ex, self._executor = self._executor, None
+        if ex is not None:
+            ex.shutdown(wait=True, cancel_futures=True)
+        self._health = None
+
+    def restart(self, broken: Optional[ProcessPoolExecutor] = None, reason: str = "") -> None:
+        """Troca o executor; com `broken`, só se ele ainda for o atual (evita reinícios em cascata)."""
+        with self._lock:
+            old = self._executor
+            if old is None or (broken is not None and old is not broken):
+                return
+            self._executor = self._new_executor()
+            self.restarts += 1
+        print(f"[cpu_pool] reiniciando o pool ({reason})")
+        # ProcessPoolExecutor não cancela uma tarefa em execução: mata os processos
+        for p in list((getattr(old, "_processes", None) or {}).values()):
+            p.kill()
+        old.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, fn: Callable, *args, timeout: Optional[float] = None):
+        """Executa fn(*args) num processo do pool e espera o resultado."""
+        if not self.enabled:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.submit_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise PoolBusy(f"{self.max_pending} tarefas na fila do pool de CPU")
+        with self._lock:
+            self.pending += 1
+            slot = self._free.pop()
+        try:
+            for attempt in (0, 1):
+                ex = self._current()
+                self._started[slot] = 0.0
+                try:
+                    fut = ex.submit(_timed, slot, fn, *args)
+                    break
+                except (RuntimeError, BrokenProcessPool):  # trocado/quebrado entre _current() e submit
+                    if attempt:
+                        raise
+                    self.restart(ex, "submit falhou")
+            limit = timeout if timeout is not None else self.task_timeout
+            while True:
+                begun = self._started[slot]
+                if not limit:
+                    wait = None
+                elif begun:
+                    wait = max(limit - (time.monotonic() - begun), 0.0)
+                else:
+                    wait = min(limit, 1.0)  # ainda na fila (pool ocupado): a espera não conta
+                try:
+                    result = fut.result(timeout=wait)
+                    break
+                except FutureTimeout:
+                    begun = self._started[slot]
+                    if not begun or time.monotonic() - begun < limit:
+                        continue
+                    with self._lock:
+                        self.timeouts += 1
+                    self.restart(ex, "timeout")
+                    raise TaskTimeout(f"{getattr(fn, '__name__', fn)} passou de {limit} s")
+                except BrokenProcessPool:
+                    self.restart(ex, "processo morreu")
+                    raise
+            with self._lock:
+                self.completed += 1
+            return result
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self._free.append(slot)
+            self._slots.release()
+
+    def check(self, timeout: float = 10.0) -> bool:
+        """
+        Saudável se o pool responde a um ping. Com tarefas em voo o ping não é
+        feito (esperaria atrás delas); o timeout por tarefa já cobre esse caso.
+        """
+        if not self.enabled:
+            return True
+        ex = self._current()
+        if self.pending:
+            return not getattr(ex, "_broken", False)
+        try:
+            ex.submit(_ping).result(timeout=timeout)
+        except Exception as e:
+            self.restart(ex, f"health check: {type(e).__name__}")
+            return False
+        return True
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"[cpu_pool] health check falhou: {type(e).__name__}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            ex = self._executor
+            alive = sum(p.is_alive() for p in (getattr(ex, "_processes", None) or {}).values()) if ex else 0
+            return {
+                "workers": self.workers,
+                "alive": alive,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "restarts": self.restarts,
+            }
+
+
+pool = CpuPool(
+    workers=settings.CPU_POOL_WORKERS,
+    max_tasks_per_child=settings.CPU_POOL_MAX_TASKS_PER_CHILD,
+    max_pending=settings.CPU_POOL_MAX_PENDING,
+    task_timeout=settings.CPU_POOL_TASK_TIMEOUT_S,
+    submit_timeout=settings.CPU_POOL_SUBMIT_TIMEOUT_S,
+    health_interval=settings.CPU_POOL_HEALTH_INTERVAL_S,
+)
+
+
+def _pool_samples():
+    for key, v in pool.stats().items():
+        yield "uroflux_cpu_pool", {"stat": key}, v
+
+
+metrics.add_collector("uroflux_cpu_pool", "Pool de processos de CPU (análise + laudo).", "gauge", _pool_samples)
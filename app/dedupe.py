@@ -0,0 +1,54 @@
+# app/dedupe.py
+# Deduplicação de mensagens do webhook. A Meta reenvia a mesma mensagem
+# várias vezes (timeouts, retries); a 1ª barreira é este LRU em memória e a
+# 2ª é o insert-or-ignore em jobs.dedupe_key (ver jobs.enqueue_unique).
+import threading
+from collections import OrderedDict
+
+from .settings import settings
+
+
+class MessageDeduper:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_db = 0
+        self.misses = 0
+
+    def seen(self, key: str) -> bool:
+        with self._lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                self.hits_memory += 1
+                return True
+            return False
+
+    def add(self, key: str) -> None:
+        with self._lock:
+            self._seen[key] = None
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.maxsize:
+                self._seen.popitem(last=False)
+
+    def record_db_hit(self) -> None:
+        with self._lock:
+            self.hits_db += 1
+
+    def record_miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_db": self.hits_db,
+                "misses": self.misses,
+                "size": len(self._seen),
+                "maxsize": self.maxsize,
+            }
+
+
+messages = MessageDeduper(settings.DEDUPE_LRU_SIZE)
@@ -0,0 +1,260 @@
+# app/events.py
+# Mudanças de status dos exames empurradas para as telas do médico por SSE
+# (GET /web/exams/events), no lugar de recarregar a página (e refazer a
+# consulta dos exames) esperando o resultado.
+#   - quem muda o status (pipeline) chama publish() depois do commit
+#   - cada processo web tem um Broker: fila por navegador conectado + histórico
+#     curto para o EventSource retomar (Last-Event-ID) depois de uma queda
+#   EXAM_EVENTS_BACKEND:
+#     memory   publish() entrega no próprio processo (worker dentro do web, dev)
+#     postgres publish() faz NOTIFY; cada processo web escuta (LISTEN) numa
+#              conexão própria e repassa ao seu Broker (vários processos/worker)
+#     auto     postgres quando o banco é Postgres (padrão)
+import asyncio
+import json
+import select
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Callable, Awaitable, Deque, List, Optional, Set, Tuple
+
+from .settings import settings
+
+CHANNEL = "uroflux_exam_events"
+NOTIFY_MAX_BYTES = 7900  # payload do NOTIFY é limitado a 8000 bytes
+
+
+def exam_event(exam_id: int, patient_id: int, status: str,
+               audio: bool = False, report: bool = False) -> dict:
+    return {"id": exam_id, "patient_id": patient_id, "status": status,
+            "audio": audio, "report": report, "at": str(datetime.utcnow())}
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.loop = loop
+        self.queue: "asyncio.Queue[Optional[Tuple[str, dict]]]" = asyncio.Queue(maxsize)
+        self.replay: List[Tuple[str, dict]] = []
+        self.resync = False
+
+    def offer(self, item: Optional[Tuple[str, dict]]) -> None:
+        # roda no loop do navegador; fila cheia (cliente lento): manda recarregar
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.resync = True
+
+
+class Broker:
+    def __init__(self, history: int = 1000, queue_size: int = 256):
+        self.queue_size = queue_size
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._history: Deque[Tuple[int, dict]] = deque(maxlen=history)
+        self._subs: Set[Subscription] = set()
+        self._lock = threading.Lock()
+
+    def _id(self, seq: int) -> str:
+        return f"{self.epoch}:{seq}"
+
+    def subscribe(self, last_event_id: Optional[str] = None) -> Subscription:
+        """Chamado dentro do loop asyncio; replay e inscrição são atômicos (sem buraco)."""
+        sub = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            if last_event_id:
+                epoch, _, seq = last_event_id.partition(":")
+                oldest = self._history[0][0] if self._history else self._seq + 1
+                if epoch != self.epoch or not seq.isdigit() or int(seq) + 1 < oldest:
+                    sub.resync = True  # outro processo/reinício ou histórico já descartado
+                else:
+                    sub.replay = [(self._id(s), ev) for s, ev in self._history if s > int(seq)]
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._subs.discard(sub)
+
+    def publish_local(self, events: List[dict]) -> None:
+        """Entrega aos navegadores deste processo (de qualquer thread)."""
+        with self._lock:
+            items = []
+            for ev in events:
+                self._seq += 1
+                self._history.append((self._seq, ev))
+                items.append((self._id(self._seq), ev))
+            subs = list(self._subs)
+        for sub in subs:
+            for item in items:
+                try:
+                    sub.loop.call_soon_threadsafe(sub.offer, item)
+                except RuntimeError:  # loop já fechado
+                    self.unsubscribe(sub)
+                    break
+
+    def reset(self) -> None:
+        """Eventos podem ter sido perdidos (ex.: LISTEN caiu): todos recarregam."""
+        with self._lock:
+            self.epoch = uuid.uuid4().hex[:8]
+            self._history.clear()
+            subs = list(self._subs)
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, None)
+            except RuntimeError:
+                self.unsubscribe(sub)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"subscribers": len(self._subs), "published": self._seq, "history": len(self._history)}
+
+
+broker = Broker(settings.EXAM_EVENTS_HISTORY)
+
+
+def backend() -> str:
+    b = settings.EXAM_EVENTS_BACKEND
+    if b == "auto":
+        from .db import engine
+
+        return "postgres" if engine.dialect.name == "postgresql" else "memory"
+    return b
+
+
+# ---------- publicação ----------
+def _chunks(events: List[dict]):
+    batch: List[str] = []
+    size = 2
+    for ev in events:
+        s = json.dumps(ev, separators=(",", ":"))
+        if batch and size + len(s) + 1 > NOTIFY_MAX_BYTES:
+            yield "[" + ",".join(batch) + "]"
+            batch, size = [], 2
+        batch.append(s)
+        size += len(s) + 1
+    if batch:
+        yield "[" + ",".join(batch) + "]"
+
+
+def publish(events: List[dict]) -> None:
+    """Depois do commit. Melhor esforço: uma falha aqui nunca derruba o exame."""
+    if not events:
+        return
+    try:
+        if backend() == "postgres":
+            from sqlalchemy import text
+
+            from .db import engine
+
+            with engine.begin() as conn:
+                for payload in _chunks(events):
+                    conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                 {"channel": CHANNEL, "payload": payload})
+        else:
+            broker.publish_local(events)
+    except Exception as e:
+        print(f"[events] publicação falhou: {type(e).__name__}: {e}")
+
+
+# ---------- LISTEN (processos web com backend postgres) ----------
+class _Listener:
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="exam-events-listen", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    def _run(self) -> None:
+        import psycopg2
+
+        from .db import engine
+
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        connected_before = False
+        backoff = 1.0
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {CHANNEL}")
+                if connected_before:
+                    broker.reset()  # o que foi notificado enquanto estávamos fora se perdeu
+                connected_before, backoff = True, 1.0
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    batch: List[dict] = []
+                    while conn.notifies:
+                        batch.extend(json.loads(conn.notifies.pop(0).payload))
+                    if batch:
+                        broker.publish_local(batch)
+            except Exception as e:
+                print(f"[events] LISTEN caiu: {type(e).__name__}: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+listener = _Listener()
+
+
+def start() -> None:
+    if backend() == "postgres":
+        listener.start()
+
+
+def stop() -> None:
+    listener.stop()
+
+
+# ---------- SSE ----------
+def _sse(event: str, data: dict, event_id: Optional[str] = None) -> str:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def sse_stream(last_event_id: Optional[str], is_disconnected: Callable[[], Awaitable[bool]],
+                     patient_id: Optional[int] = None):
+    """
+    Corpo do text/event-stream de um navegador. A inscrição acontece aqui dentro,
+    na primeira iteração: se o cliente cair antes de a resposta começar, o
+    gerador nunca roda e não sobra fila inscrita no Broker.
+    """
+    sub = broker.subscribe(last_event_id)
+    try:
+        yield "retry: 3000\n\n"
+        if sub.resync:
+            yield _sse("resync", {})
+            return
+        for event_id, ev in sub.replay:
+            if patient_id is None or ev["patient_id"] == patient_id:
+                yield _sse("exam", ev, event_id)
+        while True:
+            try:
+                item = await asyncio.wait_for(sub.queue.get(), settings.EXAM_EVENTS_KEEPALIVE_S)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    return
+                yield ": ping\n\n"  # mantém proxies/load balancer com a conexão aberta
+                continue
+            if item is None or sub.resync:
+                yield _sse("resync", {})
+                return
+            event_id, ev = item
+            if patient_id is None or ev["patient_id"] == patient_id:
+                yield _sse("exam", ev, event_id)
+    finally:
+        broker.unsubscribe(sub)
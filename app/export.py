@@ -0,0 +1,195 @@
+# app/export.py
+# Exportação de exames e métricas em CSV ou Parquet, em streaming: memória constante
+# (um lote de EXPORT_BATCH_ROWS linhas) com 1 mil ou 10 milhões de exames.
+#   - leitura num cursor do lado do servidor (stream_results/yield_per), numa
+#     conexão só dela; no SQLite (dev), páginas por id como no app/reprocess.py
+#   - cada lote vira um bloco de CSV ou um row group do Parquet e já sai
+#   - GET /exams/export?format=csv|parquet&patient_id=&since=&until=&status=
+#   - python -m app.export --format parquet --out exames.parquet --since 2025-01-01
+# Parquet usa pyarrow (no requirements.txt); numa instalação sem ele o formato
+# responde 501 em vez de quebrar no meio do stream.
+import argparse
+import csv
+import io
+import sys
+from datetime import datetime
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+
+from .models import Exam, ExamResult, Patient
+from .settings import settings
+
+FORMATS = {"csv": "text/csv; charset=utf-8", "parquet": "application/vnd.apache.parquet"}
+
+# (coluna no arquivo, coluna no banco, tipo no Parquet)
+COLUMNS = [
+    ("exam_id", Exam.id, "int64"),
+    ("patient_id", Exam.patient_id, "int64"),
+    ("patient_name", Patient.name, "string"),
+    ("patient_cpf", Patient.cpf, "string"),
+    ("status", Exam.status, "string"),
+    ("created_at", Exam.created_at, "timestamp"),
+    ("audio_sha256", Exam.audio_sha256, "string"),
+    # métricas (vazias enquanto o exame não tem resultado)
+    ("duracao_s", ExamResult.duracao_s, "float64"),
+    ("vazao_max_ml_s", ExamResult.vazao_max_ml_s, "float64"),
+    ("vazao_media_ml_s", ExamResult.vazao_media_ml_s, "float64"),
+    ("volume_total_ml", ExamResult.volume_total_ml, "float64"),
+    ("tempo_ate_pico_s", ExamResult.tempo_ate_pico_s, "float64"),
+    ("duracao_gravacao_s", ExamResult.duracao_gravacao_s, "float64"),
+    ("classe_dominante", ExamResult.classe_dominante, "string"),
+    ("pipeline_version", ExamResult.pipeline_version, "string"),
+]
+
+
+class ExportUnavailable(Exception):
+    """Formato pedido precisa de uma dependência que não está instalada."""
+
+
+def _select(patient_id: Optional[int], since: Optional[datetime], until: Optional[datetime],
+            status: Optional[Sequence[str]]):
+    stmt = (
+        select(*(col for _, col, _ in COLUMNS))
+          .join(Patient, Patient.id == Exam.patient_id)
+          .outerjoin(ExamResult, ExamResult.exam_id == Exam.id)
+    )
+    if patient_id is not None:
+        stmt = stmt.where(Exam.patient_id == patient_id)
+    if since:
+        stmt = stmt.where(Exam.created_at >= since)  # created_at poda as partições
+    if until:
+        stmt = stmt.where(Exam.created_at < until)
+    if status:
+        stmt = stmt.where(Exam.status.in_(status))
+    return stmt
+
+
+def batches(patient_id: Optional[int] = None, since: Optional[datetime] = None,
+            until: Optional[datetime] = None, status: Optional[Sequence[str]] = None,
+            size: Optional[int] = None) -> Iterator[List[Tuple]]:
+    """Linhas em ordem de id, em lotes de `size`."""
+    from .db import engine
+
+    size = size or settings.EXPORT_BATCH_ROWS
+    stmt = _select(patient_id, since, until, status)
+    if engine.dialect.name == "sqlite":
+        # dev: no SQLite um SELECT aberto trava os commits do worker; lê páginas por id
+        last_id = 0
+        while True:
+            with engine.connect() as conn:
+                page = conn.execute(stmt.where(Exam.id > last_id).order_by(Exam.id).limit(size)).all()
+            if not page:
+                return
+            yield page
+            last_id = page[-1][0]
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=size).execute(stmt.order_by(Exam.id))
+        for part in result.partitions():
+            yield part
+
+
+# ---------- CSV ----------
+def iter_csv(rows: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow([name for name, _, _ in COLUMNS])
+    for batch in rows:
+        w.writerows(batch)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    tail = buf.getvalue()
+    if tail:  # arquivo sem linhas: só o cabeçalho
+        yield tail.encode("utf-8")
+
+
+# ---------- Parquet ----------
+class _Drain:
+    """Arquivo só de escrita cujo conteúdo é esvaziado a cada lote (vai para a resposta)."""
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.buf += data
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        out = bytes(self.buf)
+        self.buf.clear()
+        return out
+
+
+def _arrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportUnavailable("exportação em Parquet precisa do pyarrow (pip install pyarrow)")
+    return pa, pq
+
+
+def iter_parquet(rows: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    pa, pq = _arrow()
+    types = {"int64": pa.int64(), "string": pa.string(), "timestamp": pa.timestamp("us"),
+             "float64": pa.float64()}
+    schema = pa.schema([(name, types[kind]) for name, _, kind in COLUMNS])
+    sink = _Drain()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for batch in rows:
+            columns = list(zip(*batch))
+            writer.write_batch(pa.record_batch(
+                [pa.array(col, type=f.type) for col, f in zip(columns, schema)], schema=schema
+            ))  # um row group por lote
+            yield sink.take()
+    finally:
+        writer.close()  # rodapé com o schema e os offsets dos row groups
+    yield sink.take()
+
+
+def stream(fmt: str, **filters) -> Iterator[bytes]:
+    if fmt == "parquet":
+        _arrow()  # falha já, antes de começar a resposta
+        return iter_parquet(batches(**filters))
+    return iter_csv(batches(**filters))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Exporta exames em CSV ou Parquet (streaming).")
+    ap.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    ap.add_argument("--out", default="-", help="arquivo de saída (padrão: stdout)")
+    ap.add_argument("--patient", type=int, default=None, help="só os exames deste paciente")
+    ap.add_argument("--since", type=datetime.fromisoformat, help="criados a partir de (AAAA-MM-DD)")
+    ap.add_argument("--until", type=datetime.fromisoformat, help="criados antes de (AAAA-MM-DD)")
+    ap.add_argument("--status", nargs="+", default=None)
+    args = ap.parse_args()
+    try:
+        chunks = stream(args.format, patient_id=args.patient, since=args.since, until=args.until,
+                        status=args.status)
+    except ExportUnavailable as e:
+        sys.exit(str(e))
+    out = sys.stdout.buffer if args.out == "-" else open(args.out, "wb")
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# app/features.py
+# Feature store: o que a análise precisa, sem decodificar o OGG de novo.
+# Por áudio (endereçado pelo sha256, ao lado do áudio bruto no S3):
+#   audios/sha256/ab/<hash>.feat.v<N>.npz  energia na banda + centroide por frame
+#                                          (~0,5 KB por segundo de gravação)
+#   audios/sha256/ab/<hash>.pcm16k.npz     PCM mono int16 já decodificado (opcional,
+#                                          FEATURES_STORE_PCM) p/ quando mudar o framing
+# Mudou só a derivação das métricas (metrics_from_features)? Basta o .feat.
+# Localmente os arrays ficam descompactados em .npy e são abertos com mmap; o
+# cache é preenchido na leitura (load), não na ingestão, e limitado em bytes
+# (FEATURE_CACHE_MAX_BYTES): passando disso saem os diretórios usados há mais tempo.
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+
+from .processing import (
+    FrameFeatures, decode_pcm_chunks, metrics_from_features, SAMPLE_RATE, FRAME, HOP, CHUNK_FRAMES,
+)
+from .settings import settings
+
+# suba ao mudar FrameFeatures (banda, janela, FRAME/HOP): os .feat antigos deixam de valer
+FEATURES_VERSION = 1
+
+
+class Features(NamedTuple):
+    band: np.ndarray
+    centroid: np.ndarray
+    n_samples: int
+    pcm: Optional[np.ndarray] = None  # int16 mono SAMPLE_RATE
+
+
+def _prefix(audio_sha256: str) -> str:
+    return f"audios/sha256/{audio_sha256[:2]}/{audio_sha256}"
+
+
+def features_key(audio_sha256: str) -> str:
+    return f"{_prefix(audio_sha256)}.feat.v{FEATURES_VERSION}.npz"
+
+
+def pcm_key(audio_sha256: str) -> str:
+    return f"{_prefix(audio_sha256)}.pcm16k.npz"
+
+
+def _cache_base() -> str:
+    return settings.FEATURE_CACHE_DIR or os.path.join(tempfile.gettempdir(), "uroflux-features")
+
+
+def _cache_dir(audio_sha256: str) -> str:
+    return os.path.join(_cache_base(), f"{audio_sha256}.v{FEATURES_VERSION}")
+
+
+# ---------- extração (uma decodificação) ----------
+def extract(audio: bytes | memoryview, keep_pcm: Optional[bool] = None) -> Features:
+    """Decodifica uma vez e devolve as features por frame (e o PCM, se pedido)."""
+    if keep_pcm is None:
+        keep_pcm = settings.FEATURES_STORE_PCM
+    max_samples = int(settings.FEATURES_PCM_MAX_S * SAMPLE_RATE)
+    feats = FrameFeatures()
+    pcm_parts = []
+    for chunk in decode_pcm_chunks(audio):
+        feats.push(chunk)
+        if keep_pcm:
+            if feats.n_samples > max_samples:
+                keep_pcm, pcm_parts = False, []  # gravação longa demais: guarda só as features
+            else:
+                pcm_parts.append(np.clip(np.round(chunk * 32768.0), -32768, 32767).astype("<i2"))
+    band, centroid = feats.arrays()
+    pcm = None
+    if keep_pcm:
+        pcm = np.concatenate(pcm_parts) if pcm_parts else np.zeros(0, dtype="<i2")
+    return Features(band, centroid, feats.n_samples, pcm)
+
+
+def from_pcm(pcm: np.ndarray) -> Features:
+    """Refaz as features a partir do PCM guardado (novo FEATURES_VERSION), sem ffmpeg."""
+    feats = FrameFeatures()
+    step = CHUNK_FRAMES * HOP
+    for i in range(0, len(pcm), step):
+        feats.push(np.asarray(pcm[i:i + step], dtype=np.float32) / 32768.0)
+    band, centroid = feats.arrays()
+    return Features(band, centroid, feats.n_samples, pcm)
+
+
+def analyze(f: Features) -> dict:
+    return metrics_from_features(f.band, f.centroid, f.n_samples)
+
+
+# ---------- serialização ----------
+def _npz(**arrays) -> bytes:
+    buf = io.BytesIO()
+    np.savez_compressed(buf, **arrays)
+    return buf.getvalue()
+
+
+def _feat_npz(f: Features) -> bytes:
+    meta = np.array([f.n_samples, SAMPLE_RATE, FRAME, HOP, FEATURES_VERSION], dtype=np.int64)
+    return _npz(band=f.band.astype(np.float32), centroid=f.centroid.astype(np.float32), meta=meta)
+
+
+def _unpack_to_cache(audio_sha256: str, blobs: dict) -> None:
+    """Descompacta os .npz para .npy (mmap-áveis) num diretório trocado atomicamente."""
+    final = _cache_dir(audio_sha256)
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(final), prefix=".tmp-")
+    try:
+        if os.path.isdir(final):  # completa um cache que só tinha parte dos arrays
+            for name in os.listdir(final):
+                shutil.copy2(os.path.join(final, name), tmp)
+        for blob in blobs.values():
+            with zipfile.ZipFile(io.BytesIO(blob)) as z:
+                z.extractall(tmp)  # membros do npz já são .npy
+        old = final + ".old"
+        if os.path.isdir(final):
+            os.replace(final, old)
+        os.replace(tmp, final)
+        shutil.rmtree(old, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    _trim_cache(keep=final)
+
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for entry in os.scandir(path):
+        try:
+            total += entry.stat().st_size
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def _trim_cache(keep: Optional[str] = None) -> None:
+    """
+    LRU por diretório (o mtime é renovado a cada leitura em _load_cached) até
+    caber em FEATURE_CACHE_MAX_BYTES. Vários processos podem aparar ao mesmo
+    tempo: quem chegar depois só não acha o que apagar. Quem ainda tem os .npy
+    abertos com mmap continua lendo (no Linux o arquivo some só no último close).
+    """
+    limit = settings.FEATURE_CACHE_MAX_BYTES
+    if not limit:
+        return
+    entries = []
+    try:
+        with os.scandir(_cache_base()) as it:
+            for e in it:
+                if e.is_dir() and not e.name.startswith("."):
+                    try:
+                        entries.append((e.stat().st_mtime, _dir_bytes(e.path), e.path))
+                    except FileNotFoundError:
+                        pass
+    except FileNotFoundError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        if path == keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def _load_cached(audio_sha256: str, with_pcm: bool) -> Optional[Features]:
+    d = _cache_dir(audio_sha256)
+    try:
+        band = np.load(os.path.join(d, "band.npy"), mmap_mode="r")
+        centroid = np.load(os.path.join(d, "centroid.npy"), mmap_mode="r")
+        meta = np.load(os.path.join(d, "meta.npy"))
+        pcm = np.load(os.path.join(d, "pcm.npy"), mmap_mode="r") if with_pcm else None
+    except (FileNotFoundError, ValueError):
+        return None
+    try:
+        os.utime(d)  # recência p/ o LRU do _trim_cache
+    except FileNotFoundError:
+        pass
+    return Features(band, centroid, int(meta[0]), pcm)
+
+
+def encode(audio_sha256: str, f: Features) -> Dict[str, bytes]:
+    """Chave no S3 -> .npz (features e, se houver, o PCM)."""
+    blobs = {features_key(audio_sha256): _feat_npz(f)}
+    if f.pcm is not None:
+        blobs[pcm_key(audio_sha256)] = _npz(pcm=f.pcm)
+    return blobs
+
+
+def decode(feat_blob: bytes) -> Features:
+    """Features a partir do .feat.npz (sem cache local, p/ quem recebeu os bytes)."""
+    with np.load(io.BytesIO(feat_blob)) as z:
+        return Features(z["band"], z["centroid"], int(z["meta"][0]))
+
+
+# ---------- API ----------
+def save(audio_sha256: str, f: Features) -> None:
+    """Sobe as features (e o PCM) se ainda não existem."""
+    save_blobs(audio_sha256, encode(audio_sha256, f))
+
+
+def save_blobs(audio_sha256: str, blobs: Dict[str, bytes]) -> None:
+    """
+    save() com os .npz já prontos (ex.: gerados num processo do pool de CPU).
+    Não passa pelo cache local: na ingestão quase nenhum áudio é lido de novo;
+    quem precisar (reprocess, PIPELINE_VERSION novo) descompacta em load().
+    """
+    from .storage import object_exists, upload_bytes
+
+    for key, blob in blobs.items():
+        if not object_exists(key):
+            upload_bytes(key, blob, content_type="application/octet-stream")
+
+
+def load(audio_sha256: str, with_pcm: bool = False) -> Optional[Features]:
+    """
+    Features do áudio, de preferência do cache local (mmap); senão baixa do
+    S3 e descompacta. None se o áudio ainda não tem features desta versão.
+    """
+    f = _load_cached(audio_sha256, with_pcm)
+    if f is not None:
+        return f
+    from .storage import get_bytes
+
+    feat = get_bytes(features_key(audio_sha256))
+    pcm = get_bytes(pcm_key(audio_sha256)) if with_pcm or feat is None else None
+    if feat is None:
+        if pcm is None:
+            return None
+        # features de uma versão anterior: refaz a partir do PCM e publica
+        f = from_pcm(np.load(io.BytesIO(pcm))["pcm"])
+        save(audio_sha256, f)
+        return f if with_pcm else f._replace(pcm=None)
+    if with_pcm and pcm is None:
+        return None
+    blobs = {"feat": feat}
+    if pcm is not None:
+        blobs["pcm"] = pcm
+    _unpack_to_cache(audio_sha256, blobs)
+    return _load_cached(audio_sha256, with_pcm)
+
+
+def reanalyze(audio_sha256: str) -> Optional[dict]:
+    """Métricas recalculadas só a partir das features guardadas (sem ffmpeg)."""
+    f = load(audio_sha256)
+    return analyze(f) if f is not None else None
@@ -0,0 +1,246 @@
+# app/jobs.py
+# Fila de jobs persistida no banco (Postgres em produção, SQLite no dev).
+# O webhook só grava o job e responde; os workers (app/worker.py) executam.
+import random
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import or_, and_, update, func
+from sqlalchemy.orm import Session
+
+from .models import Job
+from .settings import settings
+
+# kind -> função(db, payload)
+HANDLERS: Dict[str, Callable[[Session, dict], None]] = {}
+
+
+# kind -> função(db, [payload, ...]) -> [None | Exception, ...] (um por payload)
+BATCH_HANDLERS: Dict[str, Callable[[Session, List[dict]], List[Optional[Exception]]]] = {}
+
+# nº da tentativa atual, acrescentado à cópia do payload que o handler recebe
+ATTEMPT_KEY = "_attempt"
+
+
+def is_last_attempt(payload: dict) -> bool:
+    """True se uma falha agora manda o job para 'failed' (o handler deve encerrar o que abriu)."""
+    return payload.get(ATTEMPT_KEY, 0) >= settings.JOB_MAX_ATTEMPTS
+
+
+def handler(kind: str):
+    """Registra a função que executa os jobs do tipo `kind`."""
+    def deco(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return deco
+
+
+def batch_handler(kind: str):
+    """
+    Registra uma função que executa vários jobs do tipo `kind` de uma vez
+    (consultas/commits compartilhados). Tem prioridade sobre @handler em run_jobs.
+    """
+    def deco(fn):
+        BATCH_HANDLERS[kind] = fn
+        return fn
+    return deco
+
+
+def enqueue(db: Session, kind: str, payload: dict, commit: bool = True) -> Job:
+    job = Job(kind=kind, payload=payload, status="queued", run_after=datetime.utcnow())
+    db.add(job)
+    if commit:
+        db.commit()
+    return job
+
+
+def enqueue_unique(db: Session, kind: str, payload: dict, dedupe_key: str) -> bool:
+    """
+    INSERT ... ON CONFLICT (dedupe_key) DO NOTHING.
+    Retorna False se já existia um job com essa chave (não faz commit).
+    """
+    return dedupe_key in enqueue_unique_many(db, [(kind, payload, dedupe_key)])
+
+
+def enqueue_unique_many(db: Session, items: List[Tuple[str, dict, str]]) -> Set[str]:
+    """
+    Versão em lote de enqueue_unique: um único INSERT multi-linha para
+    (kind, payload, dedupe_key). Devolve as chaves efetivamente inseridas
+    (as demais já existiam). Não faz commit.
+    """
+    if not items:
+        return set()
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        # fallback genérico: consulta + insert
+        keys = [key for _, _, key in items]
+        existing = {k for (k,) in db.query(Job.dedupe_key).filter(Job.dedupe_key.in_(keys))}
+        inserted = set()
+        for kind, payload, key in items:
+            if key in existing or key in inserted:
+                continue
+            enqueue(db, kind, payload, commit=False).dedupe_key = key
+            inserted.add(key)
+        return inserted
+    now = datetime.utcnow()
+    rows = [
+        dict(kind=kind, payload=payload, dedupe_key=key, status="queued",
+             attempts=0, run_after=now, created_at=now, updated_at=now)
+        for kind, payload, key in items
+    ]
+    stmt = (
+        insert(Job)
+          .values(rows)
+          .on_conflict_do_nothing(index_elements=["dedupe_key"])
+          .returning(Job.dedupe_key)
+    )
+    return set(db.execute(stmt).scalars())
+
+
+def claim(db: Session, worker_id: str, limit: int = 1) -> List[Job]:
+    """
+    Reserva até `limit` jobs prontos. Jobs "running" cujo visibility timeout
+    expirou (worker morreu no meio) também voltam a ser elegíveis.
+    """
+    now = datetime.utcnow()
+    rows = (
+        db.query(Job)
+          .filter(or_(
+              and_(Job.status == "queued", Job.run_after <= now),
+              and_(Job.status == "running", Job.locked_until < now),
+          ))
+          .order_by(Job.id)
+          .limit(limit)
+          .with_for_update(skip_locked=True)  # ignorado pelo SQLite
+          .all()
+    )
+    if not rows:
+        db.rollback()
+        return []
+    locked_until = now + timedelta(seconds=settings.JOB_VISIBILITY_TIMEOUT_S)
+    claimed = []
+    for job in rows:
+        # update condicional (otimista): no Postgres a linha já está travada, mas no
+        # SQLite o FOR UPDATE não existe e dois workers podem ver o mesmo job
+        res = db.execute(
+            update(Job)
+              .where(Job.id == job.id, Job.status == job.status, Job.attempts == job.attempts)
+              .values(status="running", locked_by=worker_id, locked_until=locked_until,
+                      attempts=job.attempts + 1, updated_at=now)
+              .execution_options(synchronize_session=False)
+        )
+        if res.rowcount == 1:
+            claimed.append(job.id)
+    db.commit()
+    if not claimed:
+        return []
+    return db.query(Job).filter(Job.id.in_(claimed)).order_by(Job.id).all()
+
+
+def backoff_seconds(attempts: int) -> float:
+    # exponencial (base * 2^(n-1), limitado) com jitter na metade superior
+    cap = min(settings.JOB_BACKOFF_MAX_S, settings.JOB_BACKOFF_BASE_S * (2 ** max(attempts - 1, 0)))
+    return random.uniform(cap / 2, cap)
+
+
+def mark_done(db: Session, job_id: int) -> None:
+    db.execute(
+        update(Job)
+          .where(Job.id == job_id)
+          .values(status="done", locked_until=None, last_error=None, updated_at=datetime.utcnow())
+    )
+    db.commit()
+
+
+def mark_done_many(db: Session, job_ids: List[int]) -> None:
+    if not job_ids:
+        return
+    db.execute(
+        update(Job)
+          .where(Job.id.in_(job_ids))
+          .values(status="done", locked_until=None, last_error=None, updated_at=datetime.utcnow())
+    )
+    db.commit()
+
+
+def mark_failed(db: Session, job_id: int, attempts: int, error: str) -> None:
+    """Reagenda com backoff ou, esgotadas as tentativas, marca como 'failed'."""
+    now = datetime.utcnow()
+    values = {"locked_until": None, "last_error": error[:4000], "updated_at": now}
+    if attempts >= settings.JOB_MAX_ATTEMPTS:
+        values["status"] = "failed"
+    else:
+        values["status"] = "queued"
+        values["run_after"] = now + timedelta(seconds=backoff_seconds(attempts))
+    db.execute(update(Job).where(Job.id == job_id).values(**values))
+    db.commit()
+
+
+def run_job(db: Session, job: Job) -> Optional[Exception]:
+    # guarda antes de rodar: um rollback no handler expira o objeto
+    job_id, attempts, kind = job.id, job.attempts, job.kind
+    payload = dict(job.payload or {}, **{ATTEMPT_KEY: attempts})
+    fn = HANDLERS.get(kind)
+    if fn is None:
+        mark_failed(db, job_id, settings.JOB_MAX_ATTEMPTS, f"tipo de job desconhecido: {kind}")
+        return None
+    try:
+        fn(db, payload)
+    except Exception as e:
+        db.rollback()
+        mark_failed(db, job_id, attempts, f"{type(e).__name__}: {e}")
+        return e
+    mark_done(db, job_id)
+    return None
+
+
+def run_jobs(db: Session, claimed: List[Job]) -> List[Tuple[int, str, Exception]]:
+    """
+    Executa os jobs reservados por claim(): tipos com @batch_handler rodam
+    juntos, o resto um a um. Devolve (id, kind, erro) dos que falharam.
+    """
+    # guarda antes de rodar: um rollback no handler expira os objetos
+    items = [(j.id, j.attempts, j.kind, dict(j.payload or {}, **{ATTEMPT_KEY: j.attempts})) for j in claimed]
+    by_id = {j.id: j for j in claimed}
+    failures: List[Tuple[int, str, Exception]] = []
+    by_kind: Dict[str, list] = {}
+    for item in items:
+        by_kind.setdefault(item[2], []).append(item)
+
+    for kind, group in by_kind.items():
+        fn = BATCH_HANDLERS.get(kind)
+        if fn is None:
+            for job_id, _, _, _ in group:
+                err = run_job(db, by_id[job_id])
+                if err is not None:
+                    failures.append((job_id, kind, err))
+            continue
+        try:
+            errors = fn(db, [payload for _, _, _, payload in group])
+        except Exception as e:
+            db.rollback()
+            errors = [e] * len(group)
+        done = []
+        for (job_id, attempts, _, _), err in zip(group, errors):
+            if err is None:
+                done.append(job_id)
+            else:
+                mark_failed(db, job_id, attempts, f"{type(err).__name__}: {err}")
+                failures.append((job_id, kind, err))
+        mark_done_many(db, done)
+    return failures
+
+
+def queue_depth(db: Session) -> Dict[tuple, int]:
+    """(kind, status) -> nº de jobs pendentes/rodando/falhos ("done" fica de fora: só cresce)."""
+    rows = (
+        db.query(Job.kind, Job.status, func.count(Job.id))
+          .filter(Job.status != "done")
+          .group_by(Job.kind, Job.status)
+          .all()
+    )
+    return {(kind, status): n for kind, status, n in rows}
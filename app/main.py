@@ -1,44 +1,93 @@
 # app/main.py
-from fastapi import FastAPI, Depends, HTTPException, Request, Query, Form
-from fastapi.responses import PlainTextResponse, JSONResponse
+from . import startup  # primeiro: com STARTUP_PROFILE=1 mede os imports abaixo
+from fastapi import FastAPI, Depends, HTTPException, Request, Query, Form, Response
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from starlette.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
 
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 from typing import Optional, List
+from functools import lru_cache
+from datetime import datetime, timedelta
 
-from .db import Base, engine, get_db
-from .models import Patient, Exam, ExamResult
-from .schemas import PatientCreate, PatientOut, ExamOut
-from .settings import settings
-from .whatsapp import (
-    send_template_message, send_text, send_document,
-    get_media_url, download_media
+from .db import Base, engine, SessionLocal, get_db, get_async_db, dispose_async_engine
+from .models import Patient, Exam, ExamResult, PatientTrend, Campaign, CampaignRecipient
+from .schemas import (
+    PatientCreate, PatientOut, ExamOut, PatientTrendOut,
+    CampaignCreate, CampaignOut, CampaignRecipientOut,
 )
-from .storage import upload_bytes
-from .processing import process_audio_bytes
-from .report import build_pdf_bytes
+from .settings import settings
+from .whatsapp import send_template_message
+from . import jobs, metrics, trends, events as exam_events, export as exam_export
+from .dedupe import messages as seen_messages
+from .search import filter_patients, apage_by_id
+from .campaigns import create_campaign
+from .storage import cached_presigned_url, url_cache  # boto3 só carrega ao assinar
+from .result_cache import results as result_cache
+from .cpu_pool import pool as cpu_pool  # processos só sobem com o WorkerPool
 
 import os
+import random
 
 app = FastAPI(title="UroFlux MVP")
 
+# profiler por amostragem, opcional (pyinstrument): só com PROFILE_REQUESTS=true.
+# Em rotas síncronas o trabalho roda no threadpool e aparece como espera.
+if settings.PROFILE_REQUESTS:
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        wanted = request.headers.get("X-Profile") == "1" or random.random() < settings.PROFILE_SAMPLE_RATE
+        if not wanted:
+            return await call_next(request)
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("[profile] pyinstrument não instalado; ignorando X-Profile")
+            return await call_next(request)
+        profiler = Profiler(interval=settings.PROFILE_INTERVAL_S, async_mode="enabled")
+        profiler.start()
+        try:
+            return await call_next(request)
+        finally:
+            profiler.stop()
+            print(f"[profile] {request.method} {request.url.path}\n{profiler.output_text(unicode=True)}")
+
 @app.on_event("startup")
 def on_startup():
-    # cria tabelas (MVP)
-    Base.metadata.create_all(bind=engine)
-    # sanity-check de conexão
-    try:
-        with engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
-    except Exception as e:
-        print(f"[startup] WARNING: DB check falhou: {e}")
+    # schema: `python -m app.migrations` (fase "release" do Procfile), não no boot;
+    # a conexão com o banco abre sob demanda (pool_pre_ping) na primeira requisição
+    if settings.DB_MIGRATE_ON_STARTUP:
+        from .migrations import upgrade
+        with startup.step("migrations"):
+            upgrade(engine)
+    # workers da fila no próprio processo web (ou use o processo "worker" do Procfile)
+    if settings.JOB_RUN_IN_APP:
+        from .worker import WorkerPool
+        with startup.step("worker_pool"):
+            app.state.worker_pool = WorkerPool()
+            app.state.worker_pool.start()
+    # status dos exames ao vivo (SSE): com Postgres, LISTEN numa thread própria
+    exam_events.start()
+    startup.report()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    pool = getattr(app.state, "worker_pool", None)
+    if pool is not None:
+        pool.stop()
+    exam_events.stop()
+    await dispose_async_engine()
 
-# static e templates
+# static e templates (jinja2 só carrega na primeira tela, fora do cold start)
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
-templates = Jinja2Templates(directory="app/templates")
+
+@lru_cache(maxsize=1)
+def templates():
+    from fastapi.templating import Jinja2Templates
+    return Jinja2Templates(directory="app/templates")
 
 # =======================
 #   PACIENTES
@@ -58,42 +107,123 @@ def create_patient(p: PatientCreate, db: Session = Depends(get_db)):
     db.add(obj); db.commit(); db.refresh(obj)
     return obj
 
+# paginação keyset: o próximo cursor vem no header X-Next-Cursor (ausente na última página)
 @app.get("/patients", response_model=List[PatientOut])
-def list_patients(q: Optional[str] = Query(None), db: Session = Depends(get_db)):
-    qry = db.query(Patient)
-    if q:
-        like = f"%{q}%"
-        qry = qry.filter(
-            (Patient.name.ilike(like)) |
-            (Patient.cpf.ilike(like)) |
-            (Patient.whatsapp.ilike(like))
-        )
-    return qry.order_by(Patient.id.desc()).limit(100).all()
+async def list_patients(
+    response: Response,
+    q: Optional[str] = Query(None),
+    cursor: Optional[int] = Query(None),
+    limit: int = Query(100, ge=1, le=500),
+    db: AsyncSession = Depends(get_async_db),
+):
+    stmt = filter_patients(select(Patient), q)
+    patients, next_cursor = await apage_by_id(db, stmt, Patient.id, cursor, limit)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return patients
 
 @app.get("/patients/{patient_id}", response_model=PatientOut)
-def get_patient(patient_id: int, db: Session = Depends(get_db)):
-    obj = db.get(Patient, patient_id)  # SQLAlchemy 2.x
+async def get_patient(patient_id: int, db: AsyncSession = Depends(get_async_db)):
+    obj = await db.get(Patient, patient_id)  # SQLAlchemy 2.x
     if not obj:
         raise HTTPException(404, "Paciente não encontrado.")
     return obj
 
+# gráfico de tendência: lê os baldes mensais de patient_trends, não os exames
+@app.get("/patients/{patient_id}/trend", response_model=PatientTrendOut)
+async def get_patient_trend(
+    patient_id: int,
+    months: int = Query(24, ge=1, le=240),
+    window: int = Query(3, ge=1, le=24),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if not await db.get(Patient, patient_id):
+        raise HTTPException(404, "Paciente não encontrado.")
+    buckets = (await db.scalars(
+        select(PatientTrend).where(PatientTrend.patient_id == patient_id).order_by(PatientTrend.month)
+    )).all()
+    out = trends.trend(buckets, window)
+    out["points"] = out["points"][-months:]
+    return {"patient_id": patient_id, **out}
+
 # =======================
 #   EXAMES
 # =======================
+# exams é particionada por mês em created_at: since/until limitam as partições lidas
+def _exam_period(stmt, since: Optional[datetime], until: Optional[datetime]):
+    if since:
+        stmt = stmt.where(Exam.created_at >= since)
+    if until:
+        stmt = stmt.where(Exam.created_at < until)
+    return stmt
+
 @app.get("/exams", response_model=List[ExamOut])
-def list_exams(patient_id: Optional[int] = None, db: Session = Depends(get_db)):
-    qry = db.query(Exam)
+async def list_exams(patient_id: Optional[int] = None, since: Optional[datetime] = None,
+                     until: Optional[datetime] = None, db: AsyncSession = Depends(get_async_db)):
+    stmt = _exam_period(select(Exam), since, until)
     if patient_id:
-        qry = qry.filter(Exam.patient_id == patient_id)
-    return qry.order_by(Exam.id.desc()).limit(200).all()
+        stmt = stmt.where(Exam.patient_id == patient_id)
+    return (await db.scalars(stmt.order_by(Exam.id.desc()).limit(200))).all()
+
+# histórico de um paciente, do mais novo para o mais antigo (cursor = X-Next-Cursor)
+@app.get("/patients/{patient_id}/exams", response_model=List[ExamOut])
+async def list_patient_exams(
+    patient_id: int,
+    response: Response,
+    cursor: Optional[int] = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    db: AsyncSession = Depends(get_async_db),
+):
+    stmt = _exam_period(select(Exam).where(Exam.patient_id == patient_id), since, until)
+    exams, next_cursor = await apage_by_id(db, stmt, Exam.id, cursor, limit)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return exams
+
+# exportação em streaming (declarada antes de /exams/{exam_id})
+@app.get("/exams/export")
+def export_exams(
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+    patient_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    status: Optional[List[str]] = Query(None),
+):
+    try:
+        body = exam_export.stream(format, patient_id=patient_id, since=since, until=until, status=status)
+    except exam_export.ExportUnavailable as e:
+        raise HTTPException(501, str(e))
+    name = f"exames-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(body, media_type=exam_export.FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{name}"'})
 
 @app.get("/exams/{exam_id}", response_model=ExamOut)
-def get_exam(exam_id: int, db: Session = Depends(get_db)):
-    obj = db.get(Exam, exam_id)
+async def get_exam(exam_id: int, db: AsyncSession = Depends(get_async_db)):
+    obj = await db.get(Exam, exam_id)
     if not obj:
         raise HTTPException(404, "Exame não encontrado.")
     return obj
 
+# laudo/áudio: redirect para uma URL assinada do S3 (os bytes não passam pelo app)
+async def _redirect_to_object(exam_id: int, field: str, db: AsyncSession):
+    key = (await db.execute(select(getattr(Exam, field)).where(Exam.id == exam_id))).scalar_one_or_none()
+    if not key:
+        raise HTTPException(404, "Arquivo não disponível para este exame.")
+    if key.startswith(("http://", "https://")):  # registros antigos com URL completa
+        return RedirectResponse(key, status_code=302)
+    url = await run_in_threadpool(cached_presigned_url, key)
+    return RedirectResponse(url, status_code=302)
+
+@app.get("/exams/{exam_id}/report")
+async def exam_report(exam_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await _redirect_to_object(exam_id, "pdf_url", db)
+
+@app.get("/exams/{exam_id}/audio")
+async def exam_audio(exam_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await _redirect_to_object(exam_id, "audio_url", db)
+
 # =======================
 #   WhatsApp
 # =======================
@@ -112,6 +242,27 @@ def send_instructions(patient_id: int, db: Session = Depends(get_db)):
         raise HTTPException(500, f"Falha ao enviar WhatsApp: {e}")
     return {"ok": True}
 
+# Envio em massa: grava a campanha e responde; o envio roda nos workers
+@app.post("/campaigns/send-instructions", response_model=CampaignOut)
+def create_instructions_campaign(body: CampaignCreate, db: Session = Depends(get_db)):
+    if not body.patient_ids and not body.q:
+        raise HTTPException(400, "Informe patient_ids ou q.")
+    return create_campaign(db, body.template_name, body.lang, patient_ids=body.patient_ids, q=body.q)
+
+@app.get("/campaigns/{campaign_id}", response_model=CampaignOut)
+def get_campaign(campaign_id: int, db: Session = Depends(get_db)):
+    obj = db.get(Campaign, campaign_id)
+    if not obj:
+        raise HTTPException(404, "Campanha não encontrada.")
+    return obj
+
+@app.get("/campaigns/{campaign_id}/recipients", response_model=List[CampaignRecipientOut])
+def list_campaign_recipients(campaign_id: int, status: Optional[str] = None, db: Session = Depends(get_db)):
+    qry = db.query(CampaignRecipient).filter(CampaignRecipient.campaign_id == campaign_id)
+    if status:
+        qry = qry.filter(CampaignRecipient.status == status)
+    return qry.order_by(CampaignRecipient.id).limit(1000).all()
+
 # Verificação do webhook (GET)
 @app.get("/webhook/meta", response_class=PlainTextResponse)
 def verify_webhook(request: Request):
@@ -123,8 +274,12 @@ def verify_webhook(request: Request):
     return PlainTextResponse("erro", status_code=403)
 
 # Recebimento de mensagens (POST)
+# Só registra os jobs e responde: download/processamento/envio ficam com os workers,
+# senão a Meta estoura o timeout e reenvia o webhook.
 @app.post("/webhook/meta")
 def receive_webhook(payload: dict, db: Session = Depends(get_db)):
+    # o payload inteiro vira um INSERT multi-linha (ON CONFLICT DO NOTHING) e um commit
+    unique: dict = {}  # dedupe_key -> (kind, payload) (na ordem de chegada)
     try:
         entries = payload.get("entry", [])
         for entry in entries:
@@ -135,60 +290,79 @@ def receive_webhook(payload: dict, db: Session = Depends(get_db)):
                 for msg in messages:
                     from_wa = msg.get("from")  # número do paciente
                     _type = msg.get("type")
+                    msg_id = msg.get("id")
+
+                    # redelivery da Meta: já vimos essa mensagem neste processo
+                    if msg_id and seen_messages.seen(msg_id):
+                        continue
 
                     if _type == "audio":
                         media_id = msg.get("audio", {}).get("id")
-                        msg_id = msg.get("id")
-                        handle_audio_message(db, from_wa, media_id, msg_id)
+                        kind, job_payload = "audio_message", {"from": from_wa, "media_id": media_id, "msg_id": msg_id}
+                    else:
+                        kind, job_payload = "text_reply", {"to": from_wa, "text": "Por favor, envie uma mensagem de *áudio* para realizar o exame."}
+
+                    if not msg_id:
+                        jobs.enqueue(db, kind, job_payload, commit=False)
                     else:
-                        send_text(from_wa, "Por favor, envie uma mensagem de *áudio* para realizar o exame.")
+                        unique.setdefault(f"wa:{msg_id}", (kind, job_payload))
+
+        inserted = jobs.enqueue_unique_many(db, [(k, p, key) for key, (k, p) in unique.items()])
+        db.commit()
+        # só marca no LRU depois do commit (se falhar, a Meta reenvia e tentamos de novo)
+        for key in unique:
+            if key in inserted:
+                seen_messages.record_miss()
+            else:
+                # já enfileirada por outro processo/antes de um restart
+                seen_messages.record_db_hit()
+            seen_messages.add(key[len("wa:"):])
         return {"ok": True}
     except Exception as e:
+        db.rollback()
         return JSONResponse({"error": str(e)}, status_code=500)
 
-def handle_audio_message(db: Session, from_whatsapp: str, media_id: str, meta_message_id: str | None):
-    # 1) localizar paciente
-    patient = db.query(Patient).filter(Patient.whatsapp == from_whatsapp).first()
-    if not patient:
-        send_text(from_whatsapp, "Não encontrei seu cadastro. Peça ao seu médico para cadastrá-lo.")
-        return
-
-    # 2) criar exame como "processing"
-    # ATENÇÃO: seu modelo Exam não tem 'meta_message_id' no momento.
-    # Se desejar persistir, adicione a coluna no modelo + migre o banco.
-    exam = Exam(patient_id=patient.id, status="processing")
-    db.add(exam); db.commit(); db.refresh(exam)
-
-    # 3) baixar áudio da Meta
-    media_url = get_media_url(media_id)
-    audio_bytes = download_media(media_url)
-
-    # 4) subir áudio bruto (opcional, mas útil p/ auditoria)
-    audio_key = f"audios/patient_{patient.id}_exam_{exam.id}.ogg"
-    audio_url = upload_bytes(audio_key, audio_bytes, content_type="audio/ogg")
-    exam.audio_url = audio_url
-    db.commit()
-
-    # 5) processar
-    try:
-        metrics = process_audio_bytes(audio_bytes)  # sua função retorna métricas
-        pdf_bytes = build_pdf_bytes(patient.name, patient.cpf, metrics)
-
-        pdf_key = f"reports/patient_{patient.id}_exam_{exam.id}.pdf"
-        pdf_url = upload_bytes(pdf_key, pdf_bytes, content_type="application/pdf")
-        # Se você tiver a coluna em ExamResult, salve lá. No MVP, guarde no próprio Exam:
-        # exam.result = ExamResult(summary=..., pdf_url=pdf_url)  # se tiver a tabela
-        exam.status = "done"
-        # se quiser, crie fields pdf_url/summary em Exam (ou mantenha no ExamResult)
-        # por enquanto, vamos só enviar o PDF ao paciente:
-        db.commit()
+@app.get("/stats")
+def stats():
+    return {
+        "dedupe": seen_messages.stats(),
+        "presigned_urls": url_cache.stats(),
+        "results": result_cache.stats(),
+        "cpu_pool": cpu_pool.stats(),
+        "exam_events": exam_events.broker.stats(),
+    }
 
-        send_document(to_whatsapp=from_whatsapp, doc_url=pdf_url, caption="Seu resultado UroFlux")
-    except Exception:
-        exam.status = "failed"
-        db.commit()
-        send_text(from_whatsapp, "Houve um problema ao processar seu exame. Tente novamente mais tarde.")
-        raise
+# -----------------------
+#   MÉTRICAS (Prometheus)
+# -----------------------
+def _queue_depth():
+    with SessionLocal() as db:
+        for (kind, status), n in jobs.queue_depth(db).items():
+            yield "uroflux_jobs", {"kind": kind, "status": status}, n
+
+def _dedupe_hits():
+    st = seen_messages.stats()
+    for source in ("memory", "db"):
+        yield "uroflux_dedupe_hits_total", {"source": source}, st[f"hits_{source}"]
+
+def _dedupe_misses():
+    yield "uroflux_dedupe_misses_total", {}, seen_messages.stats()["misses"]
+
+def _result_cache():
+    st = result_cache.stats()
+    for outcome in ("hits_memory", "hits_s3", "misses"):
+        yield "uroflux_result_cache_total", {"outcome": outcome}, st[outcome]
+
+metrics.add_collector("uroflux_jobs", "Jobs na fila por tipo e status (exceto done).", "gauge", _queue_depth)
+metrics.add_collector("uroflux_dedupe_hits_total", "Mensagens repetidas do webhook, por onde foram barradas.",
+                      "counter", _dedupe_hits)
+metrics.add_collector("uroflux_dedupe_misses_total", "Mensagens novas do webhook.", "counter", _dedupe_misses)
+metrics.add_collector("uroflux_result_cache_total", "Consultas ao cache de resultados (hash do áudio).",
+                      "counter", _result_cache)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 # =======================
 #   UI (médico)
@@ -198,24 +372,19 @@ def home():
     return RedirectResponse(url="/web/patients")
 
 @app.get("/web/patients")
-def web_patients(request: Request, q: str | None = None, db: Session = Depends(get_db)):
-    qry = db.query(Patient)
-    if q:
-        like = f"%{q}%"
-        qry = qry.filter(
-            (Patient.name.ilike(like)) |
-            (Patient.cpf.ilike(like)) |
-            (Patient.whatsapp.ilike(like))
-        )
-    patients = qry.order_by(Patient.id.desc()).limit(200).all()
-    return templates.TemplateResponse(
+async def web_patients(request: Request, q: str | None = None, cursor: int | None = None,
+                       db: AsyncSession = Depends(get_async_db)):
+    stmt = filter_patients(select(Patient), q)
+    patients, next_cursor = await apage_by_id(db, stmt, Patient.id, cursor, 200)
+    return templates().TemplateResponse(
         "patients_list.html",
-        {"request": request, "patients": patients, "q": q or ""}
+        {"request": request, "patients": patients, "q": q or "",
+         "cursor": cursor, "next_cursor": next_cursor}
     )
 
 @app.get("/web/patients/new")
 def web_new_patient(request: Request):
-    return templates.TemplateResponse(
+    return templates().TemplateResponse(
         "patient_detail.html",
         {"request": request, "patient": None, "exams": [], "creating": True}
     )
@@ -241,14 +410,17 @@ def web_create_patient(
     return RedirectResponse(url=f"/web/patients/{p.id}", status_code=303)
 
 @app.get("/web/patients/{patient_id}")
-def web_patient_detail(request: Request, patient_id: int, db: Session = Depends(get_db)):
-    p = db.get(Patient, patient_id)
+async def web_patient_detail(request: Request, patient_id: int, cursor: int | None = None,
+                             db: AsyncSession = Depends(get_async_db)):
+    p = await db.get(Patient, patient_id)
     if not p:
         return RedirectResponse(url="/web/patients", status_code=303)
-    exams = db.query(Exam).filter(Exam.patient_id == patient_id).order_by(Exam.id.desc()).all()
-    return templates.TemplateResponse(
+    exams, next_cursor = await apage_by_id(db, select(Exam).where(Exam.patient_id == patient_id),
+                                           Exam.id, cursor, 50)
+    return templates().TemplateResponse(
         "patient_detail.html",
-        {"request": request, "patient": p, "exams": exams, "creating": False}
+        {"request": request, "patient": p, "exams": exams, "creating": False,
+         "cursor": cursor, "next_cursor": next_cursor}
     )
 
 @app.post("/web/patients/{patient_id}/send-instructions")
@@ -266,7 +438,40 @@ def web_send_instructions(patient_id: int, db: Session = Depends(get_db)):
         pass
     return RedirectResponse(url=f"/web/patients/{patient_id}", status_code=303)
 
+@app.post("/web/campaigns/send-instructions")
+def web_create_campaign(q: str = Form(""), db: Session = Depends(get_db)):
+    c = create_campaign(db, "uroflux_instrucoes_audio", "pt_BR", q=q or None)
+    return RedirectResponse(url=f"/web/campaigns/{c.id}", status_code=303)
+
+@app.get("/web/campaigns/{campaign_id}")
+def web_campaign_detail(request: Request, campaign_id: int, db: Session = Depends(get_db)):
+    c = db.get(Campaign, campaign_id)
+    if not c:
+        return RedirectResponse(url="/web/patients", status_code=303)
+    failed = (
+        db.query(CampaignRecipient)
+          .filter(CampaignRecipient.campaign_id == campaign_id, CampaignRecipient.status == "failed")
+          .order_by(CampaignRecipient.id).limit(200).all()
+    )
+    return templates().TemplateResponse(
+        "campaign_detail.html",
+        {"request": request, "campaign": c, "failed": failed}
+    )
+
 @app.get("/web/exams")
-def web_exams(request: Request, db: Session = Depends(get_db)):
-    exams = db.query(Exam).order_by(Exam.id.desc()).limit(200).all()
-    return templates.TemplateResponse("exams_list.html", {"request": request, "exams": exams})
+async def web_exams(request: Request, db: AsyncSession = Depends(get_async_db)):
+    # só os meses recentes: as partições antigas nem são abertas
+    since = datetime.utcnow() - timedelta(days=settings.EXAMS_HOT_DAYS)
+    exams = (await db.scalars(
+        select(Exam).where(Exam.created_at >= since).order_by(Exam.id.desc()).limit(200)
+    )).all()
+    return templates().TemplateResponse("exams_list.html", {"request": request, "exams": exams})
+
+@app.get("/web/exams/events")
+async def web_exam_events(request: Request, patient_id: Optional[int] = None):
+    """Status dos exames ao vivo (text/event-stream); as telas atualizam as linhas no lugar."""
+    return StreamingResponse(
+        exam_events.sse_stream(request.headers.get("last-event-id"), request.is_disconnected, patient_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,130 @@
+# app/media.py
+# Buffer único para a mídia baixada da Meta. Pequena fica em memória; passando
+# de MEDIA_SPOOL_MAX_MEMORY vai para um arquivo temporário, lido via mmap.
+# Upload e decodificação leem o mesmo buffer por memoryview, sem cópias extras;
+# para o pool de processos o arquivo vai pelo caminho (SpooledFile), não pelos bytes.
+import io
+import mmap
+import tempfile
+from contextlib import contextmanager
+from typing import NamedTuple, Optional, Union
+
+from .settings import settings
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class SpooledFile(NamedTuple):
+    """Mídia em disco entregue a outro processo pelo caminho (ele faz o próprio mmap)."""
+    path: str
+    size: int
+
+
+@contextmanager
+def shared_view(data: Union[bytes, memoryview, SpooledFile]):
+    """memoryview do conteúdo; com SpooledFile, abre e mapeia o arquivo enquanto durar o with."""
+    if not isinstance(data, SpooledFile):
+        yield data
+        return
+    if data.size == 0:
+        yield memoryview(b"")
+        return
+    with open(data.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            yield view
+        finally:
+            view.release()
+
+
+class MediaBuffer:
+    def __init__(self, max_bytes: Optional[int] = None, max_memory: Optional[int] = None):
+        self.max_bytes = max_bytes if max_bytes is not None else settings.MEDIA_MAX_BYTES
+        self.max_memory = max_memory if max_memory is not None else settings.MEDIA_SPOOL_MAX_MEMORY
+        self._file = io.BytesIO()
+        self._on_disk = False
+        self._mmap: Optional[mmap.mmap] = None
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        if self.size + len(chunk) > self.max_bytes:
+            raise MediaTooLarge(f"mídia maior que {self.max_bytes} bytes")
+        if not self._on_disk and self.size + len(chunk) > self.max_memory:
+            # com nome: o pool de CPU abre o mesmo arquivo (ver shareable)
+            disk = tempfile.NamedTemporaryFile(prefix="uroflux-media-")
+            disk.write(self._file.getbuffer())
+            self._file = disk
+            self._on_disk = True
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def view(self) -> memoryview:
+        """memoryview somente leitura de todo o conteúdo (mmap se estiver em disco)."""
+        if not self._on_disk:
+            return self._file.getbuffer().toreadonly()
+        if self._mmap is None:
+            self._file.flush()
+            if self.size == 0:
+                return memoryview(b"")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def shareable(self) -> Union[bytes, SpooledFile]:
+        """Para outro processo: em disco vai o caminho; em memória (até MEDIA_SPOOL_MAX_MEMORY), a cópia."""
+        if self._on_disk:
+            self._file.flush()
+            return SpooledFile(self._file.name, self.size)
+        return bytes(self.view())
+
+    def reader(self) -> "ViewReader":
+        """Leitor de arquivo independente (posição própria) sobre o mesmo buffer."""
+        return ViewReader(self.view())
+
+    def close(self) -> None:
+        # se ainda houver memoryview vivo (ex.: preso num traceback), o
+        # fechamento fica para o GC em vez de mascarar o erro original
+        try:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            self._file.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ViewReader(io.RawIOBase):
+    """Interface de arquivo (read/seek) sobre um memoryview, para o boto3."""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = min(len(b), len(self._view) - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
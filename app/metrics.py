@@ -0,0 +1,175 @@
+# app/metrics.py
+# Métricas do processo no formato texto do Prometheus (GET /metrics), sem
+# dependência externa. No caminho quente é só perf_counter + bisect + um lock
+# por observação; valores caros (profundidade da fila etc.) são lidos na hora
+# do scrape por coletores registrados com add_collector().
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from .settings import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(2 ** p for p in range(10, 26, 2))  # 1 KiB .. 32 MiB
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]  # (nome, labels, valor)
+
+
+def _num(v: float) -> str:
+    # sem notação científica truncada: contadores grandes precisam sair exatos
+    if v == float("inf"):
+        return "+Inf"
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def _fmt_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+    return "{" + body + "}"
+
+
+class Counter:
+    def __init__(self, name: str, doc: str):
+        self.name, self.doc, self.type = name, doc, "counter"
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, v in items:
+            yield self.name, key, v
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, buckets: Sequence[float]):
+        self.name, self.doc, self.type = name, doc, "histogram"
+        self.buckets = tuple(buckets)
+        # labels -> [contagem por bucket..., +Inf], soma
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][i] += 1
+            entry[1][0] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(c), s[0]) for k, (c, s) in self._values.items()]
+        for key, counts, total in items:
+            acc = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                acc += n
+                yield self.name + "_bucket", key + (("le", _num(bound)),), acc
+            yield self.name + "_count", key, acc
+            yield self.name + "_sum", key, total
+
+
+_metrics: List = []
+_collectors: List[Tuple[str, str, str, Callable[[], Iterable[Sample]]]] = []
+
+
+def counter(name: str, doc: str) -> Counter:
+    m = Counter(name, doc)
+    _metrics.append(m)
+    return m
+
+
+def histogram(name: str, doc: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    m = Histogram(name, doc, buckets)
+    _metrics.append(m)
+    return m
+
+
+def add_collector(name: str, doc: str, type_: str, fn: Callable[[], Iterable[Sample]]):
+    """Métrica calculada no scrape: fn() devolve (nome, labels, valor)."""
+    _collectors.append((name, doc, type_, fn))
+
+
+# ---------- métricas do pipeline ----------
+stage_seconds = histogram("uroflux_stage_seconds", "Latência de cada etapa do exame.")
+stage_bytes = histogram("uroflux_stage_bytes", "Bytes tratados por etapa do exame.", BYTES_BUCKETS)
+exams_total = counter("uroflux_exams_total", "Exames por status final.")
+graph_errors_total = counter("uroflux_graph_errors_total",
+                             "Erros nas chamadas à Graph API (inclui os que tiveram retry).")
+
+
+@contextmanager
+def stage(name: str):
+    """Mede a etapa `name` (também quando ela falha)."""
+    if not settings.METRICS_ENABLED:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - t0, stage=name)
+
+
+def observe_seconds(name: str, seconds: float):
+    """Etapa medida em outro lugar (ex.: num processo do pool de CPU)."""
+    if settings.METRICS_ENABLED:
+        stage_seconds.observe(seconds, stage=name)
+
+
+def observe_bytes(name: str, n: int):
+    if settings.METRICS_ENABLED:
+        stage_bytes.observe(n, stage=name)
+
+
+def render() -> str:
+    out: List[str] = []
+    for m in _metrics:
+        out.append(f"# HELP {m.name} {m.doc}")
+        out.append(f"# TYPE {m.name} {m.type}")
+        for name, labels, v in m.samples():
+            out.append(f"{name}{_fmt_labels(labels)} {_num(v)}")
+    for name, doc, type_, fn in _collectors:
+        try:
+            samples = list(fn())
+        except Exception as e:  # um coletor quebrado não derruba o scrape
+            print(f"[metrics] coletor {name} falhou: {type(e).__name__}: {e}")
+            continue
+        out.append(f"# HELP {name} {doc}")
+        out.append(f"# TYPE {name} {type_}")
+        for sname, labels, v in samples:
+            out.append(f"{sname}{_fmt_labels(tuple(sorted(labels.items())))} {_num(v)}")
+    return "\n".join(out) + "\n"
+
+
+def serve(port: int, host: str = "0.0.0.0"):
+    """/metrics em thread própria, para o processo worker (que não tem o FastAPI)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    srv = ThreadingHTTPServer((host, port), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="metrics", daemon=True).start()
+    return srv
@@ -0,0 +1,123 @@
+# app/migrations.py
+# Migrações mínimas e idempotentes. create_all só cria tabelas novas; colunas
+# e índices em tabelas que já existem precisam passar por aqui.
+# Rodam como passo explícito de deploy:  python -m app.migrations
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from .db import Base, engine
+from . import models  # noqa: F401  (registra as tabelas em Base.metadata)
+from .normalize import fold_text, only_digits
+
+
+def _add_column_if_missing(conn: Connection, table: str, column: str, ddl: str):
+    cols = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in cols:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _0001_message_idempotency(conn: Connection):
+    _add_column_if_missing(conn, "exams", "meta_message_id", "VARCHAR(64)")
+    _add_column_if_missing(conn, "jobs", "dedupe_key", "VARCHAR(128)")
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_exams_meta_message_id ON exams (meta_message_id)"
+    ))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_jobs_dedupe_key ON jobs (dedupe_key)"
+    ))
+
+
+def _0002_patient_search_columns(conn: Connection):
+    _add_column_if_missing(conn, "patients", "name_search", "VARCHAR(255)")
+    _add_column_if_missing(conn, "patients", "cpf_digits", "VARCHAR(14)")
+    _add_column_if_missing(conn, "patients", "whatsapp_digits", "VARCHAR(32)")
+
+    # backfill em lotes (a normalização é feita em Python, sem depender de unaccent)
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, name, cpf, whatsapp FROM patients WHERE id > :last ORDER BY id LIMIT 1000"
+        ), {"last": last_id}).fetchall()
+        if not rows:
+            break
+        conn.execute(
+            text("UPDATE patients SET name_search = :n, cpf_digits = :c, whatsapp_digits = :w WHERE id = :id"),
+            [{"id": r.id, "n": fold_text(r.name), "c": only_digits(r.cpf), "w": only_digits(r.whatsapp)}
+             for r in rows],
+        )
+        last_id = rows[-1].id
+
+    if conn.dialect.name == "postgresql":
+        using = "USING gin ({col} gin_trgm_ops)"
+    else:
+        using = "({col})"
+    for col in ("name_search", "cpf_digits", "whatsapp_digits"):
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_patients_{col}_trgm ON patients " + using.format(col=col)
+        ))
+
+
+def _0003_exam_audio_hash(conn: Connection):
+    _add_column_if_missing(conn, "exams", "audio_sha256", "VARCHAR(64)")
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_exams_audio_sha256 ON exams (audio_sha256)"))
+
+
+def _0004_exam_messages(conn: Connection):
+    # unicidade por mensagem sai de exams (não sobrevive ao particionamento) e vai
+    # para exam_messages (criada pelo create_all); na dúvida fica o exame mais antigo
+    conn.execute(text(
+        "INSERT INTO exam_messages (meta_message_id, exam_id) "
+        "SELECT e.meta_message_id, min(e.id) FROM exams e "
+        "WHERE e.meta_message_id IS NOT NULL AND NOT EXISTS "
+        "(SELECT 1 FROM exam_messages m WHERE m.meta_message_id = e.meta_message_id) "
+        "GROUP BY e.meta_message_id"
+    ))
+    conn.execute(text("DROP INDEX IF EXISTS ux_exams_meta_message_id"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_exams_patient_id"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_exams_meta_message_id ON exams (meta_message_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_exams_patient_id_id ON exams (patient_id, id)"))
+    using = "USING brin (created_at)" if conn.dialect.name == "postgresql" else "(created_at)"
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_exams_created_at_brin ON exams {using}"))
+
+
+def _0005_exams_partitioned(conn: Connection):
+    from .partitions import convert_exams
+
+    convert_exams(conn)  # só Postgres; copia a tabela inteira com ela travada
+
+
+MIGRATIONS = [
+    ("0001_message_idempotency", _0001_message_idempotency),
+    ("0002_patient_search_columns", _0002_patient_search_columns),
+    ("0003_exam_audio_hash", _0003_exam_audio_hash),
+    ("0004_exam_messages", _0004_exam_messages),
+    ("0005_exams_partitioned", _0005_exams_partitioned),
+]
+
+
+def upgrade(engine: Engine):
+    if engine.dialect.name == "postgresql":
+        # os índices GIN trigram de patients dependem da extensão já no create_all
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations (id VARCHAR(128) PRIMARY KEY)"
+        ))
+        done = {r[0] for r in conn.execute(text("SELECT id FROM schema_migrations"))}
+        for mig_id, fn in MIGRATIONS:
+            if mig_id in done:
+                continue
+            fn(conn)
+            conn.execute(text("INSERT INTO schema_migrations (id) VALUES (:id)"), {"id": mig_id})
+            print(f"[migrations] aplicada {mig_id}")
+
+
+def main():
+    upgrade(engine)
+    print("[migrations] schema em dia")
+
+
+if __name__ == "__main__":
+    main()
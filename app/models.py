@@ -1,7 +1,8 @@
 # app/models.py
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Date, DateTime, Float, ForeignKey, Text, JSON, Index
+from sqlalchemy.orm import relationship, validates
 from .db import Base
+from .normalize import fold_text, only_digits
 from datetime import datetime
 
 class Patient(Base):
@@ -12,19 +13,201 @@ class Patient(Base):
     whatsapp = Column(String(32), index=True, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
+    # colunas de busca (preenchidas pelos @validates abaixo), com índice trigram no Postgres
+    name_search = Column(String(255), nullable=True)     # minúsculo, sem acento
+    cpf_digits = Column(String(14), nullable=True)       # só dígitos
+    whatsapp_digits = Column(String(32), nullable=True)  # só dígitos
+
     exams = relationship("Exam", back_populates="patient")
 
+    __table_args__ = (
+        Index("ix_patients_name_search_trgm", "name_search",
+              postgresql_using="gin", postgresql_ops={"name_search": "gin_trgm_ops"}),
+        Index("ix_patients_cpf_digits_trgm", "cpf_digits",
+              postgresql_using="gin", postgresql_ops={"cpf_digits": "gin_trgm_ops"}),
+        Index("ix_patients_whatsapp_digits_trgm", "whatsapp_digits",
+              postgresql_using="gin", postgresql_ops={"whatsapp_digits": "gin_trgm_ops"}),
+    )
+
+    @validates("name")
+    def _set_name(self, key, value):
+        self.name_search = fold_text(value)
+        return value
+
+    @validates("cpf")
+    def _set_cpf(self, key, value):
+        self.cpf_digits = only_digits(value)
+        return value
+
+    @validates("whatsapp")
+    def _set_whatsapp(self, key, value):
+        self.whatsapp_digits = only_digits(value)
+        return value
+
 class Exam(Base):
+    """
+    No Postgres é particionada por mês em created_at (ver app/partitions.py): a PK
+    no banco é (id, created_at) e filtros por created_at podam as partições.
+    """
     __tablename__ = "exams"
     id = Column(Integer, primary_key=True, index=True)
-    patient_id = Column(Integer, ForeignKey("patients.id"), nullable=False, index=True)
+    patient_id = Column(Integer, ForeignKey("patients.id"), nullable=False)
 
     # novos campos para casar com o main.py
-    meta_message_id = Column(String(64), nullable=True)  # id da mensagem do WhatsApp
+    meta_message_id = Column(String(64), nullable=True)  # id da mensagem do WhatsApp (único via ExamMessage)
     audio_url = Column(Text, nullable=True)              # onde guardamos o áudio
     pdf_url = Column(Text, nullable=True)                # onde guardamos o PDF
+    audio_sha256 = Column(String(64), nullable=True, index=True)  # hash do áudio (chave no S3 e no cache)
 
     status = Column(String(32), default="received", nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     patient = relationship("Patient", back_populates="exams")
+    # carregado junto (selectin): as rotas async não podem fazer lazy load
+    result = relationship("ExamResult", primaryjoin="Exam.id == foreign(ExamResult.exam_id)",
+                          uselist=False, lazy="selectin", viewonly=True)
+
+    __table_args__ = (
+        Index("ix_exams_patient_id_id", "patient_id", "id"),  # histórico paginado do paciente
+        Index("ix_exams_created_at_brin", "created_at", postgresql_using="brin"),
+        Index("ix_exams_meta_message_id", "meta_message_id"),
+    )
+
+class ExamMessage(Base):
+    """
+    Uma mensagem do WhatsApp = um exame: redelivery da Meta não pode gerar um 2º.
+    Fica fora de exams porque, numa tabela particionada, índice único só vale
+    com a chave de partição (created_at) junto.
+    """
+    __tablename__ = "exam_messages"
+    meta_message_id = Column(String(64), primary_key=True)
+    exam_id = Column(Integer, nullable=False)
+
+class ExamResult(Base):
+    """
+    Métricas de um exame concluído, em colunas (antes só existiam no laudo e no
+    cache por áudio). Sem FK para exams: a PK da tabela particionada é (id, created_at).
+    """
+    __tablename__ = "exam_results"
+    id = Column(Integer, primary_key=True, index=True)
+    exam_id = Column(Integer, nullable=False)
+    patient_id = Column(Integer, ForeignKey("patients.id"), nullable=False)
+    exam_created_at = Column(DateTime, nullable=False)
+    month = Column(Date, nullable=False)  # mês do exame, balde da tendência
+    pipeline_version = Column(String(16), nullable=False)
+
+    duracao_s = Column(Float, nullable=False)
+    vazao_max_ml_s = Column(Float, nullable=False)
+    vazao_media_ml_s = Column(Float, nullable=False)
+    volume_total_ml = Column(Float, nullable=False)
+    tempo_ate_pico_s = Column(Float, nullable=False)
+    duracao_gravacao_s = Column(Float, nullable=False)
+    classe_dominante = Column(String(32), nullable=True)
+
+    summary = Column(Text, nullable=True)
+    pdf_url = Column(Text, nullable=True)  # chave do laudo no S3
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ux_exam_results_exam_id", "exam_id", unique=True),
+        Index("ix_exam_results_patient_month", "patient_id", "month"),
+    )
+
+class PatientTrend(Base):
+    """
+    Agregado por paciente e mês, atualizado a cada exame concluído (ver
+    app/trends.py): o gráfico de tendência lê alguns baldes, não o histórico.
+    Médias = soma / exams.
+    """
+    __tablename__ = "patient_trends"
+    patient_id = Column(Integer, ForeignKey("patients.id"), primary_key=True)
+    month = Column(Date, primary_key=True)
+    exams = Column(Integer, default=0, nullable=False)
+    vazao_max_max = Column(Float, default=0.0, nullable=False)
+    vazao_max_sum = Column(Float, default=0.0, nullable=False)
+    vazao_media_sum = Column(Float, default=0.0, nullable=False)
+    volume_max = Column(Float, default=0.0, nullable=False)
+    volume_sum = Column(Float, default=0.0, nullable=False)
+    last_exam_at = Column(DateTime, nullable=True)
+
+class ExamArchiveMonth(Base):
+    """Meses de exames cujos áudios já foram para o prefixo de arquivo."""
+    __tablename__ = "exam_archive_months"
+    month = Column(Date, primary_key=True)  # primeiro dia do mês
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    audios = Column(Integer, default=0, nullable=False)
+
+class Job(Base):
+    """
+    Fila de trabalhos duráveis (ex.: processar um áudio recebido pelo webhook).
+    Os workers reivindicam linhas com SELECT ... FOR UPDATE SKIP LOCKED (ver app/jobs.py).
+    """
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(64), nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+    # ex.: "wa:<id da mensagem>"; redeliveries da Meta caem no mesmo job
+    dedupe_key = Column(String(128), nullable=True)
+
+    # queued -> running -> done | failed
+    status = Column(String(16), default="queued", nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    run_after = Column(DateTime, default=datetime.utcnow, nullable=False)
+    locked_until = Column(DateTime, nullable=True)       # visibility timeout
+    locked_by = Column(String(64), nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_jobs_claim", "status", "run_after"),
+        Index("ux_jobs_dedupe_key", "dedupe_key", unique=True),
+    )
+
+class SendRate(Base):
+    """
+    Token bucket compartilhado do envio de campanhas (um por número de WhatsApp).
+    Web e workers tiram fichas desta linha (ver campaigns.take_tokens), então o
+    limite vale para o deploy inteiro e não por processo.
+    """
+    __tablename__ = "send_rates"
+    key = Column(String(64), primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)  # time.time() do último refill
+
+class Campaign(Base):
+    """Envio em massa de um template (ex.: instruções do exame) para vários pacientes."""
+    __tablename__ = "campaigns"
+    id = Column(Integer, primary_key=True, index=True)
+    template_name = Column(String(128), nullable=False)
+    lang = Column(String(16), default="pt_BR", nullable=False)
+
+    # queued -> running -> done
+    status = Column(String(16), default="queued", nullable=False)
+    total = Column(Integer, default=0, nullable=False)
+    sent = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+    recipients = relationship("CampaignRecipient", back_populates="campaign")
+
+class CampaignRecipient(Base):
+    __tablename__ = "campaign_recipients"
+    id = Column(Integer, primary_key=True, index=True)
+    campaign_id = Column(Integer, ForeignKey("campaigns.id"), nullable=False)
+    patient_id = Column(Integer, ForeignKey("patients.id"), nullable=False)
+    whatsapp = Column(String(32), nullable=False)
+
+    # pending -> sent | failed
+    status = Column(String(16), default="pending", nullable=False)
+    error = Column(Text, nullable=True)
+    sent_at = Column(DateTime, nullable=True)
+
+    campaign = relationship("Campaign", back_populates="recipients")
+
+    __table_args__ = (
+        Index("ix_campaign_recipients_campaign_status", "campaign_id", "status"),
+    )
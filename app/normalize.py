@@ -0,0 +1,18 @@
+# app/normalize.py
+# Formas normalizadas usadas na busca de pacientes (colunas *_search/*_digits).
+import re
+import unicodedata
+
+_NON_DIGITS = re.compile(r"\D+")
+
+
+def fold_text(value: str | None) -> str:
+    """minúsculas e sem acento: 'José Conceição' -> 'jose conceicao'"""
+    if not value:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower().strip()
+
+
+def only_digits(value: str | None) -> str:
+    return _NON_DIGITS.sub("", value or "")
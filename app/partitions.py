@@ -0,0 +1,243 @@
+# app/partitions.py
+# exams particionada por mês em created_at (só Postgres; no SQLite é uma
+# tabela comum e as funções daqui viram no-op, menos o arquivamento).
+#   - exams_yYYYYmMM: uma partição por mês (UTC, como o created_at), criadas
+#     EXAMS_PARTITIONS_AHEAD meses adiante pelo worker (ensure_partitions);
+#     exams_default pega o que cair fora e é esvaziada quando o mês é criado
+#   - índices no pai: BRIN em created_at (varredura por período quase de graça),
+#     (patient_id, id) para o histórico paginado, audio_sha256 e meta_message_id.
+#     A PK vira (id, created_at): todo índice único precisa da chave de partição,
+#     por isso "uma mensagem = um exame" passou para exam_messages
+#   - arquivamento (python -m app.partitions archive): áudios de meses com mais de
+#     EXAMS_ARCHIVE_AFTER_MONTHS vão para EXAMS_ARCHIVE_PREFIX numa classe de
+#     armazenamento mais barata; exams.audio_url passa a apontar para a cópia
+#
+#   python -m app.partitions ensure
+#   python -m app.partitions archive [--dry-run] [--months N]
+import argparse
+from datetime import date, datetime
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, insert, select, text, update
+from sqlalchemy.engine import Connection, Engine
+
+from .models import Exam, ExamArchiveMonth
+from .settings import settings
+
+# chave do pg_advisory_xact_lock: um processo por vez cria partições
+_LOCK_KEY = 0x75726F66  # "urof"
+
+
+def month_start(d) -> date:
+    return date(d.year, d.month, 1)
+
+
+def add_months(d: date, n: int) -> date:
+    y, m = divmod(d.month - 1 + n, 12)
+    return date(d.year + y, m + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"exams_y{month.year:04d}m{month.month:02d}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return bool(conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('exams')"
+    )).first())
+
+
+def _create_month(conn: Connection, month: date) -> bool:
+    """Cria a partição do mês (movendo o que estiver na default). True se criou."""
+    name = partition_name(month)
+    if conn.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar() is not None:
+        return False
+    bounds = {"lo": datetime.combine(month, datetime.min.time()),
+              "hi": datetime.combine(add_months(month, 1), datetime.min.time())}
+    moved = conn.execute(text(
+        "SELECT count(*) FROM exams_default WHERE created_at >= :lo AND created_at < :hi"
+    ), bounds).scalar()
+    lo, hi = bounds["lo"].isoformat(sep=" "), bounds["hi"].isoformat(sep=" ")
+    if not moved:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF exams FOR VALUES FROM ('{lo}') TO ('{hi}')"))
+        return True
+    # a default já tem linhas do mês: o ATTACH recusaria. Cria solta, move, anexa.
+    conn.execute(text(f"CREATE TABLE {name} (LIKE exams INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM exams_default WHERE created_at >= :lo AND created_at < :hi RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), bounds)
+    conn.execute(text(f"ALTER TABLE exams ATTACH PARTITION {name} FOR VALUES FROM ('{lo}') TO ('{hi}')"))
+    print(f"[partitions] {name}: {moved} exames movidos da exams_default")
+    return True
+
+
+def ensure_partitions(conn: Connection, ahead: Optional[int] = None,
+                      first: Optional[date] = None) -> List[str]:
+    """Garante as partições de `first` (padrão: mês atual) até `ahead` meses adiante."""
+    if not is_partitioned(conn):
+        return []
+    if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": _LOCK_KEY}).scalar():
+        return []  # outro processo está cuidando disso
+    ahead = settings.EXAMS_PARTITIONS_AHEAD if ahead is None else ahead
+    month = first or month_start(datetime.utcnow())
+    last = add_months(month_start(datetime.utcnow()), ahead)
+    created = []
+    while month <= last:
+        if _create_month(conn, month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def convert_exams(conn: Connection) -> None:
+    """
+    Migração: troca a exams comum por uma particionada com os mesmos dados, numa
+    transação (a tabela fica travada durante a cópia). Sequência do id, FK para
+    patients e nomes dos índices são preservados.
+    """
+    if conn.dialect.name != "postgresql" or is_partitioned(conn):
+        return
+    conn.execute(text("LOCK TABLE exams IN ACCESS EXCLUSIVE MODE"))
+    conn.execute(text("ALTER TABLE exams RENAME TO exams_old"))
+    for (idx,) in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'exams_old'")).all():
+        conn.execute(text(f'ALTER INDEX "{idx}" RENAME TO "{idx[:55]}_old"'))
+    conn.execute(text(
+        "CREATE TABLE exams (LIKE exams_old INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        "PARTITION BY RANGE (created_at)"
+    ))
+    conn.execute(text("ALTER TABLE exams ADD CONSTRAINT exams_pkey PRIMARY KEY (id, created_at)"))
+    conn.execute(text(
+        "ALTER TABLE exams ADD CONSTRAINT exams_patient_id_fkey FOREIGN KEY (patient_id) REFERENCES patients (id)"
+    ))
+    conn.execute(text("CREATE TABLE exams_default PARTITION OF exams DEFAULT"))
+    # mesmos nomes do models.Exam; ix_exams_id não entra: a PK (id, created_at) já serve
+    conn.execute(text("CREATE INDEX ix_exams_created_at_brin ON exams USING brin (created_at)"))
+    conn.execute(text("CREATE INDEX ix_exams_patient_id_id ON exams (patient_id, id)"))
+    conn.execute(text("CREATE INDEX ix_exams_audio_sha256 ON exams (audio_sha256)"))
+    conn.execute(text("CREATE INDEX ix_exams_meta_message_id ON exams (meta_message_id)"))
+
+    oldest = conn.execute(text("SELECT min(created_at) FROM exams_old")).scalar()
+    ensure_partitions(conn, first=month_start(oldest) if oldest else None)
+    conn.execute(text("INSERT INTO exams SELECT * FROM exams_old"))
+    seq = conn.execute(text("SELECT pg_get_serial_sequence('exams_old', 'id')")).scalar()
+    if seq:
+        conn.execute(text(f"ALTER SEQUENCE {seq} OWNED BY exams.id"))  # sobrevive ao DROP
+    conn.execute(text("DROP TABLE exams_old"))
+
+
+# ---------- arquivamento ----------
+def _months_to_archive(conn: Connection, cutoff: date) -> List[date]:
+    oldest = conn.execute(select(func.min(Exam.created_at)).where(Exam.created_at < cutoff)).scalar()
+    if oldest is None:
+        return []
+    done = set(conn.execute(select(ExamArchiveMonth.month)).scalars())
+    months, m = [], month_start(oldest)
+    while m < cutoff:
+        if m not in done:
+            months.append(m)
+        m = add_months(m, 1)
+    return months
+
+
+def _month_rows(conn: Connection, month: date, batch: int = 500) -> Iterator[List[Tuple]]:
+    """(id, created_at, audio_url, audio_sha256) do mês, em lotes por id."""
+    lo = datetime.combine(month, datetime.min.time())
+    hi = datetime.combine(add_months(month, 1), datetime.min.time())
+    last = 0
+    while True:
+        rows = conn.execute(
+            select(Exam.id, Exam.created_at, Exam.audio_url, Exam.audio_sha256)
+              .where(Exam.created_at >= lo, Exam.created_at < hi, Exam.id > last, Exam.audio_url.is_not(None))
+              .order_by(Exam.id).limit(batch)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+
+def _referenced(conn: Connection, key: str, sha: Optional[str]) -> bool:
+    # sem hash é registro antigo, com uma chave por exame: ninguém mais a usa
+    return sha is not None and conn.execute(
+        select(Exam.id).where(Exam.audio_sha256 == sha, Exam.audio_url == key).limit(1)
+    ).first() is not None
+
+
+def archive_month(engine: Engine, month: date, dry_run: bool = False) -> int:
+    """Copia os áudios do mês para o prefixo de arquivo e repointa os exames. Devolve quantos."""
+    from .storage import copy_object, delete_object, key_from_url, object_exists
+
+    prefix = settings.EXAMS_ARCHIVE_PREFIX
+    # created_at no WHERE: o UPDATE só toca a partição do mês
+    repoint = (update(Exam)
+               .where(Exam.id == bindparam("b_id"), Exam.created_at == bindparam("b_created_at"))
+               .values(audio_url=bindparam("b_url")))
+    moved = 0
+    originals = {}  # chave quente -> hash do áudio
+    with engine.connect() as conn:
+        for rows in _month_rows(conn, month):
+            updates = []
+            for exam_id, created_at, audio_url, sha in rows:
+                key = key_from_url(audio_url)
+                if not key or key.startswith(prefix):
+                    continue
+                dst = prefix + key
+                if not dry_run and not object_exists(dst):
+                    copy_object(key, dst, storage_class=settings.EXAMS_ARCHIVE_STORAGE_CLASS)
+                updates.append({"b_id": exam_id, "b_created_at": created_at, "b_url": dst})
+                originals[key] = sha
+            if updates and not dry_run:
+                conn.execute(repoint, updates)
+                conn.commit()
+            moved += len(updates)
+        if dry_run:
+            return moved
+        # o áudio é endereçado por conteúdo: o mesmo arquivo pode estar num exame
+        # recente, que continua apontando para a chave quente
+        for key, sha in originals.items():
+            if _referenced(conn, key, sha):
+                continue
+            delete_object(key)
+            conn.commit()  # enxerga o que foi gravado durante o delete
+            if _referenced(conn, key, sha):  # exame novo pulou o upload por achar a chave
+                copy_object(prefix + key, key)
+        conn.execute(insert(ExamArchiveMonth).values(month=month, archived_at=datetime.utcnow(), audios=moved))
+        conn.commit()
+    return moved
+
+
+def archive(engine: Engine, after_months: Optional[int] = None, dry_run: bool = False) -> None:
+    after_months = settings.EXAMS_ARCHIVE_AFTER_MONTHS if after_months is None else after_months
+    cutoff = add_months(month_start(datetime.utcnow()), -after_months)
+    with engine.connect() as conn:
+        months = _months_to_archive(conn, cutoff)
+    if not months:
+        print(f"[partitions] nada para arquivar antes de {cutoff}")
+    for month in months:
+        n = archive_month(engine, month, dry_run=dry_run)
+        print(f"[partitions] {partition_name(month)}: {n} áudios {'a arquivar' if dry_run else 'arquivados'}")
+
+
+def main():
+    from .db import engine
+
+    ap = argparse.ArgumentParser(description="Partições mensais de exams e arquivamento dos áudios.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("ensure", help="cria as partições do mês atual e dos próximos")
+    arc = sub.add_parser("archive", help="move os áudios dos meses antigos para o prefixo de arquivo")
+    arc.add_argument("--months", type=int, default=None, help="idade mínima em meses (padrão: settings)")
+    arc.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+    if args.cmd == "ensure":
+        with engine.begin() as conn:
+            created = ensure_partitions(conn)
+        print(f"[partitions] criadas: {', '.join(created) or 'nenhuma'}")
+    else:
+        archive(engine, args.months, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+# app/pipeline.py
+# Processamento das mensagens recebidas pelo webhook. Roda nos workers da fila
+# (app/worker.py), nunca dentro da requisição do webhook.
+# storage/processing/report (boto3, numpy, reportlab) são importados no uso:
+# registrar os handlers não pode custar o startup do web/worker.
+#
+# Os áudios chegam em lote (jobs.run_jobs): uma consulta de idempotência, uma
+# busca de pacientes (IN + cache), um INSERT dos exames e um commit com o
+# resultado de todo o lote. Download/análise/upload/envio rodam em paralelo
+# (PIPELINE_CONCURRENCY); a Session fica só na thread do worker.
+#
+# Áudio e laudo são endereçados por conteúdo (sha256): o mesmo áudio não é
+# enviado de novo ao S3, e as métricas vêm do cache (hash, PIPELINE_VERSION).
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import events, trends
+from .jobs import ATTEMPT_KEY, handler, batch_handler, is_last_attempt
+from .metrics import stage, observe_bytes, observe_seconds, exams_total
+from .models import Patient, Exam, ExamMessage
+from .media import MediaTooLarge
+from .settings import settings
+from .whatsapp import send_text, send_document, get_media_url, download_media_to
+
+# suba ao mudar a análise (processing.py) ou o laudo (report.py): invalida o
+# cache de resultados e os PDFs já gerados para o mesmo áudio
+PIPELINE_VERSION = "1"
+
+MSG_NOT_REGISTERED = "Não encontrei seu cadastro. Peça ao seu médico para cadastrá-lo."
+MSG_TOO_LARGE = "Seu áudio é grande demais. Grave novamente um áudio mais curto."
+MSG_FAILED = "Houve um problema ao processar seu exame. Tente novamente mais tarde."
+
+
+def report_key(audio_sha256: str, patient_id: int) -> str:
+    # o laudo leva nome/CPF: só é reaproveitado para o mesmo paciente
+    return f"reports/{PIPELINE_VERSION}/{audio_sha256}/patient_{patient_id}.pdf"
+
+
+class PatientRef(NamedTuple):
+    id: int
+    name: str
+    cpf: str
+
+
+class PatientCache:
+    """whatsapp -> PatientRef por alguns segundos (só acertos; cadastro novo vale na hora)."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._items: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, numbers: Iterable[str]) -> Dict[str, PatientRef]:
+        now = time.monotonic()
+        out = {}
+        with self._lock:
+            for wa in numbers:
+                item = self._items.get(wa)
+                if item is not None:
+                    if item[0] > now:
+                        out[wa] = item[1]
+                    else:
+                        del self._items[wa]
+        return out
+
+    def put_many(self, refs: Dict[str, PatientRef]) -> None:
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for wa, ref in refs.items():
+                self._items[wa] = (expires, ref)
+
+
+patients_cache = PatientCache(settings.PATIENT_CACHE_TTL_S)
+
+
+def lookup_patients(db: Session, numbers: Iterable[str]) -> Dict[str, PatientRef]:
+    """Resolve vários remetentes com uma consulta IN (o que não estiver no cache)."""
+    numbers = set(numbers)
+    found = patients_cache.get_many(numbers)
+    missing = numbers - found.keys()
+    if missing:
+        rows = (
+            db.query(Patient.id, Patient.name, Patient.cpf, Patient.whatsapp)
+              .filter(Patient.whatsapp.in_(missing))
+              .order_by(Patient.id)
+              .all()
+        )
+        fresh: Dict[str, PatientRef] = {}
+        for pid, name, cpf, wa in rows:
+            fresh.setdefault(wa, PatientRef(pid, name, cpf))  # mesmo número: o mais antigo
+        patients_cache.put_many(fresh)
+        found.update(fresh)
+    return found
+
+
+@handler("audio_message")
+def audio_message_job(db: Session, payload: dict):
+    handle_audio_message(db, payload["from"], payload["media_id"], payload.get("msg_id"),
+                         payload.get(ATTEMPT_KEY, 0))
+
+
+@batch_handler("audio_message")
+def audio_message_batch(db: Session, payloads: List[dict]) -> List[Optional[Exception]]:
+    return handle_audio_batch(db, payloads)
+
+
+@handler("text_reply")
+def text_reply_job(db: Session, payload: dict):
+    send_text(payload["to"], payload["text"])
+
+
+def handle_audio_message(db: Session, from_whatsapp: str, media_id: str, meta_message_id: str | None,
+                         attempt: int = 0):
+    err = handle_audio_batch(db, [{"from": from_whatsapp, "media_id": media_id, "msg_id": meta_message_id,
+                                   ATTEMPT_KEY: attempt}])[0]
+    if err is not None:
+        raise err
+
+
+class _Item:
+    """Uma mensagem do lote; as threads do pool só preenchem os campos de resultado."""
+
+    __slots__ = ("idx", "to", "media_id", "msg_id", "patient", "exam_id", "outcome",
+                 "audio_sha256", "audio_key", "pdf_key", "error", "created_at", "metrics", "last_attempt")
+
+    def __init__(self, idx: int, payload: dict, patient: PatientRef):
+        self.idx = idx
+        self.to = payload["from"]
+        self.media_id = payload["media_id"]
+        self.msg_id = payload.get("msg_id")
+        self.patient = patient
+        self.exam_id: Optional[int] = None
+        self.outcome: Optional[str] = None  # "done" | "failed" | "too_large" | "retry"
+        self.audio_sha256: Optional[str] = None
+        self.audio_key: Optional[str] = None
+        self.pdf_key: Optional[str] = None
+        self.error: Optional[Exception] = None
+        self.created_at: Optional[datetime] = None
+        self.metrics: Optional[dict] = None
+        self.last_attempt = is_last_attempt(payload)
+
+
+def handle_audio_batch(db: Session, payloads: List[dict]) -> List[Optional[Exception]]:
+    """
+    Processa um lote de mensagens de áudio. Devolve, por payload, None ou a
+    exceção transitória (rede da Meta/S3) com que o job deve tentar de novo.
+    """
+    results: List[Optional[Exception]] = [None] * len(payloads)
+
+    # 0) idempotência: mensagem já virou exame (redelivery) -> nada a fazer;
+    #    se ficou em "processing" é retry do próprio job e retomamos o mesmo exame;
+    #    se já foi concluído num retry do próprio job, foi o envio que falhou: reenvia
+    msg_ids = [p.get("msg_id") for p in payloads if p.get("msg_id")]
+    existing: Dict[str, tuple] = {}
+    if msg_ids:
+        rows = (db.query(Exam.id, Exam.meta_message_id, Exam.status, Exam.created_at, Exam.pdf_url)
+                  .filter(Exam.meta_message_id.in_(msg_ids)))
+        existing = {msg_id: (exam_id, status, created_at, pdf_url)
+                    for exam_id, msg_id, status, created_at, pdf_url in rows}
+
+    # 1) localizar pacientes (uma consulta para o lote)
+    with stage("patient_lookup"):
+        patients = lookup_patients(db, (p["from"] for p in payloads))
+
+    items: List[_Item] = []
+    resend: List[_Item] = []
+    unknown: List[tuple] = []
+    taken = set()
+    for i, p in enumerate(payloads):
+        msg_id = p.get("msg_id")
+        prev = existing.get(msg_id) if msg_id else None
+        if msg_id and msg_id in taken:
+            continue
+        if msg_id:
+            taken.add(msg_id)
+        if prev is not None and prev[1] != "processing":
+            # a dedupe_key impede outro job com a mesma mensagem enquanto este
+            # existe: exame concluído num retry dele é laudo/aviso não entregue
+            patient = patients.get(p["from"])
+            if p.get(ATTEMPT_KEY, 0) > 1 and patient is not None:
+                item = _Item(i, p, patient)
+                item.exam_id, item.outcome, item.pdf_key = prev[0], prev[1], prev[3]
+                resend.append(item)
+            continue
+        patient = patients.get(p["from"])
+        if patient is None:
+            unknown.append((i, p["from"]))
+            continue
+        item = _Item(i, p, patient)
+        if prev is not None:
+            item.exam_id, item.created_at = prev[0], prev[2]
+        items.append(item)
+
+    # 2) criar os exames novos como "processing" (INSERT em lote, um commit)
+    new = [it for it in items if it.exam_id is None]
+    if new:
+        with stage("exam_insert"):
+            _insert_exams(db, new)
+        items = [it for it in items if it.exam_id is not None]
+        events.publish([events.exam_event(it.exam_id, it.patient.id, "processing")
+                        for it in new if it.exam_id is not None])
+
+    # 3..5) baixar, subir, analisar, gerar e subir o laudo -- em paralelo
+    if items:
+        with ThreadPoolExecutor(max_workers=min(settings.PIPELINE_CONCURRENCY, len(items))) as pool:
+            list(pool.map(_fetch_and_process, items))
+        # última tentativa: em vez de deixar o exame em "processing" para sempre,
+        # fecha como falho e o paciente recebe o aviso (o job ainda vai para "failed")
+        for it in items:
+            if it.outcome == "retry" and it.last_attempt:
+                print(f"[pipeline] exame {it.exam_id}: tentativas esgotadas: "
+                      f"{type(it.error).__name__}: {it.error}")
+                it.outcome = "failed"
+                results[it.idx] = it.error
+
+        # 6) resultado do lote inteiro em uma transação
+        rows = [{"id": it.exam_id, "status": "done" if it.outcome == "done" else "failed",
+                 "audio_url": it.audio_key, "pdf_url": it.pdf_key, "audio_sha256": it.audio_sha256}
+                for it in items if it.outcome != "retry"]
+        if rows:
+            db.execute(update(Exam), rows)
+            # métricas em colunas + agregado do paciente, no mesmo commit do status
+            trends.record(db, [
+                trends.result_row(it.exam_id, it.patient.id, it.created_at, it.metrics, PIPELINE_VERSION, it.pdf_key)
+                for it in items if it.outcome == "done"
+            ])
+            db.commit()
+            events.publish([_exam_event(it) for it in items if it.outcome != "retry"])
+
+    # 7) envios (laudo ou avisos), também em paralelo. Envio que falha não muda o
+    #    exame (o laudo já está no S3): o erro volta para a fila, que tenta de novo
+    #    só o envio (ver o passo 0)
+    sends = [(i, wa, None) for i, wa in unknown]
+    sends += [(it.idx, it.to, it) for it in items + resend if it.outcome != "retry"]
+    if sends:
+        with ThreadPoolExecutor(max_workers=min(settings.PIPELINE_CONCURRENCY, len(sends))) as pool:
+            errors = list(pool.map(lambda s: _send_result(s[1], s[2]), sends))
+        for (i, _, it), err in zip(sends, errors):
+            if err is None:
+                if it is not None:
+                    exams_total.inc(status="done" if it.outcome == "done" else "failed")
+            else:
+                if it is not None:
+                    print(f"[pipeline] exame {it.exam_id}: envio falhou: {type(err).__name__}: {err}")
+                results[i] = err
+
+    for it in items:
+        if it.outcome == "retry":
+            results[it.idx] = it.error
+    return results
+
+
+def _exam_event(it: _Item, status: Optional[str] = None) -> dict:
+    status = status or ("done" if it.outcome == "done" else "failed")
+    return events.exam_event(it.exam_id, it.patient.id, status,
+                             audio=bool(it.audio_key), report=bool(it.pdf_key))
+
+
+def _claim_messages(db: Session, exams: List[Exam]) -> None:
+    db.add_all([ExamMessage(meta_message_id=e.meta_message_id, exam_id=e.id)
+                for e in exams if e.meta_message_id])
+    db.flush()
+
+
+def _insert_exams(db: Session, new: List[_Item]) -> None:
+    exams = [Exam(patient_id=it.patient.id, status="processing", meta_message_id=it.msg_id) for it in new]
+    db.add_all(exams)
+    try:
+        db.flush()
+        _claim_messages(db, exams)
+        ids = [(e.id, e.created_at) for e in exams]
+        db.commit()
+    except IntegrityError:
+        # a PK de exam_messages barra uma corrida entre dois workers:
+        # refaz um a um e quem perdeu fica de fora
+        db.rollback()
+        ids = []
+        for it in new:
+            exam = Exam(patient_id=it.patient.id, status="processing", meta_message_id=it.msg_id)
+            db.add(exam)
+            try:
+                db.flush()
+                _claim_messages(db, [exam])
+                exam_id = (exam.id, exam.created_at)
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                exam_id = (None, None)
+            ids.append(exam_id)
+    for it, (exam_id, created_at) in zip(new, ids):
+        it.exam_id, it.created_at = exam_id, created_at
+
+
+def _fetch_and_process(it: _Item) -> None:
+    """Roda numa thread do pool: só rede/CPU, sem Session. Preenche it.outcome."""
+    from .storage import upload_bytes, upload_stream_if_absent, object_exists
+    from concurrent.futures.process import BrokenProcessPool
+
+    from . import features
+    from .cpu_pool import PoolBusy, analyze_and_render, pool as cpu_pool
+    from .result_cache import results as result_cache
+
+    # 3) baixar áudio da Meta (streaming, para um buffer só: memória ou tmp+mmap)
+    # (falhas de rede aqui e no upload do áudio voltam para a fila, com backoff)
+    try:
+        with stage("media_url"):
+            media_url = get_media_url(it.media_id)
+        with stage("download"):
+            media = download_media_to(media_url)
+    except MediaTooLarge as e:
+        print(f"[pipeline] exame {it.exam_id}: {e}")
+        it.outcome = "too_large"
+        return
+    except Exception as e:
+        it.outcome, it.error = "retry", e
+        return
+    observe_bytes("download", media.size)
+
+    with media:
+        digest = hashlib.sha256(media.view()).hexdigest()
+        it.audio_sha256 = digest
+        # 4) subir áudio bruto (auditoria), só se esse conteúdo ainda não está no S3
+        try:
+            with stage("upload_audio"):
+                key = f"audios/sha256/{digest[:2]}/{digest}.ogg"
+                fresh = upload_stream_if_absent(key, media.reader(), content_type="audio/ogg")
+                if fresh:
+                    observe_bytes("upload_audio", media.size)
+                it.audio_key = key
+        except Exception as e:
+            it.outcome, it.error = "retry", e
+            return
+
+        # 5) processar (ou reaproveitar) e gerar o laudo
+        # leituras/gravações no S3 (cache, laudo, features) são rede: falha volta
+        # para a fila. Erro na análise é do áudio/pipeline, não transitório: o
+        # exame fica falho e o paciente é avisado uma vez (a fila não tenta de novo)
+        try:
+            metrics = result_cache.get(digest, PIPELINE_VERSION)
+            # pdf_url/audio_url guardam a chave no S3; o link assinado é gerado na
+            # hora (no envio para a Meta baixar, e em /exams/{id}/report p/ o médico).
+            pdf_key = report_key(digest, it.patient.id)
+            need_pdf = not object_exists(pdf_key)
+            kind, data = "metrics", metrics
+            if metrics is None:
+                # features guardadas (ex.: PIPELINE_VERSION novo) evitam decodificar de novo;
+                # áudio que acabou de subir não tem features: nem procura (2 GETs 404 no S3)
+                feats = None if fresh else features.load(digest)
+                kind, data = ("features", feats) if feats is not None else ("audio", media.view())
+        except Exception as e:
+            it.outcome, it.error = "retry", e
+            return
+
+        pdf_bytes = None
+        if metrics is None or need_pdf:
+            if kind == "audio" and cpu_pool.enabled:
+                data = media.shareable()  # memoryview não vai para outro processo; o arquivo sim
+            # análise e laudo fora desta thread (GIL): ver app/cpu_pool.py
+            who = (it.patient.name, it.patient.cpf) if need_pdf else (None, None)
+            try:
+                with stage("cpu_pool"):
+                    metrics, pdf_bytes, blobs, timings = cpu_pool.run(analyze_and_render, kind, data, digest, *who)
+            except (PoolBusy, BrokenProcessPool) as e:
+                # pool de CPU cheio ou reiniciado: não é culpa do áudio, volta para a fila
+                it.outcome, it.error = "retry", e
+                return
+            except Exception as e:
+                print(f"[pipeline] exame {it.exam_id} falhou: {type(e).__name__}: {e}")
+                it.outcome = "failed"
+                return
+            finally:
+                data = None
+            for name, seconds in timings.items():
+                observe_seconds(name, seconds)
+            # caches são só atalho: sem eles a próxima vez fica mais cara, não errada
+            if kind != "metrics":
+                try:
+                    result_cache.put(digest, PIPELINE_VERSION, metrics)
+                except Exception as e:
+                    print(f"[pipeline] exame {it.exam_id}: resultado não guardado: {type(e).__name__}: {e}")
+            if blobs:
+                try:
+                    with stage("features_save"):
+                        features.save_blobs(digest, blobs)
+                except Exception as e:
+                    print(f"[pipeline] exame {it.exam_id}: features não salvas: {type(e).__name__}: {e}")
+
+        if pdf_bytes is not None:
+            observe_bytes("pdf", len(pdf_bytes))
+            try:
+                with stage("upload_pdf"):
+                    upload_bytes(pdf_key, pdf_bytes, content_type="application/pdf")
+            except Exception as e:
+                it.outcome, it.error = "retry", e
+                return
+        it.pdf_key = pdf_key
+        it.metrics = metrics
+        it.outcome = "done"
+
+
+def _send_result(to: str, it: Optional[_Item], text: Optional[str] = None) -> Optional[Exception]:
+    """Laudo (exame ok) ou o aviso cabível; devolve a exceção em vez de lançar."""
+    from .storage import cached_presigned_url
+
+    try:
+        if it is not None and it.outcome == "done":
+            with stage("send"):
+                send_document(to_whatsapp=to, doc_url=cached_presigned_url(it.pdf_key),
+                              caption="Seu resultado UroFlux")
+        elif text is not None or it is None:
+            send_text(to, text or MSG_NOT_REGISTERED)
+        elif it.outcome == "too_large":
+            send_text(to, MSG_TOO_LARGE)
+        else:
+            send_text(to, MSG_FAILED)
+    except Exception as e:
+        return e
+    return None
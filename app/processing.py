@@ -1,15 +1,217 @@
-# Aqui você PLUGA seu pipeline de processamento
-# Entrada: bytes do áudio
+# Pipeline de análise do áudio da micção (urofluxometria acústica)
+# Entrada: bytes do áudio (OGG/Opus da nota de voz do WhatsApp)
 # Saída: dict com métricas/valores que alimentarão o PDF
+#
+# Etapas:
+#   1) decodifica para PCM mono 16 kHz (ffmpeg), lido em blocos de tamanho fixo
+#   2) por bloco: janelas com stride tricks (sem cópia) -> energia e espectro por frame
+#   3) no fim: só vetores por frame (poucos KB/min) -> detecção da micção e curva de vazão
+# A memória fica limitada ao tamanho do bloco, independente da duração da gravação.
+import shutil
+import subprocess
+import threading
+from typing import Iterable, Iterator
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+SAMPLE_RATE = 16000
+FRAME = 512                  # 32 ms
+HOP = 256                    # 16 ms
+CHUNK_FRAMES = 1024          # frames por bloco (~16 s de áudio, poucos MB de pico)
+BAND_HZ = (500.0, 4000.0)    # faixa onde o jato de urina tem mais energia
+CURVE_HZ = 10                # resolução da curva de vazão devolvida (pontos/s)
+FEED_CHUNK = 64 * 1024       # bytes por escrita no stdin do ffmpeg
+
+# Energia -> vazão: Q = FLOW_GAIN * amplitude_na_banda ** FLOW_EXPONENT
+# FLOW_GAIN é um PLACEHOLDER NÃO CALIBRADO: foi escolhido só para o jato sintético
+# do bench (ruído branco, RMS 0,2) dar números de ordem de grandeza plausível
+# (Qmax ~14 ml/s, volume < 1 L em 2 min), não vem de nenhuma medida física. Os
+# valores absolutos do laudo não têm validade clínica até ele ser ajustado com
+# gravações de volume conhecido (urofluxômetro de referência ou recipiente graduado).
+FLOW_GAIN = 10.8
+FLOW_EXPONENT = 1.0
+# frame "ativo" = energia na banda acima de (piso de ruído * ACTIVE_RATIO)
+ACTIVE_RATIO = 4.0           # ~6 dB
+SMOOTH_S = 1.0               # janela da média móvel (Qmax sobre 1 s, como na urofluxometria)
+MIN_GAP_S = 1.5              # pausas menores que isso não encerram a micção
+CENTROID_AGUA_HZ = 1800.0    # heurística: jato na água tem centroide mais grave que na louça
+
+_WINDOW = np.hanning(FRAME).astype(np.float32)
+_FREQS = np.fft.rfftfreq(FRAME, d=1.0 / SAMPLE_RATE).astype(np.float32)
+_BAND = (_FREQS >= BAND_HZ[0]) & (_FREQS <= BAND_HZ[1])
+
+
+# ---------------------------------------------------------------------------
+# Decodificação
+# ---------------------------------------------------------------------------
+def decode_pcm_chunks(audio: bytes | memoryview, chunk_samples: int = CHUNK_FRAMES * HOP) -> Iterator[np.ndarray]:
+    """
+    Decodifica (ffmpeg) para float32 mono SAMPLE_RATE, em blocos de `chunk_samples`.
+    Aceita memoryview (ex.: MediaBuffer.view()), escrito no pipe sem cópia.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg não encontrado no PATH (necessário para decodificar OGG/Opus)")
+    proc = subprocess.Popen(
+        [ffmpeg, "-nostdin", "-loglevel", "error", "-i", "pipe:0",
+         "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+
+    # escreve a entrada numa thread, senão stdin/stdout cheios travam um ao outro
+    def _feed():
+        try:
+            view = memoryview(audio)
+            for i in range(0, len(view), FEED_CHUNK):
+                proc.stdin.write(view[i:i + FEED_CHUNK])
+        except BrokenPipeError:
+            pass
+        finally:
+            proc.stdin.close()
+
+    feeder = threading.Thread(target=_feed, daemon=True)
+    feeder.start()
+    nbytes = chunk_samples * 2
+    try:
+        while True:
+            buf = proc.stdout.read(nbytes)
+            if not buf:
+                break
+            if len(buf) % 2:
+                buf = buf[:-1]
+            yield np.frombuffer(buf, dtype="<i2").astype(np.float32) / 32768.0
+    finally:
+        proc.stdout.close()
+        feeder.join()
+        err = proc.stderr.read().decode(errors="replace").strip()
+        proc.stderr.close()
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg falhou ao decodificar o áudio: {err[:500]}")
+
+
+# ---------------------------------------------------------------------------
+# Features por frame
+# ---------------------------------------------------------------------------
+class FrameFeatures:
+    """Acumula energia na banda e centroide espectral por frame, bloco a bloco."""
+
+    def __init__(self):
+        self._tail = np.zeros(0, dtype=np.float32)
+        self._band: list[np.ndarray] = []
+        self._centroid: list[np.ndarray] = []
+        self.n_samples = 0
+
+    def push(self, pcm: np.ndarray) -> None:
+        self.n_samples += len(pcm)
+        x = np.concatenate([self._tail, pcm]) if len(self._tail) else pcm
+        if len(x) < FRAME:
+            self._tail = x
+            return
+        frames = sliding_window_view(x, FRAME)[::HOP]          # view (n, FRAME), sem cópia
+        n = frames.shape[0]
+        self._tail = x[n * HOP:]                                # o que sobra vai p/ o próximo bloco
+
+        spec = np.abs(np.fft.rfft(frames * _WINDOW, axis=1)).astype(np.float32)
+        power = spec * spec
+        total = power.sum(axis=1) + 1e-12
+        self._band.append(power[:, _BAND].sum(axis=1) / FRAME)
+        self._centroid.append((power @ _FREQS) / total)
+
+    def arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        cat = lambda parts: np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+        return cat(self._band), cat(self._centroid)
+
+
+def _moving_average(x: np.ndarray, n: int) -> np.ndarray:
+    if n <= 1 or len(x) == 0:
+        return x
+    c = np.cumsum(np.concatenate([[0.0], x]), dtype=np.float64)
+    out = (c[n:] - c[:-n]) / n
+    pad_l = (n - 1) // 2
+    return np.pad(out, (pad_l, len(x) - len(out) - pad_l), mode="edge").astype(np.float32)
+
+
+def _voiding_span(active: np.ndarray, frame_s: float) -> tuple[int, int] | None:
+    """Primeiro/último frame da micção, ignorando pausas curtas (< MIN_GAP_S)."""
+    idx = np.flatnonzero(active)
+    if len(idx) == 0:
+        return None
+    gaps = np.diff(idx) * frame_s
+    # maior trecho contínuo (pausas curtas unidas)
+    breaks = np.flatnonzero(gaps > MIN_GAP_S)
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks, [len(idx) - 1]])
+    best = np.argmax(idx[ends] - idx[starts])
+    return int(idx[starts[best]]), int(idx[ends[best]])
+
+
+def metrics_from_features(band: np.ndarray, centroid: np.ndarray, n_samples: int) -> dict:
+    frame_s = HOP / SAMPLE_RATE
+    empty = {
+        "duracao_s": 0.0,
+        "vazao_max_ml_s": 0.0,
+        "vazao_media_ml_s": 0.0,
+        "volume_total_ml": 0.0,
+        "tempo_ate_pico_s": 0.0,
+        "classe_dominante": "silencio",
+        "duracao_gravacao_s": round(n_samples / SAMPLE_RATE, 2),
+        "curva_dt_s": 1.0 / CURVE_HZ,
+        "curva_ml_s": [],
+    }
+    if len(band) == 0:
+        return empty
+
+    floor = float(np.percentile(band, 10)) + 1e-10
+    smooth_n = max(1, int(round(SMOOTH_S / frame_s)))
+    band_s = _moving_average(band, max(1, smooth_n // 4))
+    active = band_s > floor * ACTIVE_RATIO
+    span = _voiding_span(active, frame_s)
+    if span is None:
+        return empty
+    a, b = span
+
+    # amplitude acima do piso -> vazão instantânea
+    amp = np.sqrt(np.clip(band[a:b + 1] - floor, 0.0, None))
+    flow = FLOW_GAIN * np.power(amp, FLOW_EXPONENT, dtype=np.float32)
+    flow_s = _moving_average(flow, smooth_n)
+
+    duracao = (b - a + 1) * frame_s
+    volume = float(flow.sum() * frame_s)
+    peak = int(np.argmax(flow_s))
+    classe = "agua" if float(np.median(centroid[a:b + 1])) < CENTROID_AGUA_HZ else "louca"
+
+    # curva reamostrada para CURVE_HZ (média por blocos, via reshape)
+    per_pt = max(1, int(round(1.0 / (CURVE_HZ * frame_s))))
+    n_pts = len(flow_s) // per_pt
+    curve = flow_s[:n_pts * per_pt].reshape(n_pts, per_pt).mean(axis=1) if n_pts else flow_s
 
-def process_audio_bytes(audio_bytes: bytes) -> dict:
-    # TODO: converter para WAV/mono/22kHz, rodar seu modelo, etc.
-    # coloque valores fictícios para o MVP:
     return {
-        "duracao_s": 18.3,
-        "vazao_max_ml_s": 14.2,
-        "vazao_media_ml_s": 6.1,
-        "volume_total_ml": 265.0,
-        "tempo_ate_pico_s": 4.7,
-        "classe_dominante": "agua",
+        "duracao_s": round(duracao, 2),
+        "vazao_max_ml_s": round(float(flow_s[peak]), 1),
+        "vazao_media_ml_s": round(volume / duracao, 1) if duracao > 0 else 0.0,
+        "volume_total_ml": round(volume, 1),
+        "tempo_ate_pico_s": round(peak * frame_s, 2),
+        "classe_dominante": classe,
+        "duracao_gravacao_s": round(n_samples / SAMPLE_RATE, 2),
+        "curva_dt_s": per_pt * frame_s,
+        "curva_ml_s": [round(float(v), 2) for v in curve],
     }
+
+
+def analyze_pcm_chunks(chunks: Iterable[np.ndarray]) -> dict:
+    feats = FrameFeatures()
+    for pcm in chunks:
+        feats.push(pcm)
+    band, centroid = feats.arrays()
+    return metrics_from_features(band, centroid, feats.n_samples)
+
+
+def analyze_pcm(pcm: np.ndarray) -> dict:
+    """Mesma análise a partir de PCM float32 mono SAMPLE_RATE já decodificado."""
+    step = CHUNK_FRAMES * HOP
+    return analyze_pcm_chunks(pcm[i:i + step] for i in range(0, len(pcm), step))
+
+
+def process_audio_bytes(audio: bytes | memoryview) -> dict:
+    return analyze_pcm_chunks(decode_pcm_chunks(audio))
@@ -1,23 +1,289 @@
+# app/report.py
+# Laudo em PDF. O que é fixo na página (cabeçalho, logo, rótulos, tabela de
+# referência, moldura/grade do gráfico) é desenhado uma vez por processo: os
+# operadores do form XObject ficam guardados e são copiados para o canvas de
+# cada laudo. Por laudo só entram os dados do paciente, as métricas e a curva
+# de vazão (dizimada para a resolução do gráfico).
+# A cópia usa internos do reportlab (canvas._code, fontMapping): ao gravar, o
+# processo confere que um laudo de amostra sai byte a byte igual ao desenhado
+# pela API pública; se não sair (outra versão do reportlab), desenha sempre.
+#   python -m bench.bench_report --check
+import os
+from functools import lru_cache
+from io import BytesIO
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas
-from io import BytesIO
 
-def build_pdf_bytes(patient_name: str, cpf: str, metrics: dict) -> bytes:
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    w, h = A4
+from .settings import settings
+
+FORM_NAME = "uroflux_static"
+
+# (chave em metrics, rótulo, unidade) na ordem em que aparecem no laudo
+METRIC_LABELS = [
+    ("vazao_max_ml_s", "Vazão máxima (Qmax)", "ml/s"),
+    ("vazao_media_ml_s", "Vazão média (Qave)", "ml/s"),
+    ("volume_total_ml", "Volume urinado", "ml"),
+    ("tempo_ate_pico_s", "Tempo até o pico", "s"),
+    ("duracao_s", "Tempo de fluxo", "s"),
+    ("duracao_gravacao_s", "Duração da gravação", "s"),
+    ("classe_dominante", "Classe dominante", ""),
+]
+
+REFERENCE_ROWS = [
+    ("Qmax >= 15 ml/s", "normal"),
+    ("Qmax 10 a 15 ml/s", "limítrofe"),
+    ("Qmax < 10 ml/s", "reduzida"),
+    ("Volume < 150 ml", "avaliação pouco confiável"),
+]
+
+
+class _Layout:
+    """Geometria e textos fixos da página (montado uma vez por processo)."""
+
+    def __init__(self):
+        w, h = A4
+        self.w, self.h = w, h
+        self.margin = 50
+        self.header_h = 60
+        self.title_y = h - 42
+        self.patient_y = h - 95
+        self.metrics_y = h - 145
+        self.metric_step = 18
+        self.value_x = self.margin + 190
+        # tabela de referência à direita das métricas
+        self.ref_x = w - self.margin - 200
+        self.ref_y = self.metrics_y
+        # gráfico da curva de vazão
+        self.chart_x = self.margin + 30
+        self.chart_y = 120
+        self.chart_w = w - 2 * self.margin - 30
+        self.chart_h = 260
+        self.grid_x = 10
+        self.grid_y = 5
+        self.logo = None
+        if settings.REPORT_LOGO_PATH and os.path.exists(settings.REPORT_LOGO_PATH):
+            self.logo = ImageReader(settings.REPORT_LOGO_PATH)
+
 
+@lru_cache(maxsize=1)
+def _layout() -> _Layout:
+    return _Layout()
+
+
+def _draw_logo(c: canvas.Canvas, L: _Layout) -> None:
+    c.drawImage(L.logo, L.w - L.margin - 40, L.h - L.header_h + 10, 40, 40,
+                preserveAspectRatio=True, mask="auto")
+
+
+def _draw_static(c: canvas.Canvas, L: _Layout, logo: bool = True) -> None:
+    # cabeçalho
+    c.setFillColor(colors.HexColor("#1e3a8a"))
+    c.rect(0, L.h - L.header_h, L.w, L.header_h, stroke=0, fill=1)
+    c.setFillColor(colors.white)
     c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, h-50, "UroFlux - Resultado do Exame")
+    c.drawString(L.margin, L.title_y, "UroFlux - Resultado do Exame")
+    if logo and L.logo is not None:
+        _draw_logo(c, L)
+
+    # rótulos
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica", 12)
+    c.drawString(L.margin, L.patient_y, "Paciente:")
+    c.drawString(L.margin, L.patient_y - 20, "CPF:")
+    c.setFont("Helvetica", 10)
+    y = L.metrics_y
+    for _, label, _ in METRIC_LABELS:
+        c.drawString(L.margin, y, f"{label}:")
+        y -= L.metric_step
+
+    # tabela de referência
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(L.ref_x, L.ref_y, "Referência (adultos)")
+    c.setFont("Helvetica", 9)
+    y = L.ref_y - 16
+    for cond, meaning in REFERENCE_ROWS:
+        c.drawString(L.ref_x, y, cond)
+        c.drawString(L.ref_x + 110, y, meaning)
+        y -= 14
+
+    # moldura e grade do gráfico (as escalas são do laudo, a grade é fixa)
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(L.chart_x, L.chart_y + L.chart_h + 10, "Curva de vazão")
+    c.setStrokeColor(colors.HexColor("#e5e7eb"))
+    c.setLineWidth(0.5)
+    for i in range(1, L.grid_x):
+        x = L.chart_x + L.chart_w * i / L.grid_x
+        c.line(x, L.chart_y, x, L.chart_y + L.chart_h)
+    for i in range(1, L.grid_y):
+        y = L.chart_y + L.chart_h * i / L.grid_y
+        c.line(L.chart_x, y, L.chart_x + L.chart_w, y)
+    c.setStrokeColor(colors.black)
+    c.setLineWidth(1)
+    c.rect(L.chart_x, L.chart_y, L.chart_w, L.chart_h, stroke=1, fill=0)
+    c.setFont("Helvetica", 8)
+    c.drawCentredString(L.chart_x + L.chart_w / 2, L.chart_y - 28, "tempo (s)")
+    c.saveState()
+    c.translate(L.chart_x - 28, L.chart_y + L.chart_h / 2)
+    c.rotate(90)
+    c.drawCentredString(0, 0, "vazão (ml/s)")
+    c.restoreState()
+
+
+class _StaticStream(NamedTuple):
+    fonts: Tuple[Tuple[str, str], ...]  # (fonte, nome interno /F1, /F2...) na ordem de registro
+    code: Tuple[str, ...]               # operadores do form, sem o logo
+
+
+# laudo de amostra da conferência do replay (curva com subida, platô e descida)
+_SAMPLE_METRICS = {
+    "vazao_max_ml_s": 14.2, "vazao_media_ml_s": 8.4, "volume_total_ml": 112.0,
+    "tempo_ate_pico_s": 3.1, "duracao_s": 13.3, "duracao_gravacao_s": 18.0,
+    "classe_dominante": "normal", "extra_s": 1.5,
+    "curva_ml_s": [min(i, 40, 80 - i) * 0.35 for i in range(80)], "curva_dt_s": 0.1,
+}
+
+
+@lru_cache(maxsize=1)
+def _static_stream() -> Optional[_StaticStream]:
+    """
+    Grava uma vez o stream do form (num canvas descartável, no mesmo estado
+    inicial dos laudos). None se o replay não reproduz o desenho.
+    """
+    c = canvas.Canvas(BytesIO(), pagesize=A4)
+    c.beginForm(FORM_NAME)
+    _draw_static(c, _layout(), logo=False)
+    s = _StaticStream(tuple(c._doc.fontMapping.items()), tuple(c._code))
+    for compress in (True, False):
+        sample = ("Paciente Amostra", "000.000.000-00", _SAMPLE_METRICS, compress)
+        if _render(*sample, static=s, invariant=True) != _render(*sample, static=None, invariant=True):
+            print("[report] replay do form difere do desenho nesta versão do reportlab: desenhando sempre")
+            return None
+    return s
+
+
+def _form(c: canvas.Canvas, L: _Layout, static: Optional[_StaticStream]) -> None:
+    """Form com o conteúdo fixo: o stream gravado ou, sem ele, desenhado pela API."""
+    c.beginForm(FORM_NAME)
+    # o stream cita as fontes pelo nome interno: registra na mesma ordem e confere
+    if static is not None and all(c._doc.getInternalFontName(font) == internal
+                                  for font, internal in static.fonts):
+        c._code.extend(static.code)
+    else:
+        _draw_static(c, L, logo=False)
+    if L.logo is not None:  # a imagem é um recurso do documento: vai pelo drawImage
+        _draw_logo(c, L)
+    c.endForm()
+
+
+def decimate_minmax(y: np.ndarray, columns: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduz a curva a no máximo 2 pontos (mín e máx) por coluna do gráfico,
+    preservando os picos. Devolve (índices, valores) em ordem.
+    """
+    n = len(y)
+    if n <= 2 * columns:
+        return np.arange(n), y
+    edges = np.linspace(0, n, columns + 1).astype(np.int64)[:-1]
+    mins = np.minimum.reduceat(y, edges)
+    maxs = np.maximum.reduceat(y, edges)
+    # posição de cada extremo dentro do bloco, para manter a ordem no tempo
+    lens = np.diff(np.append(edges, n))
+    block = np.repeat(np.arange(columns), lens)
+    is_min = y == mins[block]
+    is_max = y == maxs[block]
+    first_min = np.full(columns, n)
+    first_max = np.full(columns, n)
+    np.minimum.at(first_min, block[is_min], np.flatnonzero(is_min))
+    np.minimum.at(first_max, block[is_max], np.flatnonzero(is_max))
+    idx = np.unique(np.concatenate([first_min, first_max]))
+    return idx, y[idx]
+
+
+def _nice_ceil(v: float, step: float) -> float:
+    return max(step, float(np.ceil(v / step) * step))
+
+
+def _draw_curve(c: canvas.Canvas, L: _Layout, metrics: dict) -> None:
+    curve = np.asarray(metrics.get("curva_ml_s") or [], dtype=np.float64)
+    dt = float(metrics.get("curva_dt_s") or 0.1)
+    # escalas "redondas": cada divisão da grade vale um número inteiro
+    t_max = _nice_ceil(len(curve) * dt, float(L.grid_x))
+    y_max = _nice_ceil(float(curve.max()) if len(curve) else 0.0, 5.0 * L.grid_y)
+
+    # escalas
+    c.setFont("Helvetica", 7)
+    for i in range(L.grid_x + 1):
+        c.drawCentredString(L.chart_x + L.chart_w * i / L.grid_x, L.chart_y - 12,
+                            f"{t_max * i / L.grid_x:g}")
+    for i in range(L.grid_y + 1):
+        c.drawRightString(L.chart_x - 4, L.chart_y + L.chart_h * i / L.grid_y - 2,
+                          f"{y_max * i / L.grid_y:g}")
+    if len(curve) < 2:
+        return
+
+    idx, vals = decimate_minmax(curve, int(L.chart_w))
+    xs = L.chart_x + (idx * dt) * (L.chart_w / t_max)
+    ys = L.chart_y + np.clip(vals, 0, y_max) * (L.chart_h / y_max)
+    path = c.beginPath()
+    path.moveTo(float(xs[0]), float(ys[0]))
+    for x, y in zip(xs[1:].tolist(), ys[1:].tolist()):
+        path.lineTo(x, y)
+    c.setStrokeColor(colors.HexColor("#1d4ed8"))
+    c.setLineWidth(1.2)
+    c.drawPath(path, stroke=1, fill=0)
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f"{value:g}"
+    return str(value)
+
+
+def build_pdf_bytes(patient_name: str, cpf: str, metrics: dict, compress: Optional[bool] = None) -> bytes:
+    """
+    compress: liga/desliga a compressão das páginas (padrão REPORT_PDF_COMPRESS).
+    Sem compressão o PDF sai mais rápido e maior.
+    """
+    if compress is None:
+        compress = settings.REPORT_PDF_COMPRESS
+    return _render(patient_name, cpf, metrics, compress, static=_static_stream())
+
+
+def _render(patient_name: str, cpf: str, metrics: dict, compress: bool,
+            static: Optional[_StaticStream], invariant: bool = False) -> bytes:
+    L = _layout()
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4, pageCompression=1 if compress else 0,
+                      invariant=1 if invariant else None)
+
+    _form(c, L, static)
+    c.doForm(FORM_NAME)
 
     c.setFont("Helvetica", 12)
-    c.drawString(50, h-90, f"Paciente: {patient_name}")
-    c.drawString(50, h-110, f"CPF: {cpf}")
+    c.drawString(L.margin + 60, L.patient_y, patient_name)
+    c.drawString(L.margin + 60, L.patient_y - 20, cpf)
 
-    y = h-150
+    c.setFont("Helvetica-Bold", 10)
+    y = L.metrics_y
+    for key, _, unit in METRIC_LABELS:
+        if key in metrics:
+            c.drawString(L.value_x, y, f"{_fmt(metrics[key])} {unit}".strip())
+        y -= L.metric_step
+    # métricas extras (sem rótulo conhecido) seguem no formato antigo
+    known = {k for k, _, _ in METRIC_LABELS}
+    c.setFont("Helvetica", 10)
     for k, v in metrics.items():
-        c.drawString(50, y, f"{k.replace('_',' ').title()}: {v}")
-        y -= 20
+        if k in known or isinstance(v, (list, tuple)) or k.startswith("curva_"):
+            continue
+        c.drawString(L.margin, y, f"{k.replace('_',' ').title()}: {_fmt(v)}")
+        y -= L.metric_step
+
+    _draw_curve(c, L, metrics)
 
     c.showPage()
     c.save()
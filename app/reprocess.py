@@ -0,0 +1,306 @@
+# app/reprocess.py
+# Reprocessa exames já concluídos (ex.: depois de corrigir a análise ou o laudo
+# e subir PIPELINE_VERSION): recalcula as métricas, gera o laudo novo e grava
+# a chave dele em exams.pdf_url e as métricas em exam_results (também serve de
+# backfill para exames anteriores à tabela). Nada é enviado ao paciente.
+#
+#   python -m app.reprocess --since 2025-01-01 --workers 8 --prefetch 32
+#
+# - leitura: um SELECT em cursor do lado do servidor (stream_results/yield_per),
+#   numa conexão só dele; as gravações vão por outra conexão
+# - E/S (S3) em threads, limitadas por --prefetch; CPU (decodificação, análise,
+#   PDF) no pool de processos de app/cpu_pool.py, um processo por núcleo
+# - o que já existe é reaproveitado: métricas do cache de resultados, features
+#   guardadas (app/features.py) em vez de decodificar o áudio, laudo já gerado
+# - UPDATE em lote a cada --batch exames, seguido do checkpoint (último id
+#   concluído em ordem); rodar de novo continua dali (--restart recomeça)
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+DEFAULT_CHECKPOINT = ".reprocess-checkpoint.json"
+
+
+class Row(NamedTuple):
+    exam_id: int
+    audio_url: Optional[str]
+    audio_sha256: Optional[str]
+    pdf_url: Optional[str]
+    patient_id: int
+    name: str
+    cpf: str
+    created_at: datetime
+    result_version: Optional[str]  # versão das métricas em exam_results (None = sem resultado)
+
+
+class Outcome(NamedTuple):
+    exam_id: int
+    status: str                    # "done" | "skipped" | "failed"
+    audio_sha256: Optional[str] = None
+    pdf_key: Optional[str] = None
+    error: Optional[str] = None
+    source: Optional[str] = None   # de onde vieram as métricas: cache | features | audio
+    cpu_s: float = 0.0
+    metrics: Optional[dict] = None
+    row: Optional[Row] = None
+
+
+class Reprocessor:
+    def __init__(self, workers: int, prefetch: int):
+        from .cpu_pool import CpuPool
+        from .settings import settings
+
+        # mesmo pool do worker (aquecido, reciclado, com timeout); aqui sem
+        # limite de espera na fila: o limite é a janela de exames em voo
+        self.cpu = CpuPool(workers, max_tasks_per_child=settings.CPU_POOL_MAX_TASKS_PER_CHILD,
+                           task_timeout=settings.CPU_POOL_TASK_TIMEOUT_S, submit_timeout=None,
+                           health_interval=0)
+        self.cpu.start()
+        # cada thread segura um exame do download ao upload; a espera pelo pool de
+        # CPU não ocupa uma vaga de E/S (o semáforo limita só as chamadas ao S3)
+        self.io = ThreadPoolExecutor(max_workers=prefetch + workers, thread_name_prefix="reprocess")
+        self.s3_slots = threading.Semaphore(prefetch)
+        self.window = 2 * (prefetch + workers)
+
+    def close(self, cancel: bool = False):
+        self.io.shutdown(wait=True, cancel_futures=cancel)
+        self.cpu.shutdown()
+
+    def process(self, row: Row) -> Outcome:
+        from .cpu_pool import analyze_and_render
+        from .features import features_key
+        from .pipeline import PIPELINE_VERSION, report_key
+        from .result_cache import results
+        from .storage import get_bytes, key_from_url, object_exists, upload_bytes
+
+        sha = row.audio_sha256
+        if sha and row.pdf_url == report_key(sha, row.patient_id) and row.result_version == PIPELINE_VERSION:
+            return Outcome(row.exam_id, "skipped", sha, row.pdf_url)  # já está na versão atual
+        try:
+            with self.s3_slots:
+                kind, data = None, None
+                if sha:
+                    data = results.get(sha, PIPELINE_VERSION)
+                    kind = "metrics" if data is not None else None
+                    if kind is None:
+                        data = get_bytes(features_key(sha))
+                        kind = "features" if data is not None else None
+                if kind is None:
+                    key = key_from_url(row.audio_url or "")
+                    data = get_bytes(key) if key else None
+                    if data is None:
+                        return Outcome(row.exam_id, "skipped", error="áudio não encontrado no S3")
+                    kind = "audio"
+                    sha = sha or hashlib.sha256(data).hexdigest()
+                pdf_key = report_key(sha, row.patient_id)
+                if kind == "metrics" and object_exists(pdf_key):
+                    return Outcome(row.exam_id, "done", sha, pdf_key, source="cache", metrics=data, row=row)
+
+            metrics, pdf, blobs, timings = self.cpu.run(analyze_and_render, kind, data, sha, row.name, row.cpf)
+            data = None  # o áudio não precisa ficar na memória durante o upload
+
+            with self.s3_slots:
+                for key, blob in blobs.items():
+                    if not object_exists(key):
+                        upload_bytes(key, blob, content_type="application/octet-stream")
+                if kind != "metrics":
+                    results.put(sha, PIPELINE_VERSION, metrics)
+                upload_bytes(pdf_key, pdf, content_type="application/pdf")
+        except Exception as e:
+            return Outcome(row.exam_id, "failed", error=f"{type(e).__name__}: {e}")
+        source = {"metrics": "cache", "features": "features", "audio": "audio"}[kind]
+        return Outcome(row.exam_id, "done", sha, pdf_key, source=source, cpu_s=sum(timings.values()),
+                       metrics=metrics, row=row)
+
+
+def _load_checkpoint(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_checkpoint(path: str, state: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)  # atômico: um Ctrl-C não deixa o checkpoint pela metade
+
+
+def _write_back(db, outcomes: List[Outcome]) -> None:
+    from sqlalchemy import update
+
+    from . import trends
+    from .models import Exam
+    from .pipeline import PIPELINE_VERSION
+
+    done = [o for o in outcomes if o.status == "done"]
+    rows = [{"id": o.exam_id, "pdf_url": o.pdf_key, "audio_sha256": o.audio_sha256, "status": "done"}
+            for o in done]
+    if rows:
+        db.execute(update(Exam), rows)  # executemany pela chave primária
+        # métricas novas em exam_results; os baldes de tendência desses pacientes são refeitos
+        trends.replace(db, [trends.result_row(o.exam_id, o.row.patient_id, o.row.created_at, o.metrics,
+                                              PIPELINE_VERSION, o.pdf_key) for o in done])
+    db.commit()
+
+
+class Progress:
+    def __init__(self, every_s: float):
+        self.every_s = every_s
+        self.started = self.last = time.perf_counter()
+        self.counts: Dict[str, int] = {}
+        self.cpu_s = 0.0
+
+    def add(self, o: Outcome):
+        key = o.status if o.status != "done" else f"done:{o.source}"
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.cpu_s += o.cpu_s
+
+    def line(self, last_id: int) -> str:
+        n = sum(self.counts.values())
+        elapsed = time.perf_counter() - self.started
+        parts = " ".join(f"{k}={v}" for k, v in sorted(self.counts.items()))
+        return (f"[reprocess] {n} exames em {elapsed:.0f} s ({n / elapsed if elapsed else 0:.1f}/s, "
+                f"CPU {self.cpu_s:.0f} s) {parts} | checkpoint id={last_id}")
+
+    def maybe_print(self, last_id: int):
+        now = time.perf_counter()
+        if now - self.last >= self.every_s:
+            self.last = now
+            print(self.line(last_id), flush=True)
+
+
+def _select(args, after_id: int):
+    from sqlalchemy import select
+
+    from .models import Exam, ExamResult, Patient
+
+    stmt = (
+        select(Exam.id, Exam.audio_url, Exam.audio_sha256, Exam.pdf_url, Patient.id, Patient.name, Patient.cpf,
+               Exam.created_at, ExamResult.pipeline_version)
+          .join(Patient, Patient.id == Exam.patient_id)
+          .outerjoin(ExamResult, ExamResult.exam_id == Exam.id)
+          .where(Exam.id > after_id, Exam.status.in_(args.status))
+          .order_by(Exam.id)
+    )
+    if args.since:
+        stmt = stmt.where(Exam.created_at >= args.since)
+    if args.until:
+        stmt = stmt.where(Exam.created_at < args.until)
+    return stmt
+
+
+def _stream(engine, args, after_id: int):
+    if engine.dialect.name == "sqlite":
+        # dev: no SQLite um SELECT aberto trava os commits do writer; lê páginas por id
+        while True:
+            with engine.connect() as conn:
+                page = conn.execute(_select(args, after_id).limit(args.batch)).all()
+            if not page:
+                return
+            yield from page
+            after_id = page[-1][0]
+    with engine.connect() as conn:
+        yield from conn.execution_options(stream_results=True, yield_per=args.batch).execute(
+            _select(args, after_id))
+
+
+def run(args) -> Progress:
+    from .db import SessionLocal, engine
+    from .pipeline import PIPELINE_VERSION
+
+    # o checkpoint só vale para a mesma versão e o mesmo filtro
+    scope = {"pipeline_version": PIPELINE_VERSION, "status": sorted(args.status),
+             "since": args.since and args.since.isoformat(), "until": args.until and args.until.isoformat()}
+    state = {} if args.restart else _load_checkpoint(args.checkpoint)
+    if state and state.get("scope") != scope:
+        print(f"[reprocess] checkpoint de outra versão/filtro ({state.get('scope')}): recomeçando")
+        state = {}
+    last_id = int(state.get("last_id", 0))
+    failed: List[int] = list(state.get("failed", []))
+    if last_id:
+        print(f"[reprocess] retomando após o exame {last_id}")
+
+    progress = Progress(args.report_every)
+    rp = Reprocessor(args.workers, args.prefetch)
+    inflight: "deque[Tuple[int, object]]" = deque()
+    pending: List[Outcome] = []
+    writer = SessionLocal()
+    interrupted = False
+
+    def flush():
+        nonlocal pending
+        if not pending:
+            return
+        _write_back(writer, pending)
+        pending = []
+        _save_checkpoint(args.checkpoint, {
+            "scope": scope, "last_id": last_id, "failed": failed[-10000:],
+            "updated_at": datetime.utcnow().isoformat(timespec="seconds"),
+        })
+
+    def drain_one():
+        # em ordem de id: o checkpoint nunca passa à frente de um exame inacabado
+        nonlocal last_id
+        exam_id, fut = inflight.popleft()
+        o = fut.result()
+        if o.status == "failed":
+            failed.append(exam_id)
+            print(f"[reprocess] exame {exam_id}: {o.error}")
+        progress.add(o)
+        pending.append(o)
+        last_id = exam_id
+        if len(pending) >= args.batch:
+            flush()
+        progress.maybe_print(last_id)
+
+    try:
+        for n, r in enumerate(_stream(engine, args, last_id), 1):
+            inflight.append((r[0], rp.io.submit(rp.process, Row(*r))))
+            while len(inflight) >= rp.window or (inflight and inflight[0][1].done()):
+                drain_one()
+            if args.limit and n >= args.limit:
+                break
+        while inflight:
+            drain_one()
+    except KeyboardInterrupt:
+        # o que estava em andamento fica para a próxima execução (checkpoint = último concluído)
+        print("[reprocess] interrompido")
+        interrupted = True
+    finally:
+        flush()
+        writer.close()
+        rp.close(cancel=interrupted)
+    print(progress.line(last_id))
+    if failed:
+        print(f"[reprocess] {len(failed)} exames falharam (ids no checkpoint {args.checkpoint})")
+    return progress
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Reprocessa exames já concluídos (sem enviar nada).")
+    ap.add_argument("--since", type=datetime.fromisoformat, help="exames criados a partir de (AAAA-MM-DD)")
+    ap.add_argument("--until", type=datetime.fromisoformat, help="exames criados antes de (AAAA-MM-DD)")
+    ap.add_argument("--status", nargs="+", default=["done"],
+                    help="status dos exames (padrão: done); os reprocessados com sucesso ficam 'done'")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processos de CPU")
+    ap.add_argument("--prefetch", type=int, default=16, help="chamadas simultâneas ao S3")
+    ap.add_argument("--batch", type=int, default=500, help="exames por UPDATE/checkpoint")
+    ap.add_argument("--limit", type=int, default=0, help="para depois de N exames (0 = todos)")
+    ap.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    ap.add_argument("--restart", action="store_true", help="ignora o checkpoint")
+    ap.add_argument("--report-every", type=float, default=10.0, help="segundos entre relatórios")
+    run(ap.parse_args())
+
+
+if __name__ == "__main__":
+    main()
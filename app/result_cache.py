@@ -0,0 +1,87 @@
+# app/result_cache.py
+# Cache de resultados da análise, por (sha256 do áudio, versão do pipeline).
+# O mesmo áudio reenviado (ou encaminhado) não é analisado de novo.
+#   1º nível: LRU em memória limitado em bytes (RESULT_CACHE_MAX_BYTES)
+#   2º nível: JSON no S3 em results/{versão}/{hash}.json, compartilhado entre
+#             processos (expiração fica a cargo de uma lifecycle rule do bucket)
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from .settings import settings
+
+
+def result_key(audio_sha256: str, version: str) -> str:
+    return f"results/{version}/{audio_sha256}.json"
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int, use_s3: bool = True):
+        self.max_bytes = max_bytes
+        self.use_s3 = use_s3
+        self._items: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_s3 = 0
+        self.misses = 0
+
+    def _remember(self, key: tuple, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def get(self, audio_sha256: str, version: str) -> Optional[dict]:
+        key = (audio_sha256, version)
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+                self.hits_memory += 1
+                return json.loads(data)
+        if self.use_s3:
+            from .storage import get_bytes
+
+            data = get_bytes(result_key(audio_sha256, version))
+            if data is not None:
+                self._remember(key, data)
+                with self._lock:
+                    self.hits_s3 += 1
+                return json.loads(data)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, audio_sha256: str, version: str, metrics: dict) -> None:
+        data = json.dumps(metrics, separators=(",", ":")).encode()
+        self._remember((audio_sha256, version), data)
+        if self.use_s3:
+            from .storage import upload_bytes
+
+            upload_bytes(result_key(audio_sha256, version), data, content_type="application/json")
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.hits_memory + self.hits_s3
+            total = hits + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_s3": self.hits_s3,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+results = ResultCache(settings.RESULT_CACHE_MAX_BYTES, use_s3=settings.RESULT_CACHE_S3)
@@ -1,6 +1,6 @@
 # app/schemas.py
-from datetime import datetime
-from typing import Optional
+from datetime import date, datetime
+from typing import List, Optional
 from pydantic import BaseModel, ConfigDict
 
 # ---------- Pacientes ----------
@@ -22,6 +22,14 @@ class PatientOut(BaseModel):
 class ExamResultOut(BaseModel):
     id: int
     exam_id: int
+    pipeline_version: str
+    duracao_s: float
+    vazao_max_ml_s: float
+    vazao_media_ml_s: float
+    volume_total_ml: float
+    tempo_ate_pico_s: float
+    duracao_gravacao_s: float
+    classe_dominante: Optional[str] = None
     summary: Optional[str] = None
     pdf_url: Optional[str] = None
     created_at: datetime
@@ -38,3 +46,59 @@ class ExamOut(BaseModel):
     result: Optional[ExamResultOut] = None
 
     model_config = ConfigDict(from_attributes=True)
+
+# ---------- Tendência (agregado mensal por paciente) ----------
+class TrendPointOut(BaseModel):
+    month: date
+    exams: int
+    vazao_max_ml_s: float
+    vazao_max_mean: Optional[float] = None
+    vazao_media_mean: Optional[float] = None
+    volume_max_ml: float
+    volume_mean_ml: Optional[float] = None
+    # média/máximo dos últimos `window_months` meses até este
+    rolling_vazao_max_mean: Optional[float] = None
+    rolling_vazao_max_ml_s: float
+    rolling_volume_mean_ml: Optional[float] = None
+
+class PatientTrendOut(BaseModel):
+    patient_id: int
+    exams: int
+    vazao_max_ml_s: Optional[float] = None
+    vazao_max_mean: Optional[float] = None
+    vazao_media_mean: Optional[float] = None
+    volume_max_ml: Optional[float] = None
+    volume_mean_ml: Optional[float] = None
+    last_exam_at: Optional[datetime] = None
+    window_months: int
+    points: List[TrendPointOut]
+
+# ---------- Campanhas ----------
+class CampaignCreate(BaseModel):
+    # ids explícitos OU filtro de busca (mesmo da lista de pacientes)
+    patient_ids: Optional[List[int]] = None
+    q: Optional[str] = None
+    template_name: str = "uroflux_instrucoes_audio"
+    lang: str = "pt_BR"
+
+class CampaignOut(BaseModel):
+    id: int
+    template_name: str
+    status: str
+    total: int
+    sent: int
+    failed: int
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class CampaignRecipientOut(BaseModel):
+    id: int
+    patient_id: int
+    whatsapp: str
+    status: str
+    error: Optional[str] = None
+    sent_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,43 @@
+# app/search.py
+# Busca de pacientes (nome, CPF ou WhatsApp), usada pela API, pela UI e pelas
+# campanhas. Compara com as colunas normalizadas (sem acento / só dígitos),
+# que no Postgres têm índice GIN trigram: LIKE '%x%' não vira seq scan.
+from typing import List, Optional, Tuple
+
+from sqlalchemy import or_
+
+from .models import Patient
+from .normalize import fold_text, only_digits
+
+
+def _contains(value: str) -> str:
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def filter_patients(qry, q: Optional[str]):
+    if not q:
+        return qry
+    conds = []
+    folded = fold_text(q)
+    if folded:
+        conds.append(Patient.name_search.like(_contains(folded), escape="\\"))
+    digits = only_digits(q)
+    if digits:
+        conds.append(Patient.cpf_digits.like(_contains(digits), escape="\\"))
+        conds.append(Patient.whatsapp_digits.like(_contains(digits), escape="\\"))
+    return qry.filter(or_(*conds)) if conds else qry
+
+
+async def apage_by_id(db, stmt, column, cursor: Optional[int], limit: int) -> Tuple[List, Optional[int]]:
+    """
+    Paginação keyset em ordem decrescente de id: `cursor` é o último id da
+    página anterior. Devolve (itens, próximo cursor ou None se acabou).
+    """
+    if cursor is not None:
+        stmt = stmt.where(column < cursor)
+    rows = (await db.scalars(stmt.order_by(column.desc()).limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
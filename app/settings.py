@@ -10,6 +10,13 @@ class Settings(BaseSettings):
     # Aceita: DATABASE_URL
     # -----------------------------
     DATABASE_URL: str = Field(...)
+    # pool de conexões (vale para a engine síncrona e para a async, cada uma o seu)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE_S: int = 1800
+    DB_POOL_TIMEOUT_S: float = 30.0
+    # schema é aplicado por `python -m app.migrations` (release); true só em dev
+    DB_MIGRATE_ON_STARTUP: bool = False
 
     # -----------------------------
     # AWS S3 (aceita vários nomes)
@@ -39,6 +46,17 @@ class Settings(BaseSettings):
         default=None,
         validation_alias=AliasChoices("S3_ENDPOINT_URL", "S3_ENDPOINT"),
     )
+    # cliente compartilhado + upload multipart (ver app/storage.py)
+    S3_MAX_POOL_CONNECTIONS: int = 32
+    S3_CONNECT_TIMEOUT_S: float = 5.0
+    S3_READ_TIMEOUT_S: float = 60.0
+    S3_MULTIPART_THRESHOLD_MB: int = 8
+    S3_MULTIPART_CHUNK_MB: int = 8
+    S3_MULTIPART_CONCURRENCY: int = 4
+    # links assinados (laudo/áudio): validade e cache em memória por processo
+    PRESIGN_TTL_S: int = 3600
+    PRESIGN_MIN_REMAINING_S: int = 300  # abaixo disso assina de novo
+    PRESIGN_CACHE_SIZE: int = 4096
 
     # -----------------------------
     # Meta / WhatsApp Cloud API
@@ -60,6 +78,26 @@ class Settings(BaseSettings):
         validation_alias=AliasChoices("WHATSAPP_VERIFY_TOKEN", "META_WABA_VERIFY_TOKEN"),
     )
     META_WABA_API_BASE: str = "https://graph.facebook.com/v20.0"
+    # cliente HTTP da Graph API (pool keep-alive + retry; POST só sem envio ou 429)
+    WHATSAPP_CONNECT_TIMEOUT_S: float = 3.05
+    WHATSAPP_READ_TIMEOUT_S: float = 30.0
+    WHATSAPP_POOL_MAXSIZE: int = 20
+    WHATSAPP_MAX_RETRIES: int = 4
+    WHATSAPP_BACKOFF_BASE_S: float = 0.5
+    WHATSAPP_BACKOFF_MAX_S: float = 30.0
+    # mídia recebida: limite de tamanho (o WhatsApp aceita áudios de até 16 MB)
+    # e quanto fica em memória antes de ir para arquivo temporário + mmap
+    MEDIA_MAX_BYTES: int = 16 * 1024 * 1024
+    MEDIA_SPOOL_MAX_MEMORY: int = 1024 * 1024
+    MEDIA_DOWNLOAD_CHUNK: int = 64 * 1024
+    # campanhas: limite de envio por número (token bucket no banco, vale para
+    # web + todos os workers juntos) e envios simultâneos por job
+    CAMPAIGN_RATE_PER_S: float = 80.0
+    CAMPAIGN_BURST: int = 80
+    CAMPAIGN_CONCURRENCY: int = 8
+    # destinatários por job; o job se reenfileira até esvaziar a campanha
+    # (mantém cada job bem abaixo do JOB_VISIBILITY_TIMEOUT_S)
+    CAMPAIGN_SLICE: int = 500
 
     # -----------------------------
     # App
@@ -68,6 +106,90 @@ class Settings(BaseSettings):
     APP_ENV: str = "production"
     PUBLIC_BASE_URL: Optional[str] = None  # ex.: https://meuapp.up.railway.app
 
+    # -----------------------------
+    # Laudo (PDF)
+    # -----------------------------
+    REPORT_PDF_COMPRESS: bool = True        # false: menos CPU, arquivo maior
+    REPORT_LOGO_PATH: Optional[str] = None  # PNG/JPG desenhado no cabeçalho
+    # cache de resultados por hash do áudio (ver app/result_cache.py)
+    RESULT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESULT_CACHE_S3: bool = True
+    # feature store (ver app/features.py): arrays por frame + PCM decodificado
+    FEATURES_STORE_PCM: bool = True
+    FEATURES_PCM_MAX_S: float = 600.0       # gravações maiores guardam só as features
+    FEATURE_CACHE_DIR: Optional[str] = None  # padrão: <tmp>/uroflux-features
+    FEATURE_CACHE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024  # LRU no disco local; 0 = sem limite
+
+    # -----------------------------
+    # Fila de jobs (webhook -> worker)
+    #   JOB_RUN_IN_APP=false quando o processo "worker" do Procfile estiver ativo
+    # -----------------------------
+    JOB_RUN_IN_APP: bool = True
+    JOB_CONCURRENCY: int = 4
+    JOB_POLL_INTERVAL_S: float = 1.0
+    # tempo que um job fica "reservado" para um worker; se o worker morrer,
+    # o job volta para a fila depois disso (deve ser maior que o job mais lento)
+    JOB_VISIBILITY_TIMEOUT_S: int = 300
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_BACKOFF_BASE_S: float = 5.0
+    JOB_BACKOFF_MAX_S: float = 600.0
+    # jobs reservados de uma vez por worker; áudios do mesmo lote dividem a
+    # busca de pacientes, o insert dos exames e os commits de status
+    JOB_BATCH_SIZE: int = 8
+    # mensagens de um lote processadas em paralelo (download/análise/upload)
+    PIPELINE_CONCURRENCY: int = 4
+    # cache whatsapp -> paciente usado pelo pipeline
+    PATIENT_CACHE_TTL_S: float = 60.0
+    # ids de mensagem já vistos, em memória (antes de ir ao banco)
+    DEDUPE_LRU_SIZE: int = 10000
+
+    # -----------------------------
+    # Pool de processos p/ análise + laudo (ver app/cpu_pool.py)
+    #   CPU_POOL_WORKERS: vazio = nº de núcleos; 0 = roda na thread do worker (dev)
+    #   Cada processo web com JOB_RUN_IN_APP tem o seu pool: divida os núcleos
+    # -----------------------------
+    CPU_POOL_WORKERS: Optional[int] = None
+    CPU_POOL_MAX_TASKS_PER_CHILD: int = 200
+    CPU_POOL_MAX_PENDING: Optional[int] = None  # padrão: 2x CPU_POOL_WORKERS
+    CPU_POOL_TASK_TIMEOUT_S: float = 120.0
+    CPU_POOL_SUBMIT_TIMEOUT_S: float = 30.0
+    CPU_POOL_HEALTH_INTERVAL_S: float = 30.0
+
+    # -----------------------------
+    # Observabilidade (GET /metrics, formato Prometheus)
+    #   PROFILE_REQUESTS=true libera o profiler por amostragem (pyinstrument):
+    #   header "X-Profile: 1" ou uma fração PROFILE_SAMPLE_RATE das requisições
+    # -----------------------------
+    METRICS_ENABLED: bool = True
+    WORKER_METRICS_PORT: Optional[int] = None  # /metrics do processo worker (sem FastAPI)
+    PROFILE_REQUESTS: bool = False
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_INTERVAL_S: float = 0.001
+
+    # -----------------------------
+    # Status dos exames ao vivo nas telas (SSE, ver app/events.py)
+    #   auto = NOTIFY/LISTEN no Postgres, em memória no SQLite
+    # -----------------------------
+    EXAM_EVENTS_BACKEND: str = "auto"  # auto | memory | postgres
+    EXAM_EVENTS_KEEPALIVE_S: float = 15.0
+    EXAM_EVENTS_HISTORY: int = 1000    # eventos guardados p/ quem reconecta
+
+    # -----------------------------
+    # Partições mensais de exams e arquivamento (ver app/partitions.py)
+    #   o worker cria as partições; arquivar: python -m app.partitions archive
+    # -----------------------------
+    EXAMS_PARTITIONS_AHEAD: int = 3            # meses criados adiante
+    EXAMS_PARTITION_CHECK_S: float = 6 * 3600  # 0 = o worker não cria (só o CLI)
+    EXAMS_HOT_DAYS: int = 90                   # janela da lista /web/exams
+    EXAMS_ARCHIVE_AFTER_MONTHS: int = 12
+    EXAMS_ARCHIVE_PREFIX: str = "archive/"
+    EXAMS_ARCHIVE_STORAGE_CLASS: Optional[str] = "STANDARD_IA"  # vazio em S3 compatível sem classes
+
+    # -----------------------------
+    # Exportação de exames (CSV/Parquet, ver app/export.py)
+    # -----------------------------
+    EXPORT_BATCH_ROWS: int = 10000  # linhas por lote lido/escrito (= row group do Parquet)
+
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
     # --------- Helpers / computed props ---------
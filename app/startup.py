@@ -0,0 +1,75 @@
+# app/startup.py
+# Medição do cold start. Importado primeiro pelo app.main; com STARTUP_PROFILE=1
+# mede o tempo de import de cada módulo e das etapas do startup e loga um resumo.
+# (lê o env direto: precisa estar ativo antes de carregar settings/pydantic)
+import os
+import sys
+import time
+from contextlib import contextmanager
+from importlib.abc import MetaPathFinder
+
+T0 = time.perf_counter()
+ENABLED = os.getenv("STARTUP_PROFILE", "").lower() in ("1", "true", "yes")
+
+_imports: dict[str, float] = {}
+_steps: list[tuple[str, float]] = []
+
+
+class _TimedLoader:
+    """Envolve o loader real e mede exec_module (inclui os imports aninhados)."""
+
+    def __init__(self, loader):
+        self._loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        t = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            _imports[module.__name__] = time.perf_counter() - t
+
+
+class _TimedFinder(MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader)
+                return spec
+        return None
+
+
+if ENABLED:
+    sys.meta_path.insert(0, _TimedFinder())
+
+
+@contextmanager
+def step(name: str):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        _steps.append((name, time.perf_counter() - t))
+
+
+def report(top: int = 20) -> None:
+    total_ms = (time.perf_counter() - T0) * 1000
+    print(f"[startup] pronto em {total_ms:.0f} ms (desde o import do app)")
+    if not ENABLED:
+        return
+    # tempo inclusivo: pacotes de topo + módulos do próprio app
+    rows = [(n, t) for n, t in _imports.items() if "." not in n or n.startswith("app.")]
+    rows.sort(key=lambda r: r[1], reverse=True)
+    for name, t in rows[:top]:
+        print(f"[startup]   import {name:<32} {t * 1000:8.1f} ms")
+    for name, t in _steps:
+        print(f"[startup]   etapa  {name:<32} {t * 1000:8.1f} ms")
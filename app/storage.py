@@ -1,23 +1,172 @@
 # app/storage.py
-import boto3
+# Acesso ao S3 (ou compatível). Um cliente boto3 por processo: montar o cliente
+# carrega o modelo do endpoint e abre um pool novo, caro demais por chamada.
+# boto3 só é importado no primeiro uso (~200 ms a menos no startup).
+import threading
+import time
+from collections import OrderedDict
+from typing import BinaryIO, Iterable, Optional, Tuple, Union
+
 from .settings import settings
 
+_client = None
+_client_lock = threading.Lock()
+
+
 def _s3():
-    kwargs = {}
-    if settings.AWS_S3_ENDPOINT_URL:
-        kwargs["endpoint_url"] = settings.AWS_S3_ENDPOINT_URL
-    return boto3.client(
-        "s3",
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        **kwargs
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import boto3
+                from botocore.config import Config
+
+                kwargs = {}
+                if settings.S3_ENDPOINT_URL:
+                    kwargs["endpoint_url"] = settings.S3_ENDPOINT_URL
+                if settings.AWS_DEFAULT_REGION:
+                    kwargs["region_name"] = settings.AWS_DEFAULT_REGION
+                # clientes boto3 são thread-safe; o pool precisa comportar os
+                # workers da fila + as threads do multipart
+                _client = boto3.client(
+                    "s3",
+                    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                    config=Config(
+                        max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                        connect_timeout=settings.S3_CONNECT_TIMEOUT_S,
+                        read_timeout=settings.S3_READ_TIMEOUT_S,
+                        retries={"max_attempts": 5, "mode": "adaptive"},
+                        tcp_keepalive=True,
+                    ),
+                    **kwargs
+                )
+    return _client
+
+
+def _transfer_config():
+    from boto3.s3.transfer import TransferConfig
+
+    mb = 1024 * 1024
+    return TransferConfig(
+        multipart_threshold=settings.S3_MULTIPART_THRESHOLD_MB * mb,
+        multipart_chunksize=settings.S3_MULTIPART_CHUNK_MB * mb,
+        max_concurrency=settings.S3_MULTIPART_CONCURRENCY,
+        use_threads=True,
     )
 
+
+class _IterReader:
+    """Adapta um iterador de bytes para a interface de arquivo (read) que o boto3 espera."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._it = iter(chunks)
+        self._buf = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buf) < size:
+            try:
+                self._buf += next(self._it)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buf)
+        out = bytes(self._buf[:size])
+        del self._buf[:size]
+        return out
+
+
 def upload_bytes(key: str, data: bytes, content_type="application/octet-stream"):
     s3 = _s3()
     s3.put_object(Bucket=settings.AWS_S3_BUCKET, Key=key, Body=data, ContentType=content_type)
     return key
 
+
+def upload_stream(key: str, data: Union[BinaryIO, Iterable[bytes]], content_type="application/octet-stream"):
+    """
+    Upload em streaming a partir de um arquivo (read) ou iterador de bytes.
+    Acima de S3_MULTIPART_THRESHOLD_MB vira multipart com partes enviadas em
+    paralelo; a memória de pico é ~ chunk * concorrência, não o tamanho do objeto.
+    """
+    fileobj = data if hasattr(data, "read") else _IterReader(data)
+    _s3().upload_fileobj(
+        fileobj, settings.AWS_S3_BUCKET, key,
+        ExtraArgs={"ContentType": content_type},
+        Config=_transfer_config(),
+    )
+    return key
+
+
+def _is_not_found(e: Exception) -> bool:
+    code = getattr(e, "response", {}).get("Error", {}).get("Code")
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+def object_exists(key: str) -> bool:
+    try:
+        _s3().head_object(Bucket=settings.AWS_S3_BUCKET, Key=key)
+    except Exception as e:
+        if _is_not_found(e):
+            return False
+        raise
+    return True
+
+
+def get_bytes(key: str) -> Optional[bytes]:
+    """Conteúdo do objeto, ou None se não existir."""
+    try:
+        return _s3().get_object(Bucket=settings.AWS_S3_BUCKET, Key=key)["Body"].read()
+    except Exception as e:
+        if _is_not_found(e):
+            return None
+        raise
+
+
+def upload_stream_if_absent(key: str, data: Union[BinaryIO, Iterable[bytes]],
+                            content_type="application/octet-stream") -> bool:
+    """
+    Para chaves endereçadas por conteúdo: se o objeto já existe, o conteúdo é
+    o mesmo e o upload é pulado. Devolve True se enviou.
+    """
+    if object_exists(key):
+        return False
+    upload_stream(key, data, content_type=content_type)
+    return True
+
+
+def copy_object(src: str, dst: str, storage_class: Optional[str] = None) -> str:
+    """Cópia dentro do bucket (do lado do S3, sem passar os bytes por aqui)."""
+    extra = {"StorageClass": storage_class} if storage_class else {}
+    _s3().copy(
+        {"Bucket": settings.AWS_S3_BUCKET, "Key": src}, settings.AWS_S3_BUCKET, dst,
+        ExtraArgs=extra or None, Config=_transfer_config(),
+    )
+    return dst
+
+
+def delete_object(key: str) -> None:
+    _s3().delete_object(Bucket=settings.AWS_S3_BUCKET, Key=key)
+
+
+def key_from_url(value: str) -> Optional[str]:
+    """
+    Chave no bucket a partir do que está em audio_url/pdf_url: registros novos já
+    guardam a chave; os antigos guardam a URL assinada (virtual-host ou path-style).
+    """
+    if not value.startswith(("http://", "https://")):
+        return value
+    from urllib.parse import unquote, urlparse
+
+    u = urlparse(value)
+    path = unquote(u.path).lstrip("/")
+    bucket = settings.AWS_S3_BUCKET
+    if u.netloc.startswith(bucket + "."):
+        return path or None
+    if path.startswith(bucket + "/"):
+        return path[len(bucket) + 1:] or None
+    return None
+
+
 def presigned_url(key: str, expires=3600):
     s3 = _s3()
     return s3.generate_presigned_url(
@@ -25,3 +174,62 @@ def presigned_url(key: str, expires=3600):
         Params={"Bucket": settings.AWS_S3_BUCKET, "Key": key},
         ExpiresIn=expires,
     )
+
+
+class PresignedCache:
+    """
+    LRU de URLs assinadas com expiração: uma URL só é reaproveitada enquanto
+    ainda vale por pelo menos `min_remaining` segundos (quem abre o link
+    precisa de tempo para baixar); as expiradas saem antes das menos usadas.
+    """
+
+    def __init__(self, maxsize: int, ttl: int, min_remaining: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.min_remaining = min(min_remaining, ttl // 2)
+        self._urls: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._urls.get(key)
+            if item is not None:
+                if item[1] - now >= self.min_remaining:
+                    self._urls.move_to_end(key)
+                    self.hits += 1
+                    return item[0]
+                del self._urls[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, url: str, signed_at: float) -> None:
+        with self._lock:
+            self._urls[key] = (url, signed_at + self.ttl)
+            self._urls.move_to_end(key)
+            if len(self._urls) > self.maxsize:
+                # primeiro as vencidas/quase vencidas, depois pela ordem LRU
+                limit = time.monotonic() + self.min_remaining
+                for k in [k for k, (_, exp) in self._urls.items() if exp < limit]:
+                    del self._urls[k]
+                while len(self._urls) > self.maxsize:
+                    self._urls.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._urls), "maxsize": self.maxsize}
+
+
+url_cache = PresignedCache(settings.PRESIGN_CACHE_SIZE, settings.PRESIGN_TTL_S, settings.PRESIGN_MIN_REMAINING_S)
+
+
+def cached_presigned_url(key: str) -> str:
+    """URL assinada para `key`, reaproveitada do cache enquanto válida."""
+    url = url_cache.get(key)
+    if url is None:
+        signed_at = time.monotonic()
+        url = presigned_url(key, expires=url_cache.ttl)
+        url_cache.put(key, url, signed_at)
+    return url
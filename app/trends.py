@@ -0,0 +1,198 @@
+# app/trends.py
+# Métricas dos exames em exam_results e o agregado por paciente/mês em
+# patient_trends, mantido na mesma transação que marca o exame como concluído.
+#   - record(): exames novos (pipeline); soma cada resultado inserido ao balde
+#     do mês com um upsert (o mesmo exame duas vezes não conta duas vezes)
+#   - replace(): métricas recalculadas (reprocess); máximo não se desfaz de
+#     forma incremental, então os baldes dos pacientes afetados são refeitos
+#   - python -m app.trends rebuild  refaz todos a partir de exam_results
+import argparse
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from .models import ExamResult, PatientTrend
+
+_SUMS = ("vazao_max_sum", "vazao_media_sum", "volume_sum")
+_MAXES = ("vazao_max_max", "volume_max", "last_exam_at")
+
+
+def result_row(exam_id: int, patient_id: int, exam_created_at: datetime, metrics: dict,
+               pipeline_version: str, pdf_key: Optional[str] = None) -> dict:
+    """Linha de exam_results a partir do dicionário de processing.metrics_from_features."""
+    m = metrics
+    return {
+        "exam_id": exam_id, "patient_id": patient_id, "exam_created_at": exam_created_at,
+        "month": date(exam_created_at.year, exam_created_at.month, 1),
+        "pipeline_version": pipeline_version,
+        "duracao_s": float(m["duracao_s"]),
+        "vazao_max_ml_s": float(m["vazao_max_ml_s"]),
+        "vazao_media_ml_s": float(m["vazao_media_ml_s"]),
+        "volume_total_ml": float(m["volume_total_ml"]),
+        "tempo_ate_pico_s": float(m["tempo_ate_pico_s"]),
+        "duracao_gravacao_s": float(m["duracao_gravacao_s"]),
+        "classe_dominante": m.get("classe_dominante"),
+        "summary": f"Vazão máx. {m['vazao_max_ml_s']} ml/s, média {m['vazao_media_ml_s']} ml/s, "
+                   f"volume {m['volume_total_ml']} ml",
+        "pdf_url": pdf_key,
+        "created_at": datetime.utcnow(),
+    }
+
+
+def _buckets(rows: Iterable[dict]) -> List[dict]:
+    """Um balde por (paciente, mês): o upsert não pode tocar a mesma linha duas vezes."""
+    out: Dict[Tuple[int, date], dict] = {}
+    for r in rows:
+        b = out.get((r["patient_id"], r["month"]))
+        if b is None:
+            b = out[(r["patient_id"], r["month"])] = {
+                "patient_id": r["patient_id"], "month": r["month"], "exams": 0,
+                "vazao_max_max": 0.0, "vazao_max_sum": 0.0, "vazao_media_sum": 0.0,
+                "volume_max": 0.0, "volume_sum": 0.0, "last_exam_at": r["exam_created_at"],
+            }
+        b["exams"] += 1
+        b["vazao_max_max"] = max(b["vazao_max_max"], r["vazao_max_ml_s"])
+        b["vazao_max_sum"] += r["vazao_max_ml_s"]
+        b["vazao_media_sum"] += r["vazao_media_ml_s"]
+        b["volume_max"] = max(b["volume_max"], r["volume_total_ml"])
+        b["volume_sum"] += r["volume_total_ml"]
+        b["last_exam_at"] = max(b["last_exam_at"], r["exam_created_at"])
+    return list(out.values())
+
+
+def _insert(dialect: str):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+def record(db: Session, rows: List[dict]) -> None:
+    """Grava os resultados novos e soma ao agregado. Não faz commit."""
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    insert = _insert(dialect)
+    if insert is None:
+        # fallback genérico: consulta + insert e refaz os baldes
+        existing = set(db.scalars(select(ExamResult.exam_id).where(
+            ExamResult.exam_id.in_([r["exam_id"] for r in rows]))))
+        new = [r for r in rows if r["exam_id"] not in existing]
+        if new:
+            db.execute(ExamResult.__table__.insert(), new)
+            rebuild(db, {r["patient_id"] for r in new})
+        return
+    inserted = set(db.scalars(
+        insert(ExamResult).values(rows)
+          .on_conflict_do_nothing(index_elements=["exam_id"])
+          .returning(ExamResult.exam_id)
+    ))
+    buckets = _buckets(r for r in rows if r["exam_id"] in inserted)
+    if not buckets:
+        return
+    stmt = insert(PatientTrend).values(buckets)
+    greatest = func.greatest if dialect == "postgresql" else func.max  # max(a, b) escalar no SQLite
+    t = PatientTrend.__table__.c
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["patient_id", "month"],
+        set_={
+            "exams": t.exams + stmt.excluded.exams,
+            **{c: t[c] + stmt.excluded[c] for c in _SUMS},
+            **{c: greatest(t[c], stmt.excluded[c]) for c in _MAXES},
+        },
+    )
+    db.execute(stmt)
+
+
+def replace(db: Session, rows: List[dict]) -> None:
+    """Troca os resultados destes exames (métricas recalculadas) e refaz os baldes. Não faz commit."""
+    if not rows:
+        return
+    db.execute(delete(ExamResult).where(ExamResult.exam_id.in_([r["exam_id"] for r in rows])))
+    db.execute(ExamResult.__table__.insert(), rows)
+    rebuild(db, {r["patient_id"] for r in rows})
+
+
+def rebuild(db: Session, patient_ids: Optional[Iterable[int]] = None) -> int:
+    """Recalcula os baldes (de todos os pacientes com None) a partir de exam_results."""
+    r = ExamResult
+    stmt = (
+        select(r.patient_id, r.month, func.count(), func.max(r.vazao_max_ml_s), func.sum(r.vazao_max_ml_s),
+               func.sum(r.vazao_media_ml_s), func.max(r.volume_total_ml), func.sum(r.volume_total_ml),
+               func.max(r.exam_created_at))
+          .group_by(r.patient_id, r.month)
+    )
+    wipe = delete(PatientTrend)
+    if patient_ids is not None:
+        ids = list(patient_ids)
+        stmt = stmt.where(r.patient_id.in_(ids))
+        wipe = wipe.where(PatientTrend.patient_id.in_(ids))
+    keys = ("patient_id", "month", "exams", "vazao_max_max", "vazao_max_sum", "vazao_media_sum",
+            "volume_max", "volume_sum", "last_exam_at")
+    buckets = [dict(zip(keys, row)) for row in db.execute(stmt)]
+    db.execute(wipe)
+    if buckets:
+        db.execute(PatientTrend.__table__.insert(), buckets)
+    return len(buckets)
+
+
+def trend(buckets: List[PatientTrend], window: int) -> dict:
+    """Resposta de /patients/{id}/trend: totais, pontos mensais e médias móveis de `window` meses."""
+    def mean(total, n):
+        return round(total / n, 1) if n else None
+
+    points = []
+    for i, b in enumerate(buckets):
+        recent = buckets[max(0, i - window + 1):i + 1]
+        n = sum(x.exams for x in recent)
+        points.append({
+            "month": b.month,
+            "exams": b.exams,
+            "vazao_max_ml_s": b.vazao_max_max,
+            "vazao_max_mean": mean(b.vazao_max_sum, b.exams),
+            "vazao_media_mean": mean(b.vazao_media_sum, b.exams),
+            "volume_max_ml": b.volume_max,
+            "volume_mean_ml": mean(b.volume_sum, b.exams),
+            "rolling_vazao_max_mean": mean(sum(x.vazao_max_sum for x in recent), n),
+            "rolling_vazao_max_ml_s": max(x.vazao_max_max for x in recent),
+            "rolling_volume_mean_ml": mean(sum(x.volume_sum for x in recent), n),
+        })
+    n = sum(b.exams for b in buckets)
+    return {
+        "exams": n,
+        "vazao_max_ml_s": max((b.vazao_max_max for b in buckets), default=None),
+        "vazao_max_mean": mean(sum(b.vazao_max_sum for b in buckets), n),
+        "vazao_media_mean": mean(sum(b.vazao_media_sum for b in buckets), n),
+        "volume_max_ml": max((b.volume_max for b in buckets), default=None),
+        "volume_mean_ml": mean(sum(b.volume_sum for b in buckets), n),
+        "last_exam_at": max((b.last_exam_at for b in buckets if b.last_exam_at), default=None),
+        "window_months": window,
+        "points": points,
+    }
+
+
+def main():
+    from .db import SessionLocal
+
+    ap = argparse.ArgumentParser(description="Agregados de tendência por paciente (patient_trends).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rb = sub.add_parser("rebuild", help="refaz os baldes a partir de exam_results")
+    rb.add_argument("--patient", type=int, nargs="+", default=None)
+    args = ap.parse_args()
+    db = SessionLocal()
+    try:
+        n = rebuild(db, args.patient)
+        db.commit()
+    finally:
+        db.close()
+    print(f"[trends] {n} baldes (paciente, mês) recalculados")
+
+
+if __name__ == "__main__":
+    main()
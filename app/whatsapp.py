@@ -1,10 +1,55 @@
-import requests
+# app/whatsapp.py
+# Cliente da Graph API (WhatsApp Cloud). Um único cliente por processo com pool
+# de conexões keep-alive (evita handshake TCP+TLS a cada chamada), timeouts e
+# retry com backoff exponencial + jitter, respeitando Retry-After:
+#   - GET (mídia): erro de conexão, timeout, 429 e 5xx
+#   - POST /messages não é idempotente (um 5xx ou timeout pode ter enviado a
+#     mensagem): só quando a conexão nem abriu ou num 429 (a Meta recusou, não
+#     enviou; com ou sem Retry-After, que a Meta muitas vezes não manda)
+#   python -m bench.check_graph_retry  confere isso contra um servidor local
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from .media import MediaBuffer, MediaTooLarge
+from .metrics import graph_errors_total
 from .settings import settings
 
-GRAPH = "https://graph.facebook.com/v19.0"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD"}
 
-def send_template_message(to_whatsapp: str, template_name: str, lang="pt_BR", components=None):
-    url = f"{GRAPH}/{settings.WHATSAPP_PHONE_ID}/messages"
+
+def _should_retry_status(method: str, status: int) -> bool:
+    if method in IDEMPOTENT_METHODS:
+        return status in RETRY_STATUS
+    return status == 429
+
+
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int, retry_after: Optional[float]) -> float:
+    cap = min(settings.WHATSAPP_BACKOFF_MAX_S, settings.WHATSAPP_BACKOFF_BASE_S * (2 ** attempt))
+    delay = random.uniform(0, cap)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, settings.WHATSAPP_BACKOFF_MAX_S))
+    return delay
+
+
+# ---------- payloads ----------
+def _template_payload(to_whatsapp: str, template_name: str, lang: str, components=None) -> dict:
     payload = {
         "messaging_product": "whatsapp",
         "to": to_whatsapp,
@@ -16,26 +61,20 @@ def send_template_message(to_whatsapp: str, template_name: str, lang="pt_BR", co
     }
     if components:
         payload["template"]["components"] = components
+    return payload
 
-    r = requests.post(url, json=payload, headers={"Authorization": f"Bearer {settings.META_TOKEN}"})
-    r.raise_for_status()
-    return r.json()
 
-def send_text(to_whatsapp: str, text: str):
-    url = f"{GRAPH}/{settings.WHATSAPP_PHONE_ID}/messages"
-    payload = {
+def _text_payload(to_whatsapp: str, text: str) -> dict:
+    return {
         "messaging_product": "whatsapp",
         "to": to_whatsapp,
         "type": "text",
         "text": {"body": text}
     }
-    r = requests.post(url, json=payload, headers={"Authorization": f"Bearer {settings.META_TOKEN}"})
-    r.raise_for_status()
-    return r.json()
 
-def send_document(to_whatsapp: str, doc_url: str, caption: str = "Resultado do exame"):
-    url = f"{GRAPH}/{settings.WHATSAPP_PHONE_ID}/messages"
-    payload = {
+
+def _document_payload(to_whatsapp: str, doc_url: str, caption: str) -> dict:
+    return {
         "messaging_product": "whatsapp",
         "to": to_whatsapp,
         "type": "document",
@@ -45,17 +84,128 @@ def send_document(to_whatsapp: str, doc_url: str, caption: str = "Resultado do e
             "caption": caption
         }
     }
-    r = requests.post(url, json=payload, headers={"Authorization": f"Bearer {settings.META_TOKEN}"})
-    r.raise_for_status()
-    return r.json()
+
+
+class GraphClient:
+    def __init__(self, base_url: str | None = None, token: str | None = None,
+                 phone_number_id: str | None = None):
+        self.base_url = (base_url or settings.META_WABA_API_BASE).rstrip("/")
+        self.token = token or settings.WHATSAPP_TOKEN
+        self.phone_number_id = phone_number_id or settings.WHATSAPP_PHONE_NUMBER_ID
+        import requests  # carregado no primeiro uso, não no import do app
+        from requests.adapters import HTTPAdapter
+
+        self._requests = requests
+        self.timeout = (settings.WHATSAPP_CONNECT_TIMEOUT_S, settings.WHATSAPP_READ_TIMEOUT_S)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.WHATSAPP_POOL_MAXSIZE,
+                              max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Authorization"] = f"Bearer {self.token}"
+
+    def _never_sent(self, e: Exception) -> bool:
+        """A conexão não chegou a abrir (recusada, DNS, timeout de conexão): o pedido não saiu."""
+        from urllib3.exceptions import ConnectTimeoutError  # NewConnectionError herda dela
+
+        if isinstance(e, self._requests.ConnectTimeout):
+            return True
+        reason = getattr(e.args[0], "reason", None) if e.args else None
+        return isinstance(reason, ConnectTimeoutError)
+
+    def request(self, method: str, url: str, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        method = method.upper()
+        retries = settings.WHATSAPP_MAX_RETRIES
+        for attempt in range(retries + 1):
+            try:
+                r = self.session.request(method, url, **kwargs)
+            except (self._requests.ConnectionError, self._requests.Timeout) as e:
+                graph_errors_total.inc(reason=type(e).__name__)
+                if attempt >= retries or (method not in IDEMPOTENT_METHODS and not self._never_sent(e)):
+                    raise
+                time.sleep(_backoff(attempt, None))
+                continue
+            if r.status_code >= 400:
+                graph_errors_total.inc(reason=str(r.status_code))
+            retry_after = _retry_after_seconds(r.headers.get("Retry-After"))
+            if attempt < retries and _should_retry_status(method, r.status_code):
+                delay = _backoff(attempt, retry_after)
+                r.close()
+                time.sleep(delay)
+                continue
+            r.raise_for_status()
+            return r
+        raise AssertionError("unreachable")
+
+    def _messages_url(self) -> str:
+        return f"{self.base_url}/{self.phone_number_id}/messages"
+
+    def send_template_message(self, to_whatsapp: str, template_name: str, lang="pt_BR", components=None):
+        return self.request("POST", self._messages_url(),
+                            json=_template_payload(to_whatsapp, template_name, lang, components)).json()
+
+    def send_text(self, to_whatsapp: str, text: str):
+        return self.request("POST", self._messages_url(), json=_text_payload(to_whatsapp, text)).json()
+
+    def send_document(self, to_whatsapp: str, doc_url: str, caption: str = "Resultado do exame"):
+        return self.request("POST", self._messages_url(),
+                            json=_document_payload(to_whatsapp, doc_url, caption)).json()
+
+    def get_media_url(self, media_id: str) -> str:
+        return self.request("GET", f"{self.base_url}/{media_id}").json()["url"]
+
+    def download_media(self, media_url: str) -> bytes:
+        return self.request("GET", media_url).content
+
+    def download_media_to(self, media_url: str, max_bytes: Optional[int] = None) -> MediaBuffer:
+        """Baixa em streaming (iter_content) para um MediaBuffer, com limite de tamanho."""
+        buf = MediaBuffer(max_bytes=max_bytes)
+        try:
+            with self.request("GET", media_url, stream=True) as r:
+                length = r.headers.get("Content-Length")
+                if length and int(length) > buf.max_bytes:
+                    raise MediaTooLarge(f"mídia de {length} bytes excede {buf.max_bytes}")
+                for chunk in r.iter_content(settings.MEDIA_DOWNLOAD_CHUNK):
+                    buf.write(chunk)
+        except BaseException:
+            buf.close()
+            raise
+        return buf
+
+    def close(self):
+        self.session.close()
+
+
+_client: Optional[GraphClient] = None
+_client_lock = threading.Lock()
+
+
+def client() -> GraphClient:
+    """Cliente compartilhado do processo (pool de conexões reaproveitado entre threads)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GraphClient()
+    return _client
+
+
+# ---------- API de módulo (mantida para quem já chama estas funções) ----------
+def send_template_message(to_whatsapp: str, template_name: str, lang="pt_BR", components=None):
+    return client().send_template_message(to_whatsapp, template_name, lang, components)
+
+def send_text(to_whatsapp: str, text: str):
+    return client().send_text(to_whatsapp, text)
+
+def send_document(to_whatsapp: str, doc_url: str, caption: str = "Resultado do exame"):
+    return client().send_document(to_whatsapp, doc_url, caption)
 
 def get_media_url(media_id: str) -> str:
-    url = f"{GRAPH}/{media_id}"
-    r = requests.get(url, headers={"Authorization": f"Bearer {settings.META_TOKEN}"})
-    r.raise_for_status()
-    return r.json()["url"]
+    return client().get_media_url(media_id)
 
 def download_media(media_url: str) -> bytes:
-    r = requests.get(media_url, headers={"Authorization": f"Bearer {settings.META_TOKEN}"})
-    r.raise_for_status()
-    return r.content
+    return client().download_media(media_url)
+
+def download_media_to(media_url: str, max_bytes: Optional[int] = None) -> MediaBuffer:
+    return client().download_media_to(media_url, max_bytes)
@@ -0,0 +1,97 @@
+# app/worker.py
+# Pool de workers da fila de jobs.
+#   - dentro do web (JOB_RUN_IN_APP=true, padrão): iniciado no startup do FastAPI
+#   - processo próprio (Procfile "worker"): python -m app.worker
+import os
+import signal
+import socket
+import threading
+import time
+
+from .db import SessionLocal, engine
+from .settings import settings
+from . import jobs, metrics, cpu_pool, partitions
+from . import pipeline, campaigns  # noqa: F401  (registram os handlers)
+
+
+class WorkerPool:
+    def __init__(self, concurrency: int | None = None, poll_interval: float | None = None):
+        self.concurrency = concurrency or settings.JOB_CONCURRENCY
+        self.poll_interval = poll_interval if poll_interval is not None else settings.JOB_POLL_INTERVAL_S
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self, wait_cpu: bool = False):
+        # no web os processos de análise/laudo sobem (e aquecem) em paralelo, sem
+        # bloquear: o spawn leva dezenas de ms por processo e o app já pode atender;
+        # o worker em processo próprio passa wait_cpu=True e espera o aquecimento
+        if wait_cpu:
+            cpu_pool.pool.start(wait=True)
+        else:
+            threading.Thread(target=cpu_pool.pool.start, name="cpu-pool-start", daemon=True).start()
+        for i in range(self.concurrency):
+            t = threading.Thread(target=self._loop, args=(f"{self._prefix}:{i}",),
+                                 name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        if settings.EXAMS_PARTITION_CHECK_S:
+            t = threading.Thread(target=self._partitions_loop, name="exam-partitions", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads.clear()
+        cpu_pool.pool.shutdown()
+
+    def _loop(self, worker_id: str):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                # lote: jobs do mesmo tipo dividem consultas e commits (ver jobs.run_jobs)
+                claimed = jobs.claim(db, worker_id, limit=settings.JOB_BATCH_SIZE)
+                for job_id, kind, err in jobs.run_jobs(db, claimed):
+                    print(f"[worker {worker_id}] job {job_id} ({kind}) falhou: {err}")
+            except Exception as e:
+                # erro de banco etc.: espera e tenta de novo
+                db.rollback()
+                print(f"[worker {worker_id}] erro no loop: {e}")
+                claimed = []
+            finally:
+                db.close()
+            if not claimed:
+                self._stop.wait(self.poll_interval)
+
+    def _partitions_loop(self):
+        # partições do mês atual e dos próximos sempre prontas (vários workers: advisory lock)
+        while True:
+            try:
+                with engine.begin() as conn:
+                    created = partitions.ensure_partitions(conn)
+                if created:
+                    print(f"[worker] partições criadas: {', '.join(created)}")
+            except Exception as e:
+                print(f"[worker] partições: {type(e).__name__}: {e}")
+            if self._stop.wait(settings.EXAMS_PARTITION_CHECK_S):
+                return
+
+
+def main():
+    pool = WorkerPool()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    pool.start(wait_cpu=True)  # processo próprio: pode esperar o aquecimento
+    if settings.WORKER_METRICS_PORT:
+        metrics.serve(settings.WORKER_METRICS_PORT)
+    print(f"[worker] {pool.concurrency} workers ativos, {cpu_pool.pool.workers} processos de CPU")
+    while not stop.is_set():
+        time.sleep(0.5)
+    pool.stop()
+
+
+if __name__ == "__main__":
+    main()
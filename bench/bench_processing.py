@@ -0,0 +1,82 @@
+# bench/bench_processing.py
+# Micro-benchmark do motor de análise: ms de CPU por minuto de áudio.
+#   python -m bench.bench_processing                 # PCM sintético (só análise)
+#   python -m bench.bench_processing --file x.ogg    # inclui a decodificação (ffmpeg)
+#   python -m bench.bench_processing --check         # sanidade: números na faixa fisiológica
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from app.processing import SAMPLE_RATE, analyze_pcm, process_audio_bytes
+
+
+def synthetic_pcm(minutes: float, seed: int = 0) -> np.ndarray:
+    """Ruído de fundo + um "jato" com envelope em sino no meio da gravação."""
+    rng = np.random.default_rng(seed)
+    n = int(minutes * 60 * SAMPLE_RATE)
+    t = np.arange(n, dtype=np.float32) / SAMPLE_RATE
+    dur = t[-1]
+    a, b = 0.1 * dur, 0.9 * dur
+    env = np.abs(np.sin(np.pi * np.clip((t - a) / (b - a), 0.0, 1.0))) ** 1.5
+    return (0.005 * rng.standard_normal(n) + 0.2 * env * rng.standard_normal(n)).astype(np.float32)
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def check() -> int:
+    """
+    Sanidade da escala (FLOW_GAIN é placeholder, ver app/processing.py): no jato
+    sintético os números têm que ser fisiológicos, Qmax 5-60 ml/s, Qave < Qmax e
+    volume < 1 L até 2 min de gravação. Não é calibração. Devolve quantos falharam.
+    """
+    failed = 0
+    for minutes in (0.3, 1.0, 2.0):
+        for seed in range(3):
+            m = analyze_pcm(synthetic_pcm(minutes, seed=seed))
+            qmax, qave, vol = m["vazao_max_ml_s"], m["vazao_media_ml_s"], m["volume_total_ml"]
+            ok = 5.0 <= qmax <= 60.0 and 0.0 < qave < qmax and 0.0 < vol < 1000.0
+            failed += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {minutes:.1f} min seed={seed}: Qmax {qmax} ml/s, "
+                  f"Qave {qave} ml/s, volume {vol} ml, fluxo {m['duracao_s']} s")
+    return failed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--minutes", type=float, default=1.0, help="duração do áudio sintético")
+    ap.add_argument("--file", help="arquivo de áudio real (OGG/Opus), decodificado via ffmpeg")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--check", action="store_true", help="só confere se a escala da vazão dá números fisiológicos")
+    args = ap.parse_args()
+
+    if args.check:
+        sys.exit(1 if check() else 0)
+
+    if args.file:
+        data = open(args.file, "rb").read()
+        metrics = process_audio_bytes(data)
+        minutes = metrics["duracao_gravacao_s"] / 60.0
+        best = _time(lambda: process_audio_bytes(data), args.repeat)
+        label = "decodificação + análise"
+    else:
+        pcm = synthetic_pcm(args.minutes)
+        minutes = args.minutes
+        best = _time(lambda: analyze_pcm(pcm), args.repeat)
+        label = "análise (PCM sintético)"
+
+    ms_per_min = best * 1000.0 / minutes
+    print(f"{label}: {minutes:.2f} min de áudio em {best * 1000:.1f} ms "
+          f"-> {ms_per_min:.1f} ms/min ({60000.0 / ms_per_min:.0f}x tempo real)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# bench/bench_report.py
+# Benchmark do laudo: PDFs por segundo em um núcleo, com e sem compressão.
+#   python -m bench.bench_report --minutes 5 --n 200
+#   python -m bench.bench_report --check   # replay do form == desenho pela API pública
+import argparse
+import sys
+import time
+
+from app import report
+from app.processing import analyze_pcm
+from app.report import build_pdf_bytes
+from bench.bench_processing import synthetic_pcm
+
+
+def check() -> int:
+    """
+    Laudos com o form gravado (replay) e desenhado pela API, byte a byte
+    (invariant=1), para gravações de várias durações. Devolve quantos diferem.
+    """
+    static = report._static_stream()
+    if static is None:
+        print("FAIL replay desligado: a conferência do processo já achou diferença nesta versão do reportlab")
+        return 1
+    failed = 0
+    for minutes in (0.1, 1.0, 5.0):
+        metrics = analyze_pcm(synthetic_pcm(minutes))
+        for compress in (True, False):
+            args = ("Paciente Teste", "000.000.000-00", metrics, compress)
+            same = (report._render(*args, static=static, invariant=True)
+                    == report._render(*args, static=None, invariant=True))
+            failed += not same
+            print(f"{'ok  ' if same else 'FAIL'} {minutes:.1f} min compress={'on ' if compress else 'off'}")
+    return failed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--minutes", type=float, default=1.0, help="duração da gravação sintética")
+    ap.add_argument("--n", type=int, default=100, help="laudos por rodada")
+    ap.add_argument("--check", action="store_true", help="só confere o replay do form contra o desenho")
+    args = ap.parse_args()
+
+    if args.check:
+        sys.exit(1 if check() else 0)
+
+    metrics = analyze_pcm(synthetic_pcm(args.minutes))
+    build_pdf_bytes("Paciente Teste", "000.000.000-00", metrics)  # aquece o layout
+
+    for compress in (True, False):
+        t0 = time.perf_counter()
+        for _ in range(args.n):
+            pdf = build_pdf_bytes("Paciente Teste", "000.000.000-00", metrics, compress=compress)
+        dt = time.perf_counter() - t0
+        print(f"compress={'on ' if compress else 'off'}: {args.n / dt:7.1f} laudos/s/núcleo "
+              f"({dt * 1000 / args.n:.2f} ms/laudo, {len(pdf) / 1024:.1f} KiB, "
+              f"{len(metrics['curva_ml_s'])} pontos na curva)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# bench/check_graph_retry.py
+# Confere a política de retry do cliente da Graph API (app/whatsapp.py) contra um
+# servidor local com respostas roteirizadas:
+#   - GET de mídia: 5xx e timeout têm retry
+#   - POST /messages: 5xx e timeout de leitura NÃO (podem ter enviado); 429 sim,
+#     com ou sem Retry-After (com ele, esperando o tempo pedido); conexão recusada sim
+#   python -m bench.check_graph_retry
+# Sai com código 1 se algum caso falhar.
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")  # app.settings exige; não é usado aqui
+
+from app.settings import settings  # noqa: E402
+
+settings.WHATSAPP_MAX_RETRIES = 3
+settings.WHATSAPP_BACKOFF_BASE_S = 0.01
+settings.WHATSAPP_BACKOFF_MAX_S = 2.0
+settings.WHATSAPP_READ_TIMEOUT_S = 0.3
+
+from app import whatsapp  # noqa: E402
+
+
+class Script:
+    """Respostas por caminho, consumidas em ordem; a última se repete."""
+
+    def __init__(self):
+        self.plans = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def set(self, path: str, plan: list):
+        with self.lock:
+            self.plans[path] = list(plan)
+            self.calls[path] = 0
+
+    def next(self, path: str):
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+            plan = self.plans.get(path) or [(200, {}, 0.0)]
+            return plan.pop(0) if len(plan) > 1 else plan[0]
+
+
+def make_handler(script: Script):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            status, headers, sleep_s = script.next(self.path)
+            if sleep_s:
+                time.sleep(sleep_s)
+            data = json.dumps({"url": "http://x/media", "messages": [{"id": "wamid.1"}]}).encode()
+            try:
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            except OSError:
+                pass  # o cliente desistiu (timeout)
+
+        do_GET = _reply
+        do_POST = _reply
+
+    return Handler
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# (nome, método, caminho, roteiro, chamadas esperadas, deve dar certo, espera mínima em s)
+CASES = [
+    ("GET 503,503,200", "GET", "/media1", [(503, {}, 0), (503, {}, 0), (200, {}, 0)], 3, True, 0.0),
+    ("GET timeout,200", "GET", "/media2", [(200, {}, 0.6), (200, {}, 0)], 2, True, 0.0),
+    ("POST 503", "POST", "/p/messages", [(503, {}, 0), (200, {}, 0)], 1, False, 0.0),
+    ("POST 500", "POST", "/p/messages", [(500, {}, 0), (200, {}, 0)], 1, False, 0.0),
+    ("POST timeout", "POST", "/p/messages", [(200, {}, 0.6), (200, {}, 0)], 1, False, 0.0),
+    ("POST 429 sem Retry-After", "POST", "/p/messages", [(429, {}, 0), (200, {}, 0)], 2, True, 0.0),
+    ("POST 429 Retry-After: 1", "POST", "/p/messages",
+     [(429, {"Retry-After": "1"}, 0), (200, {}, 0)], 2, True, 1.0),
+    ("GET 429 Retry-After: 1", "GET", "/media3",
+     [(429, {"Retry-After": "1"}, 0), (200, {}, 0)], 2, True, 1.0),
+]
+
+
+def _refused_calls() -> float:
+    return sum(v for _, labels, v in whatsapp.graph_errors_total.samples()
+               if dict(labels).get("reason") == "ConnectionError")
+
+
+def run_sync(base: str, script: Script) -> list:
+    c = whatsapp.GraphClient(base_url=base, token="x", phone_number_id="p")
+    out = []
+    try:
+        for name, method, path, plan, calls, ok, min_wait in CASES:
+            script.set(path, plan)
+            t0 = time.perf_counter()
+            try:
+                c.request(method, base + path)
+                got_ok = True
+            except Exception:
+                got_ok = False
+            out.append((name, script.calls[path], got_ok, time.perf_counter() - t0, calls, ok, min_wait))
+    finally:
+        c.close()
+    return out
+
+
+def check_refused() -> tuple:
+    """POST numa porta fechada: a conexão nem abriu, então tem retry (MAX_RETRIES + 1 tentativas)."""
+    base = f"http://127.0.0.1:{free_port()}"
+    before = _refused_calls()
+    try:
+        c = whatsapp.GraphClient(base_url=base, token="x", phone_number_id="p")
+        try:
+            c.send_text("5511", "oi")
+        finally:
+            c.close()
+        got_ok = True
+    except Exception:
+        got_ok = False
+    calls = settings.WHATSAPP_MAX_RETRIES + 1
+    return ("POST conexão recusada", int(_refused_calls() - before), got_ok, 0.0, calls, False, 0.0)
+
+
+def main():
+    script = Script()
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), make_handler(script))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    failed = 0
+    try:
+        for name, got_calls, got_ok, elapsed, calls, ok, min_wait in run_sync(base, script) + [check_refused()]:
+            good = got_calls == calls and got_ok == ok and elapsed >= min_wait
+            failed += not good
+            print(f"{'ok  ' if good else 'FAIL'} {name:26s} chamadas={got_calls} (esperado {calls}) "
+                  f"{'sucesso' if got_ok else 'erro'} {elapsed:.2f}s")
+    finally:
+        server.shutdown()
+    print(f"{failed} falha(s)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# bench/check_partitions.py
+# Confere num Postgres de verdade o DDL de app/partitions.py, que no SQLite não
+# roda: parte de um banco no formato original (patients + exams comuns, como o
+# create_all criava antes das migrações), aplica python -m app.migrations
+# (0001..0005, a 0005 converte exams para particionada), cria um mês que já tem
+# linhas na exams_default e arquiva os meses antigos contra o bench.stub_s3.
+#   DATABASE_URL=postgresql://postgres@127.0.0.1:5432/uroflux_check \
+#       python -m bench.check_partitions --reset
+# Use um banco descartável: --reset apaga o schema public inteiro. Precisa da
+# extensão pg_trgm (migração 0002). Sai com código 1 se alguma conferência falhar.
+import argparse
+import os
+import socket
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text,
+                        insert, inspect, text)
+from sqlalchemy.exc import IntegrityError
+
+from bench.stub_s3 import S3Stub, serve
+
+with socket.socket() as _s:
+    _s.bind(("127.0.0.1", 0))
+    _s3_port = _s.getsockname()[1]
+os.environ.update({
+    "S3_ENDPOINT_URL": f"http://127.0.0.1:{_s3_port}", "AWS_S3_BUCKET": "check",
+    "AWS_ACCESS_KEY_ID": "x", "AWS_SECRET_ACCESS_KEY": "x", "AWS_DEFAULT_REGION": "us-east-1",
+})
+
+from app import partitions, storage  # noqa: E402
+from app.db import engine  # noqa: E402
+from app.migrations import upgrade  # noqa: E402
+from app.models import Exam  # noqa: E402
+from app.partitions import add_months, month_start, partition_name  # noqa: E402
+from app.settings import settings  # noqa: E402
+
+# tabelas como o create_all as criava antes das migrações (commit inicial)
+LEGACY = MetaData()
+Table("patients", LEGACY,
+      Column("id", Integer, primary_key=True, index=True),
+      Column("name", String(255), nullable=False),
+      Column("cpf", String(14), unique=True, index=True, nullable=False),
+      Column("whatsapp", String(32), index=True, nullable=False),
+      Column("created_at", DateTime, nullable=False))
+Table("exams", LEGACY,
+      Column("id", Integer, primary_key=True, index=True),
+      Column("patient_id", Integer, ForeignKey("patients.id"), nullable=False, index=True),
+      Column("meta_message_id", String(64)),
+      Column("audio_url", Text),
+      Column("pdf_url", Text),
+      Column("status", String(32), nullable=False),
+      Column("created_at", DateTime, nullable=False))
+
+AHEAD = settings.EXAMS_PARTITIONS_AHEAD
+NOW = month_start(datetime.utcnow())
+
+
+def at(months: int, day: int = 10) -> datetime:
+    return datetime.combine(add_months(NOW, months), datetime.min.time()) + timedelta(days=day - 1, hours=12)
+
+
+# (id, meses a partir do atual, audio_url) dos exames antigos
+LEGACY_EXAMS = [
+    (1, -14, "audio/legacy-1.ogg"),
+    (2, -14, "https://check.s3.amazonaws.com/audio/legacy-2.ogg?X-Amz-Signature=abc"),  # URL assinada antiga
+    (3, -13, None),                                    # sem áudio: não entra no arquivo
+    (4, -2, "audio/legacy-4.ogg"),
+    (5, 0, "audio/legacy-5.ogg"),
+    (6, AHEAD + 2, "audio/legacy-6.ogg"),              # relógio adiantado: cai na exams_default
+]
+
+
+class Checks:
+    def __init__(self):
+        self.failed = 0
+
+    def __call__(self, name: str, good: bool, detail="") -> None:
+        self.failed += not good
+        print(f"{'ok  ' if good else 'FAIL'} {name}" + (f": {detail}" if detail != "" else ""))
+
+
+def reset(conn) -> None:
+    conn.execute(text("DROP SCHEMA public CASCADE"))
+    conn.execute(text("CREATE SCHEMA public"))
+
+
+def seed_legacy() -> None:
+    LEGACY.create_all(bind=engine)
+    patients, exams = LEGACY.tables["patients"], LEGACY.tables["exams"]
+    with engine.begin() as conn:
+        conn.execute(insert(patients), [
+            {"id": 1, "name": "José Conferência", "cpf": "111.111.111-11", "whatsapp": "+55 11 90000-0001",
+             "created_at": at(-15)},
+            {"id": 2, "name": "Ana Partição", "cpf": "222.222.222-22", "whatsapp": "+55 11 90000-0002",
+             "created_at": at(-15)},
+        ])
+        conn.execute(insert(exams), [
+            {"id": i, "patient_id": 1 + i % 2, "meta_message_id": f"wamid.legacy{i}", "audio_url": url,
+             "pdf_url": None, "status": "done", "created_at": at(m)}
+            for i, m, url in LEGACY_EXAMS
+        ])
+        conn.execute(text("SELECT setval(pg_get_serial_sequence('patients', 'id'), 2)"))
+        conn.execute(text("SELECT setval(pg_get_serial_sequence('exams', 'id'), 6)"))
+    for i, _, url in LEGACY_EXAMS:
+        if url:
+            storage.upload_bytes(storage.key_from_url(url), f"audio {i}".encode())
+
+
+def partition_of(conn, exam_id: int) -> str:
+    return conn.execute(text("SELECT tableoid::regclass::text FROM exams WHERE id = :id"), {"id": exam_id}).scalar()
+
+
+def check_converted(check: Checks) -> None:
+    with engine.connect() as conn:
+        check("exams particionada", partitions.is_partitioned(conn))
+        check("exams_old removida", conn.execute(text("SELECT to_regclass('exams_old')")).scalar() is None)
+        ids = conn.execute(text("SELECT id FROM exams ORDER BY id")).scalars().all()
+        check("linhas preservadas", ids == [i for i, _, _ in LEGACY_EXAMS], ids)
+        for i, m, _ in LEGACY_EXAMS:
+            want = "exams_default" if m > AHEAD else partition_name(add_months(NOW, m))
+            got = partition_of(conn, i)
+            check(f"exame {i} em {want}", got == want, got)
+        want = {partition_name(add_months(NOW, m)) for m in range(-14, AHEAD + 1)}
+        got = set(conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'exams'::regclass AND c.relname <> 'exams_default'"
+        )).scalars())
+        check(f"partições do mais antigo até +{AHEAD} meses", got == want, sorted(got ^ want))
+        indexes = {ix["name"] for ix in inspect(conn).get_indexes("exams")}
+        need = {"ix_exams_created_at_brin", "ix_exams_patient_id_id", "ix_exams_audio_sha256",
+                "ix_exams_meta_message_id"}
+        check("índices do models.Exam no pai", need <= indexes, sorted(need - indexes))
+        pk = inspect(conn).get_pk_constraint("exams")
+        check("PK (id, created_at)", pk["constrained_columns"] == ["id", "created_at"], pk["constrained_columns"])
+        messages = conn.execute(text("SELECT count(*) FROM exam_messages")).scalar()
+        check("exam_messages preenchida (0004)", messages == len(LEGACY_EXAMS), messages)
+
+    # a sequência continua de onde parou e a FK para patients segue valendo
+    with engine.begin() as conn:
+        new_id = conn.execute(insert(Exam).values(patient_id=1, status="received", created_at=datetime.utcnow())
+                              .returning(Exam.id)).scalar()
+        check("sequência do id preservada", new_id == 7, new_id)
+        conn.execute(text("DELETE FROM exams WHERE id = :id"), {"id": new_id})
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(Exam).values(patient_id=999, status="received", created_at=datetime.utcnow()))
+        check("FK exams.patient_id", False, "exame sem paciente foi aceito")
+    except IntegrityError:
+        check("FK exams.patient_id", True)
+
+
+def check_default_move(check: Checks) -> None:
+    with engine.begin() as conn:
+        created = partitions.ensure_partitions(conn, ahead=AHEAD + 2)
+    want = [partition_name(add_months(NOW, m)) for m in (AHEAD + 1, AHEAD + 2)]
+    check("ensure_partitions cria os meses que faltam", created == want, created)
+    with engine.connect() as conn:
+        got = partition_of(conn, 6)
+        check("linha da exams_default movida para o mês", got == want[-1], got)
+        left = conn.execute(text("SELECT count(*) FROM exams_default")).scalar()
+        check("exams_default vazia", left == 0, left)
+    with engine.begin() as conn:
+        again = partitions.ensure_partitions(conn, ahead=AHEAD + 2)
+    check("ensure_partitions idempotente", again == [], again)
+
+
+def check_archive(check: Checks, stub: S3Stub) -> None:
+    settings.EXAMS_ARCHIVE_AFTER_MONTHS = 12
+    prefix = settings.EXAMS_ARCHIVE_PREFIX
+    # o áudio do exame 1 é o mesmo de um exame recente (endereçado por conteúdo)
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE exams SET audio_sha256 = 'sha-1' WHERE id = 1"))
+        conn.execute(insert(Exam).values(id=100, patient_id=1, status="done", created_at=at(0, day=2),
+                                         audio_url="audio/legacy-1.ogg", audio_sha256="sha-1"))
+
+    def urls():
+        with engine.connect() as conn:
+            return dict(conn.execute(text("SELECT id, audio_url FROM exams")).all())
+
+    def keys():
+        with stub.lock:
+            return {k for b, k in stub.objects}
+
+    before = urls()
+    partitions.archive(engine, dry_run=True)
+    check("dry-run não muda nada", urls() == before and not any(k.startswith(prefix) for k in keys()))
+
+    partitions.archive(engine)
+    after, stored = urls(), keys()
+    check("exame 1 repontado", after[1] == prefix + "audio/legacy-1.ogg", after[1])
+    check("exame 2 (URL assinada) repontado", after[2] == prefix + "audio/legacy-2.ogg", after[2])
+    check("exames recentes intocados", all(after[i] == before[i] for i in (4, 5, 6, 100)))
+    check("cópias no arquivo", {prefix + "audio/legacy-1.ogg", prefix + "audio/legacy-2.ogg"} <= stored)
+    check("chave quente em uso mantida", "audio/legacy-1.ogg" in stored)
+    check("chave quente sem uso apagada", "audio/legacy-2.ogg" not in stored)
+    with engine.connect() as conn:
+        months = dict(conn.execute(text("SELECT month, audios FROM exam_archive_months")).all())
+    want = {add_months(NOW, -14): 2, add_months(NOW, -13): 0}
+    check("meses registrados em exam_archive_months", months == want, months)
+    partitions.archive(engine)
+    check("segundo archive não refaz nada", urls() == after and keys() == stored)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--reset", action="store_true", help="apaga o schema public antes (banco descartável)")
+    args = ap.parse_args()
+
+    if engine.dialect.name != "postgresql":
+        sys.exit("[check_partitions] DATABASE_URL precisa ser um Postgres")
+    with engine.begin() as conn:
+        if inspect(conn).get_table_names():
+            if not args.reset:
+                sys.exit("[check_partitions] o banco já tem tabelas; use um banco descartável com --reset")
+            reset(conn)
+
+    stub = S3Stub(latency_ms=0)
+    server = serve("127.0.0.1", _s3_port, stub)
+    check = Checks()
+    try:
+        with engine.connect() as conn:
+            print(f"[check_partitions] {conn.execute(text('SELECT version()')).scalar()}")
+        seed_legacy()
+        upgrade(engine)
+        check_converted(check)
+        upgrade(engine)  # de novo: tudo já aplicado
+        check("migrações idempotentes", True)
+        check_default_move(check)
+        check_archive(check, stub)
+    finally:
+        server.shutdown()
+        engine.dispose()
+    print(f"{check.failed} falha(s)")
+    sys.exit(1 if check.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
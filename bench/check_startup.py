@@ -0,0 +1,77 @@
+# bench/check_startup.py
+# Confere o cold start do web: `import app.main` num interpretador novo não pode
+# carregar as dependências pesadas (são importadas no primeiro uso, no worker
+# ou no pool de CPU) e mede o tempo do import, ao lado do piso do framework
+# (fastapi + sqlalchemy + pydantic-settings sozinhos) na mesma máquina.
+#   python -m bench.check_startup [--runs 5] [--app-budget 0.25] [--budget 1.0]
+# Sai com código 1 se algum módulo pesado aparecer, se a parte do app (mediana
+# do import menos o piso) passar de --app-budget ou, com --budget, se o import
+# inteiro passar dele.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ["numpy", "reportlab", "boto3", "botocore", "pyarrow", "jinja2", "httpx", "requests", "psycopg2"]
+
+# roda num diretório com app/static e app/templates (o StaticFiles confere o diretório)
+PROBE = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+os.chdir({cwd!r})
+t0 = time.perf_counter()
+{stmt}
+dt = time.perf_counter() - t0
+print(json.dumps({{"s": dt, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+FRAMEWORK = ("import fastapi, fastapi.staticfiles, sqlalchemy.orm, sqlalchemy.ext.asyncio, "
+             "sqlalchemy.dialects.postgresql, pydantic_settings")
+
+
+def probe(cwd: str, stmt: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(cwd, "startup.db"))
+    code = PROBE.format(root=ROOT, cwd=cwd, heavy=HEAVY, stmt=stmt)
+    out = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--app-budget", type=float, default=0.25, help="segundos acima do piso (mediana)")
+    ap.add_argument("--budget", type=float, default=0.0, help="segundos do import inteiro (mediana; 0 = não confere)")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        for d in ("static", "templates"):
+            os.makedirs(os.path.join(cwd, "app", d))
+        # alternados, para o ruído da máquina cair nos dois igual
+        runs, floor = [], []
+        for _ in range(args.runs):
+            runs.append(probe(cwd, "import app.main"))
+            floor.append(probe(cwd, FRAMEWORK)["s"])
+
+    times = sorted(r["s"] for r in runs)
+    loaded = sorted({m for r in runs for m in r["loaded"]})
+    median = statistics.median(times)
+    base = statistics.median(floor)
+    print("import app.main: " + " ".join(f"{t * 1000:.0f}" for t in times) + f" ms (mediana {median * 1000:.0f} ms)")
+    print("piso do framework: " + " ".join(f"{t * 1000:.0f}" for t in sorted(floor)) + f" ms (mediana {base * 1000:.0f} ms)")
+    print(f"parte do app: {(median - base) * 1000:.0f} ms")
+    print("módulos pesados carregados: " + (", ".join(loaded) if loaded else "nenhum"))
+    failed = (bool(loaded) or median - base > args.app_budget
+              or (args.budget > 0 and median > args.budget))
+    print("FAIL" if failed else "ok")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
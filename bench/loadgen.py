@@ -0,0 +1,189 @@
+# bench/loadgen.py
+# Gerador de carga: webhooks de áudio no formato da Meta + buscas na tela de
+# pacientes, com req/s e p50/p95/p99 por endpoint e o tempo ponta a ponta do
+# exame (POST do webhook -> PDF enviado, medido no stub da Graph API).
+#
+#   python -m bench.stub_graph --port 9001 &
+#   python -m bench.stub_s3 --port 9002 &
+#   META_WABA_API_BASE=http://127.0.0.1:9001 S3_ENDPOINT_URL=http://127.0.0.1:9002 \
+#   AWS_S3_BUCKET=bench AWS_ACCESS_KEY_ID=x AWS_SECRET_ACCESS_KEY=x AWS_DEFAULT_REGION=us-east-1 \
+#     uvicorn app.main:app --port 8000 &
+#   python -m bench.loadgen --patients 200 --webhooks 200 --searches 1000 --concurrency 16
+# Precisa do httpx (pip install httpx), que não faz parte do requirements do app.
+import argparse
+import asyncio
+import math
+import random
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+FIRST_NAMES = ["Ana", "João", "Maria", "José", "Antônio", "Francisca", "Carlos", "Paulo",
+               "Lúcia", "Luiz", "Márcia", "Sérgio", "Conceição", "Raimundo", "Helena"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Conceição", "Araújo", "Pereira",
+              "Gonçalves", "Ferreira", "Rodrigues", "Lima", "Gomes", "Ribeiro", "Simões"]
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+
+    async def call(self, name: str, coro):
+        t0 = time.perf_counter()
+        try:
+            r = await coro
+            ok = r.status_code < 400
+        except httpx.HTTPError:
+            r, ok = None, False
+        self.latencies[name].append(time.perf_counter() - t0)
+        if not ok:
+            self.errors[name] += 1
+        return r
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        print(f"{'endpoint':<18}{'n':>7}{'erros':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for name, lat in self.latencies.items():
+            s = sorted(lat)
+            print(f"{name:<18}{len(s):>7}{self.errors[name]:>7}{len(s) / elapsed:>9.1f}"
+                  f"{percentile(s, 50) * 1000:>9.1f}{percentile(s, 95) * 1000:>9.1f}"
+                  f"{percentile(s, 99) * 1000:>9.1f}")
+
+
+def webhook_payload(from_wa: str, msg_id: str, media_id: str) -> dict:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "BENCH_WABA",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": "5511999999999", "phone_number_id": "bench"},
+                    "contacts": [{"profile": {"name": "Paciente"}, "wa_id": from_wa}],
+                    "messages": [{
+                        "from": from_wa,
+                        "id": msg_id,
+                        "timestamp": str(int(time.time())),
+                        "type": "audio",
+                        "audio": {"mime_type": "audio/ogg; codecs=opus", "id": media_id, "voice": True},
+                    }],
+                },
+            }],
+        }],
+    }
+
+
+async def seed_patients(http: httpx.AsyncClient, n: int, run: str) -> list[dict]:
+    rng = random.Random(run)
+    patients = []
+    for i in range(n):
+        p = {
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "cpf": f"{run[:3]}.{i // 1000:03d}.{i % 1000:03d}-00",
+            "whatsapp": f"55{int(run[:6], 16) % 10**6:06d}{i:05d}",
+        }
+        r = await http.post("/patients", json=p)
+        if r.status_code < 400:
+            patients.append(p)
+    return patients
+
+
+async def run(args):
+    run_id = uuid.uuid4().hex
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base, timeout=60, limits=limits) as http, \
+            httpx.AsyncClient(base_url=args.graph, timeout=10) as graph:
+        patients = await seed_patients(http, args.patients, run_id)
+        if not patients:
+            raise SystemExit("nenhum paciente cadastrado (o app está no ar?)")
+        print(f"[loadgen] {len(patients)} pacientes cadastrados")
+        sent_before = (await graph.get("/_sent", params={"since": 1 << 30})).json()["total"]
+        rec = Recorder()
+
+        # fila de tarefas: webhooks (com reentregas da Meta) intercalados com buscas
+        tasks = []
+        for i in range(args.webhooks):
+            p = patients[i % len(patients)]
+            tasks.append(("webhook", p["whatsapp"], f"wamid.{run_id}.{i}"))
+            if random.random() < args.redelivery:
+                tasks.append(("webhook", p["whatsapp"], f"wamid.{run_id}.{i}"))
+        for _ in range(args.searches):
+            tasks.append(("search", random.choice(patients)["name"].split()[random.randint(0, 2)][:4].lower(), None))
+        random.shuffle(tasks)
+
+        posted: dict[str, list[float]] = defaultdict(list)  # whatsapp -> horários dos POSTs
+        seen_ids: set[str] = set()
+        queue: asyncio.Queue = asyncio.Queue()
+        for t in tasks:
+            queue.put_nowait(t)
+
+        async def worker():
+            while not queue.empty():
+                kind, arg, msg_id = queue.get_nowait()
+                if kind == "webhook":
+                    ts = time.time()
+                    r = await rec.call("POST /webhook/meta",
+                                       http.post("/webhook/meta", json=webhook_payload(arg, msg_id, f"media-{msg_id}")))
+                    if r is not None and r.status_code < 400 and msg_id not in seen_ids:
+                        seen_ids.add(msg_id)
+                        posted[arg].append(ts)
+                else:
+                    await rec.call("GET /web/patients", http.get("/web/patients", params={"q": arg}))
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        rec.report()
+
+        # ponta a ponta: espera os documentos chegarem ao stub da Graph API
+        expected = sum(len(v) for v in posted.values())
+        deadline = time.time() + args.e2e_timeout
+        docs: dict[str, list[float]] = defaultdict(list)
+        failed = 0
+        while time.time() < deadline:
+            sent = (await graph.get("/_sent", params={"since": sent_before})).json()["sent"]
+            docs.clear()
+            failed = 0
+            for s in sent:
+                if s["to"] not in posted:
+                    continue
+                if s["type"] == "document":
+                    docs[s["to"]].append(s["ts"])
+                elif s["type"] == "text":
+                    failed += 1
+            if sum(len(v) for v in docs.values()) + failed >= expected:
+                break
+            await asyncio.sleep(0.5)
+
+        e2e = sorted(d - p for wa, ds in docs.items() for p, d in zip(sorted(posted[wa]), sorted(ds)))
+        print(f"[loadgen] exames: {expected} enviados, {len(e2e)} concluídos, {failed} com aviso de falha")
+        if e2e:
+            print(f"[loadgen] ponta a ponta: p50 {percentile(e2e, 50):.2f}s  "
+                  f"p95 {percentile(e2e, 95):.2f}s  p99 {percentile(e2e, 99):.2f}s  máx {e2e[-1]:.2f}s")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base", default="http://127.0.0.1:8000", help="URL do app")
+    ap.add_argument("--graph", default="http://127.0.0.1:9001", help="URL do stub da Graph API")
+    ap.add_argument("--patients", type=int, default=100)
+    ap.add_argument("--webhooks", type=int, default=100)
+    ap.add_argument("--searches", type=int, default=500)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--redelivery", type=float, default=0.1, help="fração de webhooks reentregues")
+    ap.add_argument("--e2e-timeout", type=float, default=300.0, help="espera máx. pelos laudos (s)")
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# bench/stub_graph.py
+# Stub local da Graph API (WhatsApp Cloud) para testes de carga.
+#   python -m bench.stub_graph --port 9001 --latency-ms 80 --audio-seconds 30
+# e no app:  META_WABA_API_BASE=http://127.0.0.1:9001
+#
+#   GET  /{media_id}            -> {"url": ".../media/{media_id}", ...}
+#   GET  /media/{media_id}      -> o áudio (WAV sintético ou --audio arquivo.ogg)
+#   POST /{phone_id}/messages   -> aceita o envio e registra (to, tipo, horário)
+#   GET  /_sent?since=N         -> envios registrados a partir do índice N
+#   POST /_reset                -> zera os envios
+import argparse
+import io
+import json
+import random
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+
+def synthetic_wav(seconds: float, sample_rate: int = 16000) -> bytes:
+    """Gravação sintética (ruído + jato) em WAV PCM16, decodificável pelo ffmpeg."""
+    from bench.bench_processing import synthetic_pcm
+
+    pcm = synthetic_pcm(seconds / 60.0)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes((np.clip(pcm, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+    return buf.getvalue()
+
+
+class GraphStub:
+    def __init__(self, audio: bytes, mime: str, latency_ms: float, jitter_ms: float, error_rate: float):
+        self.audio = audio
+        self.mime = mime
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.sent: list[dict] = []
+        self.lock = threading.Lock()
+
+    def delay(self):
+        d = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if d > 0:
+            time.sleep(d / 1000.0)
+
+    def record(self, body: dict):
+        with self.lock:
+            self.sent.append({"to": body.get("to"), "type": body.get("type"), "ts": time.time()})
+            return len(self.sent)
+
+
+def make_handler(stub: GraphStub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, como a Graph API
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, obj, status=200):
+            data = json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _maybe_fail(self) -> bool:
+            if stub.error_rate and random.random() < stub.error_rate:
+                self._json({"error": {"message": "stub: falha simulada", "code": 2}}, status=503)
+                return True
+            return False
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            if parts == ["_sent"]:
+                since = int(parse_qs(url.query).get("since", ["0"])[0])
+                with stub.lock:
+                    return self._json({"total": len(stub.sent), "sent": stub.sent[since:]})
+            stub.delay()
+            if self._maybe_fail():
+                return
+            if len(parts) == 2 and parts[0] == "media":
+                self.send_response(200)
+                self.send_header("Content-Type", stub.mime)
+                self.send_header("Content-Length", str(len(stub.audio)))
+                self.end_headers()
+                self.wfile.write(stub.audio)
+                return
+            if len(parts) == 1:
+                host = self.headers.get("Host", "127.0.0.1")
+                return self._json({
+                    "url": f"http://{host}/media/{parts[0]}",
+                    "mime_type": stub.mime,
+                    "file_size": len(stub.audio),
+                    "id": parts[0],
+                })
+            self._json({"error": {"message": "not found"}}, status=404)
+
+        def do_POST(self):
+            parts = [p for p in urlparse(self.path).path.split("/") if p]
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if parts == ["_reset"]:
+                with stub.lock:
+                    stub.sent.clear()
+                return self._json({"ok": True})
+            stub.delay()
+            if self._maybe_fail():
+                return
+            if len(parts) == 2 and parts[1] == "messages":
+                n = stub.record(json.loads(body or b"{}"))
+                return self._json({"messaging_product": "whatsapp", "messages": [{"id": f"wamid.stub{n}"}]})
+            self._json({"error": {"message": "not found"}}, status=404)
+
+    return Handler
+
+
+def serve(host: str, port: int, stub: GraphStub) -> ThreadingHTTPServer:
+    srv = ThreadingHTTPServer((host, port), make_handler(stub))
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9001)
+    ap.add_argument("--latency-ms", type=float, default=50.0, help="latência fixa por chamada")
+    ap.add_argument("--jitter-ms", type=float, default=30.0, help="latência extra aleatória (0..jitter)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fração de respostas 503")
+    ap.add_argument("--audio", help="arquivo servido como mídia (padrão: WAV sintético)")
+    ap.add_argument("--audio-seconds", type=float, default=30.0, help="duração do WAV sintético")
+    args = ap.parse_args()
+
+    if args.audio:
+        audio, mime = open(args.audio, "rb").read(), "audio/ogg"
+    else:
+        audio, mime = synthetic_wav(args.audio_seconds), "audio/wav"
+    stub = GraphStub(audio, mime, args.latency_ms, args.jitter_ms, args.error_rate)
+    srv = serve(args.host, args.port, stub)
+    print(f"[stub_graph] http://{args.host}:{args.port} (mídia de {len(audio) / 1024:.0f} KiB)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# bench/stub_s3.py
+# S3 mínimo em memória (path-style, sem checagem de assinatura) para testes de
+# carga locais. Cobre o que o app usa: PutObject, multipart, Get/HeadObject,
+# CopyObject e DeleteObject.
+#   python -m bench.stub_s3 --port 9002
+# e no app:  S3_ENDPOINT_URL=http://127.0.0.1:9002  AWS_S3_BUCKET=bench
+#            AWS_ACCESS_KEY_ID=x AWS_SECRET_ACCESS_KEY=x AWS_DEFAULT_REGION=us-east-1
+import argparse
+import hashlib
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+class S3Stub:
+    def __init__(self, latency_ms: float):
+        self.latency_ms = latency_ms
+        self.objects: dict[tuple[str, str], tuple[bytes, str]] = {}
+        self.uploads: dict[str, dict[int, bytes]] = {}
+        self.lock = threading.Lock()
+
+    def delay(self):
+        if self.latency_ms:
+            time.sleep(random.uniform(0.5, 1.5) * self.latency_ms / 1000.0)
+
+
+def _decode_aws_chunked(raw: bytes) -> bytes:
+    # corpo "aws-chunked" (checksum em trailer, padrão do botocore recente):
+    # <tam hex>[;chunk-signature=...]\r\n<dados>\r\n ... 0\r\n<trailers>\r\n\r\n
+    out, pos = bytearray(), 0
+    while True:
+        eol = raw.index(b"\r\n", pos)
+        size = int(raw[pos:eol].split(b";", 1)[0], 16)
+        if size == 0:
+            return bytes(out)
+        out += raw[eol + 2:eol + 2 + size]
+        pos = eol + 2 + size + 2
+
+
+def make_handler(stub: S3Stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _target(self):
+            url = urlparse(self.path)
+            bucket, _, key = url.path.lstrip("/").partition("/")
+            return bucket, unquote(key), parse_qs(url.query, keep_blank_values=True)
+
+        def _body(self) -> bytes:
+            if "chunked" in self.headers.get("Transfer-Encoding", ""):
+                raw = bytearray()
+                while True:
+                    size = int(self.rfile.readline().split(b";", 1)[0], 16)
+                    if size == 0:
+                        while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                            pass
+                        break
+                    raw += self.rfile.read(size)
+                    self.rfile.readline()
+                data = bytes(raw)
+            else:
+                data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if "aws-chunked" in self.headers.get("Content-Encoding", "") or \
+                    self.headers.get("x-amz-decoded-content-length"):
+                data = _decode_aws_chunked(data)
+            return data
+
+        def _send(self, status=200, body=b"", headers=None):
+            self.send_response(status)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def _xml(self, body: str, status=200):
+            self._send(status, body.encode(), {"Content-Type": "application/xml"})
+
+        def _not_found(self):
+            self._xml("<Error><Code>NoSuchKey</Code><Message>not found</Message></Error>", 404)
+
+        def do_PUT(self):
+            bucket, key, qs = self._target()
+            data = self._body()
+            stub.delay()
+            if not key:  # CreateBucket
+                return self._send()
+            src = self.headers.get("x-amz-copy-source")
+            if src:  # CopyObject (a classe de armazenamento é ignorada)
+                src_bucket, _, src_key = unquote(src).lstrip("/").partition("/")
+                with stub.lock:
+                    obj = stub.objects.get((src_bucket, src_key))
+                    if obj is None:
+                        return self._not_found()
+                    stub.objects[(bucket, key)] = obj
+                etag = '"%s"' % hashlib.md5(obj[0]).hexdigest()
+                return self._xml(f"<CopyObjectResult><ETag>{etag}</ETag></CopyObjectResult>")
+            etag = '"%s"' % hashlib.md5(data).hexdigest()
+            with stub.lock:
+                if "uploadId" in qs:
+                    stub.uploads[qs["uploadId"][0]][int(qs["partNumber"][0])] = data
+                else:
+                    ctype = self.headers.get("Content-Type", "application/octet-stream")
+                    stub.objects[(bucket, key)] = (data, ctype)
+            self._send(headers={"ETag": etag})
+
+        def do_POST(self):
+            bucket, key, qs = self._target()
+            self._body()
+            stub.delay()
+            if "uploads" in qs:
+                upload_id = uuid.uuid4().hex
+                with stub.lock:
+                    stub.uploads[upload_id] = {}
+                return self._xml(
+                    "<InitiateMultipartUploadResult>"
+                    f"<Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId>"
+                    "</InitiateMultipartUploadResult>"
+                )
+            if "uploadId" in qs:
+                with stub.lock:
+                    parts = stub.uploads.pop(qs["uploadId"][0])
+                    data = b"".join(parts[n] for n in sorted(parts))
+                    stub.objects[(bucket, key)] = (data, "application/octet-stream")
+                return self._xml(
+                    "<CompleteMultipartUploadResult>"
+                    f"<Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                    f"<ETag>\"{hashlib.md5(data).hexdigest()}-{len(parts)}\"</ETag>"
+                    "</CompleteMultipartUploadResult>"
+                )
+            self._send(400)
+
+        def do_DELETE(self):
+            bucket, key, qs = self._target()
+            with stub.lock:
+                if "uploadId" in qs:
+                    stub.uploads.pop(qs["uploadId"][0], None)
+                else:
+                    stub.objects.pop((bucket, key), None)
+            self._send(204)
+
+        def do_GET(self):
+            bucket, key, _ = self._target()
+            stub.delay()
+            obj = stub.objects.get((bucket, key))
+            if obj is None:
+                return self._not_found()
+            data, ctype = obj
+            self._send(body=data, headers={"Content-Type": ctype,
+                                           "ETag": '"%s"' % hashlib.md5(data).hexdigest()})
+
+        def do_HEAD(self):
+            bucket, key, _ = self._target()
+            obj = stub.objects.get((bucket, key))
+            if obj is None:
+                return self._send(404)
+            # HEAD: Content-Length do objeto, sem corpo
+            self.send_response(200)
+            self.send_header("Content-Type", obj[1])
+            self.send_header("Content-Length", str(len(obj[0])))
+            self.end_headers()
+
+    return Handler
+
+
+def serve(host: str, port: int, stub: S3Stub) -> ThreadingHTTPServer:
+    srv = ThreadingHTTPServer((host, port), make_handler(stub))
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9002)
+    ap.add_argument("--latency-ms", type=float, default=20.0, help="latência média por requisição")
+    args = ap.parse_args()
+
+    srv = serve(args.host, args.port, S3Stub(args.latency_ms))
+    print(f"[stub_s3] http://{args.host}:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+// Status dos exames ao vivo (SSE em /web/exams/events): atualiza as linhas da
+// tabela no lugar, sem recarregar a página.
+//   <tbody data-exam-feed [data-patient-id="..."]>, linhas com id="exam-<id>" e
+//   células marcadas com data-field; exame novo usa o <template id="exam-row-template">.
+(function () {
+  var body = document.querySelector("[data-exam-feed]");
+  if (!body || !window.EventSource) return;
+
+  var patientId = body.getAttribute("data-patient-id");
+  var es = new EventSource("/web/exams/events" + (patientId ? "?patient_id=" + patientId : ""));
+
+  var LABELS = {
+    done: ["Concluído", "text-green-700 font-medium"],
+    processing: ["Processando", "text-amber-700 font-medium"],
+    failed: ["Falhou", "text-red-700 font-medium"]
+  };
+
+  function link(href, text) {
+    var a = document.createElement("a");
+    a.className = "text-blue-600 hover:underline";
+    a.href = href;
+    a.target = "_blank";
+    a.textContent = text;
+    return a;
+  }
+
+  function fill(row, e) {
+    row.querySelectorAll("[data-field]").forEach(function (cell) {
+      switch (cell.getAttribute("data-field")) {
+        case "id":
+          cell.textContent = e.id;
+          break;
+        case "patient":
+          var a = link("/web/patients/" + e.patient_id, "Paciente " + e.patient_id);
+          a.removeAttribute("target");
+          cell.replaceChildren(a);
+          break;
+        case "status":
+          var label = LABELS[e.status];
+          if (cell.getAttribute("data-format") === "label" && label) {
+            var span = document.createElement("span");
+            span.className = label[1];
+            span.textContent = label[0];
+            cell.replaceChildren(span);
+          } else {
+            cell.textContent = e.status;
+          }
+          break;
+        case "audio":
+          cell.replaceChildren(e.audio ? link("/exams/" + e.id + "/audio", "abrir") : "—");
+          break;
+        case "report":
+          cell.replaceChildren(e.report ? link("/exams/" + e.id + "/report", "download") : "—");
+          break;
+        case "created":
+          if (!cell.textContent.trim()) cell.textContent = e.at;
+          break;
+        case "updated":
+          cell.textContent = e.at;
+          break;
+      }
+    });
+  }
+
+  es.addEventListener("exam", function (msg) {
+    var e = JSON.parse(msg.data);
+    var row = document.getElementById("exam-" + e.id);
+    if (!row) {
+      var tpl = document.getElementById("exam-row-template");
+      if (!tpl) return;
+      row = tpl.content.firstElementChild.cloneNode(true);
+      row.id = "exam-" + e.id;
+      var empty = body.querySelector("[data-empty]");
+      if (empty) empty.remove();
+      body.insertBefore(row, body.firstChild);
+    }
+    fill(row, e);
+  });
+
+  // eventos perdidos (reinício do servidor, cliente lento): recarrega uma vez
+  es.addEventListener("resync", function () {
+    es.close();
+    location.reload();
+  });
+})();